@@ -1,14 +1,42 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from sqlmodel import select
 
-from api.db import get_session
+from api.db import get_read_session, get_session
 from api.models import User, UserCreate
+from api.utils import TTLCache
+from config import get_settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/token")
 
+T = TypeVar("T")
+
+# Bounded pool for bcrypt, which would otherwise stall the event loop on every login
+password_executor = ThreadPoolExecutor(
+    max_workers=get_settings().PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
+# Password checks admitted to the pool (running or queued), further ones are rejected
+password_slots = threading.BoundedSemaphore(
+    get_settings().PASSWORD_HASH_WORKERS + get_settings().PASSWORD_HASH_QUEUE_LIMIT
+)
+
+# Users resolved from access tokens, by username. Writes to a user row evict it from
+# this process through invalidate_user, other processes see them once it expires.
+user_cache: TTLCache[str, User] = TTLCache(
+    max_size=get_settings().AUTH_CACHE_MAX_SIZE,
+    ttl=get_settings().AUTH_CACHE_TTL_SECONDS,
+)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -18,21 +46,68 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def get_user(username: str) -> User | None:
+async def run_password_task(func: Callable[..., T], *args: Any) -> T:
+    """
+    Run password hashing work on the bounded password pool, off the event loop.
+
+    Raises:
+        HTTPException: If the pool's queue is full.
+    """
+    if not password_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, try again later.",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        password_slots.release()
+
+
+def get_user(username: str, primary: bool = False) -> User | None:
     """
     Retrieve a user from the database by their username.
 
     Args:
         username (str): The username of the user to retrieve.
+        primary (bool): Read from the primary instead of the read replica,
+            for lookups that must see the latest writes.
 
     Returns:
         User | None: The User object corresponding to the given username,
         or None if no such user exists in the database.
     """
-    with get_session() as session:
+    with get_session() if primary else get_read_session() as session:
         return session.exec(select(User).where(User.username == username)).first()
 
 
+def get_cached_user(username: str) -> User | None:
+    """
+    Retrieve a user by their username, going to the database only when the user
+    is not in the in-process user cache. Missing users are not cached.
+
+    Args:
+        username (str): The username of the user to retrieve.
+
+    Returns:
+        User | None: The User object corresponding to the given username,
+        or None if no such user exists in the database.
+    """
+    user = user_cache.get(username)
+    if user is None:
+        user = get_user(username)
+        if user:
+            user_cache.set(username, user)
+    return user
+
+
+def invalidate_user(username: str) -> None:
+    """Drop a user from the user cache, to be called whenever their row is written"""
+    user_cache.delete(username)
+
+
 def check_user(user: UserCreate) -> User | None:
     """
     Check if a user to be created already exists in the database with the given username.
@@ -43,12 +118,13 @@ def check_user(user: UserCreate) -> User | None:
     Returns:
         User | None: The user if found, otherwise None.
     """
-    return get_user(user.username)
+    return get_user(user.username, primary=True)
 
 
-def authenticate_user(username: str, password: str) -> User | None:
+async def authenticate_user(username: str, password: str) -> User | None:
     """
     Authenticates a user by checking if the username and password match a user in the database.
+    The database lookup and the password verification both run off the event loop.
 
     Args:
         username (str): The username of the user to authenticate.
@@ -58,11 +134,12 @@ def authenticate_user(username: str, password: str) -> User | None:
         User | None: The authenticated user object if the username and password match a user in the database,
         otherwise None.
     """
-    user = get_user(username)
+    # Read from the primary so that users can log in right after signing up
+    user = await run_in_threadpool(get_user, username, True)
     if not user:
         return None
 
-    if not verify_password(password, user.hashed_password):
+    if not await run_password_task(verify_password, password, user.hashed_password):
         return None
 
     return user
@@ -1,15 +1,84 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine, ExecutionContext
 from sqlmodel import Session, create_engine
 
-from api import models
+from api import models, partitions
+from api.timing import record_db_statement
 from config import get_settings
 
-engine = create_engine(url=get_settings().POSTGRES_DSN, echo=True)
-session_engine = create_engine(url=get_settings().POSTGRES_DSN, echo=True)
+
+def create_db_engine(dsn: str) -> Engine:
+    """Create an engine with the pool and logging options from the settings"""
+    settings = get_settings()
+    return create_engine(
+        url=dsn,
+        echo=settings.DB_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+
+# Statement times are added to the timings of the request that issued them, if any
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_timer(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: ExecutionContext,
+    executemany: bool,
+) -> None:
+    context._started_at = time.perf_counter()  # type: ignore
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement_time(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: ExecutionContext,
+    executemany: bool,
+) -> None:
+    record_db_statement(time.perf_counter() - context._started_at)  # type: ignore
+
+
+engine = create_db_engine(get_settings().POSTGRES_DSN)
+
+# Read-only work goes to the replica when one is configured, to the primary otherwise
+replica_dsn = get_settings().POSTGRES_REPLICA_DSN
+read_engine = create_db_engine(replica_dsn) if replica_dsn else engine
 
 # Link user-defined SQL models
 models.SQLModel.metadata.create_all(engine)  # type: ignore
 
+# Partitioned tables only accept rows once the partition of their month exists
+with engine.begin() as connection:
+    partitions.create_partitions(
+        connection, get_settings().ENTRY_PARTITION_MONTHS_AHEAD
+    )
+
 
 def get_session() -> Session:
-    """Get a database session"""
-    return Session(session_engine)
+    """Get a database session on the primary"""
+    return Session(engine)
+
+
+def get_read_session() -> Session:
+    """Get a database session for read-only work, served by the replica if there is one"""
+    return Session(read_engine)
+
+
+@contextmanager
+def get_primary_session(session: Session) -> Iterator[Session]:
+    """The session itself if it is on the primary, a new primary session otherwise"""
+    if session.get_bind() is engine:
+        yield session
+    else:
+        with get_session() as primary_session:
+            yield primary_session
@@ -1,19 +1,35 @@
+import time
 from datetime import datetime, timedelta
 from typing import Any, Dict, Generator, Optional
 
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from jose import JWTError, jwt
 from sqlmodel import Session
 
-from api.auth import get_user, oauth2_scheme
-from api.db import session_engine
+from api.auth import get_cached_user, oauth2_scheme, user_cache
+from api.db import engine, read_engine
 from api.models import TokenData, User
+from api.timing import timed
+from api.utils import TTLCache
 from config import get_settings
 
+# Payloads of access tokens that were already verified, by token
+token_cache: TTLCache[str, Dict[str, Any]] = TTLCache(
+    max_size=get_settings().AUTH_CACHE_MAX_SIZE,
+    ttl=get_settings().AUTH_CACHE_TTL_SECONDS,
+)
+
 
 def session_dep() -> Generator[Session, Any, None]:
     """Dependency for FastAPI routes that require a database session"""
-    with Session(session_engine) as session:
+    with Session(engine) as session:
+        yield session
+
+
+def read_session_dep() -> Generator[Session, Any, None]:
+    """Dependency for read-only FastAPI routes, served by the replica if there is one"""
+    with Session(read_engine) as session:
         yield session
 
 
@@ -48,6 +64,32 @@ def create_access_token(
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> Dict[str, Any]:
+    """
+    Decode and verify a JWT access token, reusing the payload of tokens verified before.
+
+    Args:
+        token (str): The encoded JWT access token.
+
+    Returns:
+        Dict[str, Any]: The payload of the token.
+
+    Raises:
+        JWTError: If the token is invalid or expired.
+    """
+    payload = token_cache.get(token)
+    if payload is None:
+        secret = get_settings().JWT_SECRET_KEY
+        algorithm = get_settings().JWT_ALGORITHM
+        payload = jwt.decode(token, secret, algorithms=[algorithm])
+
+        # Never keep a token for longer than it is valid
+        expires_in = payload.get("exp", time.time()) - time.time()
+        if expires_in > 0:
+            token_cache.set(token, payload, ttl=expires_in)
+    return payload
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     """
     Returns the current user based on the provided authentication token.
@@ -67,21 +109,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    with timed("auth"):
+        return await authenticate_token(token, credentials_exception)
+
+
+async def authenticate_token(
+    token: str, credentials_exception: HTTPException
+) -> User:
+    """Resolve the user of a token, raising the given exception if it is not valid"""
     # Decode jwt
     try:
-        secret = get_settings().JWT_SECRET_KEY
-        algorithm = get_settings().JWT_ALGORITHM
-        payload = jwt.decode(token, secret, algorithms=[algorithm])
+        payload = decode_access_token(token)
         username: str = str(payload.get("sub"))  # jwt subject will be user username
         if username is None:
             raise credentials_exception
 
-        token_data = TokenData(username=username)
-    except JWTError:
+        token_data = TokenData(username=username, user_id=payload.get("uid"))
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    # Try to get user from db
-    user = get_user(username=token_data.username)
+    # Signed user ID claims identify the user without touching the users table
+    if token_data.user_id and get_settings().JWT_TRUST_USER_ID_CLAIM:
+        return User(uuid=token_data.user_id, username=token_data.username)
+
+    # Try to get user from cache, or from the db off the event loop
+    user = user_cache.get(token_data.username)
+    if user is None:
+        user = await run_in_threadpool(get_cached_user, token_data.username)
     if user is None:
         raise credentials_exception
 
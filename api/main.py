@@ -1,17 +1,33 @@
 from fastapi import FastAPI, status
 from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from api.middleware import ExceptionHandlerMiddleware
 from api.routers.feed import router as feed_router
 from api.routers.user import router as user_router
+from api.routers.websub import router as websub_router
+from api.timing import TimedRoute
+from metrics import get_registry
 
 app = FastAPI()
+app.router.route_class = TimedRoute
 app.add_middleware(ExceptionHandlerMiddleware)
 
 app.include_router(user_router, prefix="/user", tags=["user"])
 app.include_router(feed_router, prefix="/feed", tags=["feed"])
+app.include_router(websub_router, prefix="/websub", include_in_schema=False)
 
 
 @app.get("/healthcheck")
 def healthcheck() -> Response:
     return Response(status_code=status.HTTP_200_OK)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    """Prometheus metrics of the API processes"""
+    # Set as a header, media_type would get a second charset appended
+    return Response(
+        content=generate_latest(get_registry()),
+        headers={"Content-Type": CONTENT_TYPE_LATEST},
+    )
@@ -1,15 +1,24 @@
 # Database models (sqlmodel with table=true) as well as pure data models are defined here
 
-import json
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Self
 from uuid import UUID, uuid4
 
-from sqlalchemy import Column
-from sqlmodel import JSON, Field, Relationship, SQLModel
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Computed,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    LargeBinary,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel.sql.sqltypes import GUID
 
-from api.utils import get_hash
+from api.utils import get_entry_fingerprint, get_entry_guid
 
 
 class UUIDModel(SQLModel):
@@ -23,7 +32,11 @@ class UUIDModel(SQLModel):
 
 class AuditModel(SQLModel):
     updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
-    hash: Optional[str] = Field(default=None)
+
+
+def get_hash_field() -> Any:
+    """Content fingerprint column, each table needs its own Column instance"""
+    return Field(default=None, sa_column=Column(BigInteger))
 
 
 class User(UUIDModel, table=True):
@@ -32,6 +45,10 @@ class User(UUIDModel, table=True):
     username: str
     hashed_password: str = ""
 
+    # Bumped whenever the user's read state or followed feeds change, it validates
+    # the cached entry listings of the user
+    state_version: int = Field(default=0)
+
 
 class UserCreate(SQLModel):
     username: str
@@ -49,6 +66,7 @@ class Token(SQLModel):
 
 class TokenData(SQLModel):
     username: str
+    user_id: Optional[UUID] = None
 
 
 class Feed(UUIDModel, AuditModel, table=True):
@@ -61,28 +79,54 @@ class Feed(UUIDModel, AuditModel, table=True):
     # Block retries in case of repetitive failures
     should_retry: bool = Field(default=True)
 
+    # HTTP validators of the last fetched body, sent back on the next conditional fetch
+    etag: Optional[str] = Field()
+    last_modified: Optional[str] = Field()
+
+    # Adaptive refresh schedule, learned from how often the feed actually changes
+    next_refresh_at: Optional[datetime] = Field(default_factory=datetime.now, index=True)
+    refresh_interval: Optional[int] = Field()  # In seconds
+
     # Feed elements (optional to allow for lazy population)
     title: Optional[str] = Field()
     link: Optional[str] = Field()
     description: Optional[str] = Field()
     published_at: Optional[datetime] = Field()
-    raw: Optional[dict[str, Any]] = Field(sa_column=Column(JSON))
+    hash: Optional[int] = get_hash_field()
+
+    # Last time entries were written, it validates the cached listings of the feed
+    entries_updated_at: Optional[datetime] = Field(default=None, index=True)
+
+    # Running total of the entries inserted, which the followers' unread counts add
+    entries_inserted: int = Field(default=0)
+
+    # WebSub hub and topic advertised by the feed, and the subscription that lets the
+    # hub push updates: secret signing the pushes, last request sent, end of the lease
+    websub_hub: Optional[str] = Field()
+    websub_topic: Optional[str] = Field()
+    websub_secret: Optional[str] = Field()
+    websub_requested_at: Optional[datetime] = Field()
+    websub_expires_at: Optional[datetime] = Field()
 
     entries: List["FeedEntry"] = Relationship(back_populates="feed")
 
-    def update(self, feed_dict: Dict[str, Any], new_hash: str) -> None:
+    def update(self, feed_dict: Dict[str, Any], new_hash: int) -> None:
         self.hash = new_hash
         self.title = feed_dict.get("title", "")
         self.link = feed_dict.get("link", "")
         self.description = feed_dict.get("description", "")
         self.updated_at = datetime.now()
-        self.raw = feed_dict
 
         # Transform publish date to datetime
         publish_date = feed_dict.get("updated_parsed", None)
         if publish_date:
             self.published_at = datetime(*publish_date[:6])
 
+    @property
+    def is_pushed(self) -> bool:
+        """Whether a hub currently pushes the updates of the feed"""
+        return bool(self.websub_expires_at and self.websub_expires_at > datetime.now())
+
 
 class FeedRead(SQLModel):
     uuid: UUID
@@ -93,7 +137,48 @@ class FeedRead(SQLModel):
     published_at: Optional[datetime]
 
 
+# Weighted document searched by full-text queries, titles rank above descriptions
+ENTRY_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def get_entry_foreign_key(ondelete: Optional[str] = None) -> ForeignKeyConstraint:
+    """Reference to a feed entry, identified by its UUID and its partition key"""
+    return ForeignKeyConstraint(
+        ["feed_entry_id", "entry_created_at"],
+        ["feedentry.uuid", "feedentry.created_at"],
+        ondelete=ondelete,
+    )
+
+
 class FeedEntry(UUIDModel, AuditModel, table=True):
+    # Partitioned by month of creation, see api/partitions.py. Tables holding
+    # per-entry data copy the creation date and are partitioned alike.
+    __table_args__ = (
+        # GUIDs are only unique within a feed. A unique index on a partitioned table
+        # would have to include the partition key, so writers of a feed take a lock
+        # instead. The fingerprint is included so that change detection is an
+        # index-only scan.
+        Index(
+            "ix_feedentry_feed_id_guid",
+            "feed_id",
+            "guid",
+            postgresql_include=["hash"],
+        ),
+        # Matches the listing order, so that every keyset page is an index range scan
+        Index("ix_feedentry_updated_at_uuid", "updated_at", "uuid"),
+        Index("ix_feedentry_feed_id_updated_at_uuid", "feed_id", "updated_at", "uuid"),
+        # Latest published entries of a feed, known to the streaming parser
+        Index("ix_feedentry_feed_id_published_at", "feed_id", "published_at"),
+        Index("ix_feedentry_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # Never changes, unlike updated_at, so that entries stay in their partition
+    created_at: datetime = Field(default_factory=datetime.now, primary_key=True)
+
     feed_id: UUID = Field(foreign_key="feed.uuid")
     feed: Optional[Feed] = Relationship(back_populates="entries")
 
@@ -103,37 +188,53 @@ class FeedEntry(UUIDModel, AuditModel, table=True):
     link: Optional[str] = Field()
     description: Optional[str] = Field()
     published_at: Optional[datetime] = Field()
-    raw: Optional[dict[str, Any]] = Field(sa_column=Column(JSON))
+    hash: Optional[int] = get_hash_field()
 
-    def update(self, entry: Dict[str, Any], new_hash: str) -> None:
+    # Generated by the database on every insert and update, bulk ones included
+    search_vector: Optional[str] = Field(
+        default=None,
+        sa_column=Column(TSVECTOR, Computed(ENTRY_SEARCH_DOCUMENT, persisted=True)),
+    )
+
+    def update(self, entry: Dict[str, Any], new_hash: int) -> None:
         self.hash = new_hash
         self.title = entry.get("title", "")
-        self.guid = entry.get("guid", None)
+        self.guid = get_entry_guid(entry)
         self.link = entry.get("link", "")
         self.description = entry.get("description", "")
         self.updated_at = datetime.now()
-        self.raw = entry
 
         # Transform publish date to datetime
         publish_date = entry.get("updated_parsed", None)
         if publish_date:
             self.published_at = datetime(*publish_date[:6])
 
-    @classmethod
-    def create_from_dict(cls, feed_id: UUID, entry_dict: Dict[str, Any]) -> Self:
+    @staticmethod
+    def values_from_dict(
+        feed_id: UUID, entry_dict: Dict[str, Any], new_hash: int
+    ) -> Dict[str, Any]:
+        """Column values of a feed entry, as written by the bulk upsert"""
         publish_date = entry_dict.get("updated_parsed", None)
         publish_date = datetime(*publish_date[:6]) if publish_date else None
+        now = datetime.now()
+
+        return {
+            "uuid": uuid4(),
+            "feed_id": feed_id,
+            "title": entry_dict.get("title", ""),
+            "guid": get_entry_guid(entry_dict),
+            "link": entry_dict.get("link", ""),
+            "description": entry_dict.get("description", ""),
+            "published_at": publish_date,
+            "created_at": now,
+            "updated_at": now,
+            "hash": new_hash,
+        }
 
-        return cls(
-            feed_id=feed_id,
-            title=entry_dict.get("title", ""),
-            guid=entry_dict.get("guid", None),
-            link=entry_dict.get("link", ""),
-            description=entry_dict.get("description", ""),
-            published_at=publish_date,
-            hash=get_hash(json.dumps(entry_dict)),
-            raw=entry_dict,
-        )
+    @classmethod
+    def create_from_dict(cls, feed_id: UUID, entry_dict: Dict[str, Any]) -> Self:
+        new_hash = get_entry_fingerprint(entry_dict)
+        return cls(**cls.values_from_dict(feed_id, entry_dict, new_hash))
 
 
 class FeedEntryRead(SQLModel):
@@ -145,19 +246,96 @@ class FeedEntryRead(SQLModel):
     published_at: Optional[datetime]
 
 
+class CachedFeedEntry(FeedEntryRead):
+    # Keeps the sync date so that cached entries can be merged and paginated like rows
+    updated_at: Optional[datetime]
+    created_at: Optional[datetime]
+
+
+def get_archive_key(referenced_column: str) -> Any:
+    """Primary key of an archive table, deleted along with the row it archives"""
+    return Field(
+        sa_column=Column(
+            GUID, ForeignKey(referenced_column, ondelete="CASCADE"), primary_key=True
+        )
+    )
+
+
+class FeedRaw(SQLModel, table=True):
+    """
+    Raw feedparser payload of a feed, kept out of the feed table so that reading
+    feeds doesn't pull it along. Compressed with api.utils.compress_payload.
+    """
+
+    feed_id: UUID = get_archive_key("feed.uuid")
+    payload: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
+class FeedEntryRaw(SQLModel, table=True):
+    """Raw feedparser payload of a feed entry, see FeedRaw"""
+
+    __table_args__ = (
+        get_entry_foreign_key(ondelete="CASCADE"),
+        {"postgresql_partition_by": "RANGE (entry_created_at)"},
+    )
+
+    feed_entry_id: UUID = Field(primary_key=True)
+    entry_created_at: datetime = Field(primary_key=True)
+    payload: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
 class FeedUser(SQLModel, table=True):
     # Create a link table with a composite primary key
     feed_id: UUID = Field(foreign_key="feed.uuid", primary_key=True)
     user_id: UUID = Field(foreign_key="users.uuid", primary_key=True)
 
+    # Maintained as entries are read, and reconciled periodically. Entries inserted
+    # since are added when it is read: the feed's entries_inserted past this value
+    unread_count: int = Field(default=0)
+    entries_counted: int = Field(default=0)
+
+
+class FeedUnreadCount(SQLModel):
+    feed_id: UUID
+    unread_count: int
+
 
 class FeedEntryUser(SQLModel, table=True):
+    __table_args__ = (
+        get_entry_foreign_key(),
+        {"postgresql_partition_by": "RANGE (entry_created_at)"},
+    )
+
     # Create a link table with a composite primary key
-    feed_entry_id: UUID = Field(foreign_key="feedentry.uuid", primary_key=True)
+    feed_entry_id: UUID = Field(primary_key=True)
     user_id: UUID = Field(foreign_key="users.uuid", primary_key=True)
+    entry_created_at: datetime = Field(primary_key=True)  # Partition key of the entry
     is_read: bool = Field(index=True, default=False)  # Index for faster filtering
 
 
+class FeedReadMarker(SQLModel, table=True):
+    """
+    Read watermark of a user on a feed: entries synced up to read_until are read,
+    unless a FeedEntryUser row says otherwise. Marking a whole feed as read is a
+    single row instead of one FeedEntryUser per entry.
+    """
+
+    user_id: UUID = Field(foreign_key="users.uuid", primary_key=True)
+    feed_id: UUID = Field(foreign_key="feed.uuid", primary_key=True)
+    read_until: datetime = Field()
+
+
+@dataclass
+class WrittenEntry:
+    """Entry created or updated by a refresh, for the work done once it is committed"""
+
+    uuid: UUID
+    feed_id: UUID
+    created_at: datetime
+    updated_at: datetime
+    created: bool
+
+
 @dataclass
 class ParsedFeed:
     """Basic dataclass for the output of feedparser.parse"""
@@ -0,0 +1,167 @@
+import logging
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+# Feed entries, and the per-entry rows of users and of the raw archive, are split into
+# monthly partitions by the creation date of the entry. Nearly all reads go to the
+# last few weeks, and old months are compacted or dropped whole instead of being
+# deleted row by row. Partitions are named <table>_<YYYY>_<MM>.
+
+# Partitioned tables, tables referencing feed entries first
+ENTRY_TABLES = ("feedentryraw", "feedentryuser", "feedentry")
+
+
+def get_month_start(date: datetime) -> datetime:
+    return datetime(date.year, date.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(table: str, month: datetime) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def create_partition(connection: Connection, month: datetime) -> None:
+    """Create the partitions of a month in every entry table, if missing"""
+    bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    for table in reversed(ENTRY_TABLES):
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {get_partition_name(table, month)} "
+                f"PARTITION OF {table} FOR VALUES {bounds}"
+            )
+        )
+
+
+def create_partitions(connection: Connection, months_ahead: int) -> None:
+    """Create the partitions of the current month and the next ones, if missing"""
+    this_month = get_month_start(datetime.now())
+    for offset in range(months_ahead + 1):
+        create_partition(connection, add_months(this_month, offset))
+
+
+def list_partition_months(connection: Connection, table: str) -> List[datetime]:
+    """Months that currently have a partition of the table, oldest first"""
+    statement = text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+    )
+    months = []
+    for (name,) in connection.execute(statement, {"table": table}):
+        try:
+            months.append(datetime.strptime(name[len(table) + 1 :], "%Y_%m"))
+        except ValueError:
+            continue  # Not one of ours
+    return sorted(months)
+
+
+def drop_partition(connection: Connection, table: str, month: datetime) -> None:
+    name = get_partition_name(table, month)
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    connection.execute(text(f"DROP TABLE {name}"))
+
+
+def has_rows(connection: Connection, table: str, month: datetime) -> bool:
+    name = get_partition_name(table, month)
+    statement = text(f"SELECT EXISTS (SELECT 1 FROM {name})")
+    return bool(connection.execute(statement).scalar())
+
+
+def drop_entry_month(connection: Connection, month: datetime) -> Set[UUID]:
+    """Drop a month from every entry table, returning the feeds that lost entries"""
+    name = get_partition_name("feedentry", month)
+    feed_ids = set(
+        connection.execute(text(f"SELECT DISTINCT feed_id FROM {name}")).scalars()
+    )
+    for table in ENTRY_TABLES:
+        if month in list_partition_months(connection, table):
+            drop_partition(connection, table, month)
+    return feed_ids
+
+
+def compact_entry_month(connection: Connection, month: datetime) -> Set[UUID]:
+    """Delete the entries of a month no user has state on, returning their feeds"""
+    # Their raw payloads go along through the cascading foreign key
+    result = connection.execute(
+        text(
+            "WITH deleted AS ("
+            f"DELETE FROM {get_partition_name('feedentry', month)} entry "
+            "WHERE NOT EXISTS (SELECT 1 FROM feedentryuser "
+            "WHERE feedentryuser.entry_created_at = entry.created_at "
+            "AND feedentryuser.feed_entry_id = entry.uuid) "
+            "RETURNING entry.feed_id"
+            ") SELECT feed_id, count(*) FROM deleted GROUP BY feed_id"
+        )
+    )
+    deleted = dict(result.all())
+    if deleted:
+        logger.info(f"Compacted {sum(deleted.values())} entries of {month:%Y-%m}.")
+    return set(deleted)
+
+
+def expire_partitions(
+    connection: Connection,
+    retention_months: Optional[int],
+    raw_retention_months: Optional[int],
+    mode: str,
+) -> Tuple[int, int, Set[UUID]]:
+    """
+    Apply the retention tiers to the months older than their retention.
+
+    Raw payloads are emptied first, their partitions are kept so that updates of old
+    entries can still archive theirs. Entries are then compacted, keeping those a
+    user has read state on. Months without any user state can be dropped whole
+    instead. Months already expired are left alone by the following runs.
+
+    Args:
+        connection (Connection): Connection to run the maintenance on.
+        retention_months (Optional[int]): Full months of entries to keep, None to keep
+            them forever.
+        raw_retention_months (Optional[int]): Full months of raw payloads to keep,
+            None to keep them as long as their entries.
+        mode (str): "compact" to delete the entries without user state, "drop" to
+            drop the partitions of months without user state and compact the others.
+
+    Returns:
+        Tuple[int, int, Set[UUID]]: Months of raw payloads emptied, months that lost
+        entries, and the feeds those entries belonged to.
+    """
+    this_month = get_month_start(datetime.now())
+    raw_months = entry_months = 0
+    feed_ids: Set[UUID] = set()
+
+    if raw_retention_months is not None:
+        cutoff = add_months(this_month, -raw_retention_months)
+        for month in list_partition_months(connection, "feedentryraw"):
+            if month < cutoff and has_rows(connection, "feedentryraw", month):
+                name = get_partition_name("feedentryraw", month)
+                connection.execute(text(f"TRUNCATE {name}"))
+                raw_months += 1
+
+    if retention_months is None:
+        return raw_months, entry_months, feed_ids
+
+    cutoff = add_months(this_month, -retention_months)
+    for month in list_partition_months(connection, "feedentry"):
+        if month >= cutoff:
+            break
+
+        if mode == "drop" and not has_rows(connection, "feedentryuser", month):
+            month_feed_ids = drop_entry_month(connection, month)
+        else:
+            month_feed_ids = compact_entry_month(connection, month)
+        if month_feed_ids:
+            entry_months += 1
+            feed_ids |= month_feed_ids
+
+    return raw_months, entry_months, feed_ids
@@ -1,44 +1,179 @@
-from typing import Annotated, List, Optional
+from datetime import datetime
+from typing import Annotated, Any, Dict, List, Optional, Set
 from uuid import UUID
 
-from fastapi import APIRouter, Body, Depends, Query, status
-from fastapi.responses import Response
+from fastapi import APIRouter, Body, Depends, Header, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from pydantic import AnyUrl
 from sqlmodel import Session
 
-from api.dependencies import get_current_user, session_dep
-from api.models import Feed, FeedEntry, FeedEntryRead, FeedRead, User
+from api.db import get_primary_session, get_read_session
+from api.dependencies import get_current_user, read_session_dep, session_dep
+from api.models import (
+    Feed,
+    FeedEntryRead,
+    FeedRead,
+    FeedUnreadCount,
+    User,
+)
+from api.responses import RowsResponse
 from api.services import feed_service
+from api.timing import TimedRoute
+from api.utils import encode_cursor, encode_search_cursor, etag_matches, get_etag
 from background import tasks
+from entry_stream import stream_entry_events
+
+router = APIRouter(route_class=TimedRoute)
 
-router = APIRouter()
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Clients may keep listings, but have to revalidate them with If-None-Match
+LISTING_CACHE_CONTROL = "private, no-cache"
 
 
 @router.get(
     "/entries", response_model=List[FeedEntryRead], description="List feed entries"
 )
 def list_feed_entries(
+    request: Request,
     read: Optional[bool] = Query(None, description="Filter by read/unread status"),
     feed_id: Optional[UUID] = Query(None, description="Filter by feed ID"),
     followed_only: Optional[bool] = Query(
         None, description="Filter by followed feeds only"
     ),
+    since: Optional[datetime] = Query(
+        None, description="Only entries first seen since then, the faster the closer"
+    ),
     limit: int = Query(default=50, le=100),
     offset: int = Query(default=0),
+    cursor: Optional[str] = Query(
+        None, description="Continue from the X-Next-Cursor header of the previous page"
+    ),
+    if_none_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(session_dep),
-) -> List[FeedEntry]:
+    session: Session = Depends(read_session_dep),
+) -> Response:
     """List feed filtered entries"""
+    # Validated before anything is listed, so an unchanged listing costs one query.
+    # It is read from the primary: a replica lagging behind the client's own writes
+    # would answer them with a 304.
+    with get_primary_session(session) as primary_session:
+        validator = feed_service.get_listing_validator(
+            primary_session, current_user.uuid, feed_id, followed_only
+        )
+    etag = get_etag(str(current_user.uuid), validator, str(request.query_params))
+    if etag_matches(if_none_match, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL},
+        )
+    if primary_session is not session:
+        # Tag the listing with the state of the replica it is read from, so that a
+        # listing read before the replica caught up is not kept as the current one
+        validator = feed_service.get_listing_validator(
+            session, current_user.uuid, feed_id, followed_only
+        )
+        etag = get_etag(str(current_user.uuid), validator, str(request.query_params))
+
     entries = feed_service.list_feed_entries(
         session=session,
         user_id=current_user.uuid,
         read=read,
         feed_id=feed_id,
         followed_only=followed_only,
+        since=since,
         limit=limit,
         offset=offset,
+        cursor=cursor,
+    )
+
+    headers = {"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL}
+
+    # A full page means there may be more, point the client right after the last entry
+    if len(entries) == limit and entries[-1].updated_at:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            entries[-1].updated_at, entries[-1].uuid
+        )
+    return RowsResponse(entries, FeedEntryRead, headers=headers)
+
+
+@router.get(
+    "/search",
+    response_model=List[FeedEntryRead],
+    description="Search feed entries by title and description",
+)
+def search_feed_entries(
+    q: str = Query(
+        min_length=1, description='Search terms: words, "phrases", or, -excluded'
+    ),
+    read: Optional[bool] = Query(None, description="Filter by read/unread status"),
+    feed_id: Optional[UUID] = Query(None, description="Filter by feed ID"),
+    followed_only: Optional[bool] = Query(
+        None, description="Filter by followed feeds only"
+    ),
+    since: Optional[datetime] = Query(
+        None, description="Only entries first seen since then, the faster the closer"
+    ),
+    limit: int = Query(default=50, le=100),
+    cursor: Optional[str] = Query(
+        None, description="Continue from the X-Next-Cursor header of the previous page"
+    ),
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(read_session_dep),
+) -> Response:
+    """Search feed entries, best matches first"""
+    results = feed_service.search_feed_entries(
+        session=session,
+        user_id=current_user.uuid,
+        text=q,
+        read=read,
+        feed_id=feed_id,
+        followed_only=followed_only,
+        since=since,
+        limit=limit,
+        cursor=cursor,
+    )
+
+    # A full page means there may be more, point the client right after the last entry
+    headers = {}
+    if len(results) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_search_cursor(
+            results[-1].rank, results[-1].uuid
+        )
+    return RowsResponse(results, FeedEntryRead, headers=headers)
+
+
+@router.get(
+    "/unread-counts",
+    response_model=List[FeedUnreadCount],
+    description="Count the unread entries of each followed feed",
+)
+def list_unread_counts(
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(read_session_dep),
+) -> List[FeedUnreadCount]:
+    """Count the unread entries of each followed feed, read from maintained counters"""
+    return feed_service.get_unread_counts(session, current_user.uuid)
+
+
+@router.get("/stream", description="Stream the new entries of followed feeds")
+async def stream_new_entries(
+    current_user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    """Server-sent events with the IDs of the entries created in followed feeds"""
+
+    def load_feed_ids() -> Set[str]:
+        # No connection is held between reloads, streams stay open for hours
+        with get_read_session() as session:
+            feed_ids = feed_service.get_followed_feed_ids(session, current_user.uuid)
+        return {str(feed_id) for feed_id in feed_ids}
+
+    return StreamingResponse(
+        stream_entry_events(load_feed_ids),
+        media_type="text/event-stream",
+        # Proxies would otherwise hold events back to buffer them
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return entries
 
 
 @router.post(
@@ -54,6 +189,7 @@ def follow_feed(
         session=session, user_id=current_user.uuid, feed_url=feed_url
     )
     session.commit()  # Commit early so that task can access the feed
+    feed_service.backfill_timeline(session, current_user.uuid, feed.uuid)
 
     # Submit job to refresh the feed
     tasks.refresh_feed.delay(feed.uuid)
@@ -82,6 +218,45 @@ def mark_entry_read_unread(
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@router.post("/{feed_id}/read", description="Mark a feed as read up to an entry")
+def mark_feed_read(
+    feed_id: UUID,
+    read_until: Annotated[
+        Optional[datetime],
+        Body(
+            embed=True,
+            description="Sync date of the last entry to mark, the newest one if omitted",
+        ),
+    ] = None,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(session_dep),
+) -> Response:
+    """Mark all entries of a feed synced up to a date as read, in one write"""
+    feed_service.mark_feed_read(session, current_user.uuid, feed_id, read_until)
+    session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/entry/{entry_id}/raw", description="Get the raw payload of a feed entry")
+def get_feed_entry_raw(
+    entry_id: UUID,
+    _: User = Depends(get_current_user),
+    session: Session = Depends(read_session_dep),
+) -> Dict[str, Any]:
+    """Get a feed entry as it was last parsed, kept apart from the listed entries"""
+    return feed_service.get_feed_entry_raw(session, entry_id)
+
+
+@router.get("/{feed_id}/raw", description="Get the raw payload of a feed")
+def get_feed_raw(
+    feed_id: UUID,
+    _: User = Depends(get_current_user),
+    session: Session = Depends(read_session_dep),
+) -> Dict[str, Any]:
+    """Get a feed as it was last parsed, kept apart from the feed itself"""
+    return feed_service.get_feed_raw(session, feed_id)
+
+
 @router.post("/{feed_id}/refresh", description="Trigger a forced feed refresh")
 def force_refresh_feed(
     feed_id: str,
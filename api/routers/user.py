@@ -9,9 +9,10 @@ from api.auth import authenticate_user
 from api.dependencies import create_access_token, session_dep
 from api.models import Token, User, UserCreate, UserRead
 from api.services import user_service
+from api.timing import TimedRoute
 from config import get_settings
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.post("/token", response_model=Token)
@@ -19,7 +20,7 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Any:
     """Login using username and password for access token"""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -28,7 +29,8 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=get_settings().JWT_EXPIRY_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": str(user.uuid)},
+        expires_delta=access_token_expires,
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
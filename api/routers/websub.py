@@ -0,0 +1,57 @@
+from typing import List, Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Body, Depends, Header, Query, status
+from fastapi.responses import PlainTextResponse, Response
+from sqlmodel import Session
+
+from api.dependencies import session_dep
+from api.errors import NotFoundError
+from api.models import WrittenEntry
+from api.services import feed_service, websub_service
+from api.timing import TimedRoute
+from background.websub import SIGNATURE_HEADER
+from entry_cache import invalidate_recent_entries
+from entry_stream import publish_new_entries
+
+# Callback routes of WebSub subscriptions, called by hubs rather than by users
+router = APIRouter(route_class=TimedRoute)
+
+
+@router.get("/{feed_id}", response_class=PlainTextResponse)
+def verify_subscription(
+    feed_id: UUID,
+    mode: str = Query(alias="hub.mode"),
+    topic: str = Query(alias="hub.topic"),
+    challenge: str = Query("", alias="hub.challenge"),
+    token: str = Query(""),
+    lease_seconds: Optional[int] = Query(None, alias="hub.lease_seconds"),
+    session: Session = Depends(session_dep),
+) -> str:
+    """Confirm a subscription request to the hub by echoing its challenge"""
+    if not websub_service.verify_intent(
+        session, feed_id, mode, topic, token, lease_seconds
+    ):
+        raise NotFoundError("No such subscription was requested.")
+    session.commit()
+    return challenge
+
+
+@router.post("/{feed_id}", status_code=status.HTTP_202_ACCEPTED)
+def receive_content(
+    feed_id: UUID,
+    body: bytes = Body(media_type="application/xml"),
+    signature: Optional[str] = Header(None, alias=SIGNATURE_HEADER),
+    session: Session = Depends(session_dep),
+) -> Response:
+    """Store the feed content pushed by the hub"""
+    written_entries: List[WrittenEntry] = []
+    written = websub_service.store_pushed_content(
+        session, feed_id, body, signature, written_entries
+    )
+    session.commit()
+    if written:
+        invalidate_recent_entries(feed_id)
+        publish_new_entries(feed_id, [e.uuid for e in written_entries if e.created])
+        feed_service.push_to_timelines(session, written_entries)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
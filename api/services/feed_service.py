@@ -1,14 +1,92 @@
-import json
-from typing import List, Optional
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from uuid import UUID
 
 from pydantic import AnyUrl
+from redis import RedisError
+from sqlalchemy import (
+    REAL,
+    cast,
+    column,
+    delete,
+    false,
+    func,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import ColumnElement
 from sqlmodel import Session, and_, or_, select
 
-from api.db import get_session
+import entry_cache
+import timelines
+from api.auth import invalidate_user
+from api.db import get_primary_session, get_session
 from api.errors import NotFoundError
-from api.models import Feed, FeedEntry, FeedEntryUser, FeedUser, ParsedFeed
-from api.utils import get_hash
+from api.models import (
+    CachedFeedEntry,
+    Feed,
+    FeedEntry,
+    FeedEntryRaw,
+    FeedEntryUser,
+    FeedRaw,
+    FeedReadMarker,
+    FeedUnreadCount,
+    FeedUser,
+    ParsedFeed,
+    User,
+    WrittenEntry,
+)
+from api.utils import (
+    compress_payload,
+    decode_cursor,
+    decode_search_cursor,
+    decompress_payload,
+    get_entry_fingerprint,
+    get_entry_guid,
+    get_feed_fingerprint,
+    to_naive_local,
+)
+from config import get_settings
+from metrics import FEED_ENTRIES_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+# Columns overwritten when an existing entry's content changes
+ENTRY_UPDATE_COLUMNS = (
+    "title",
+    "link",
+    "description",
+    "published_at",
+    "updated_at",
+    "hash",
+)
+
+# Columns returned by the entry writes
+WRITTEN_ENTRY_COLUMNS = (
+    FeedEntry.uuid,
+    FeedEntry.guid,
+    FeedEntry.created_at,
+    FeedEntry.updated_at,
+)
+
+# Columns kept in the recent entries cache, and loaded by listings
+RECENT_ENTRY_COLUMNS = (
+    FeedEntry.uuid,
+    FeedEntry.feed_id,
+    FeedEntry.title,
+    FeedEntry.link,
+    FeedEntry.description,
+    FeedEntry.published_at,
+    FeedEntry.updated_at,
+    FeedEntry.created_at,
+)
 
 
 def follow_feed(session: Session, user_id: UUID, feed_url: AnyUrl) -> Feed:
@@ -25,9 +103,12 @@ def follow_feed(session: Session, user_id: UUID, feed_url: AnyUrl) -> Feed:
         results = session.exec(statement)  # type: ignore
         exists = results.first()
         if not exists:
-            # Add feed to user's feeds
+            # Add feed to user's feeds, counting the entries it already has
             feed_user = FeedUser(feed_id=feed.uuid, user_id=user_id)
             session.add(feed_user)
+            session.flush()
+            reconcile_unread_counts(session, [feed.uuid], user_id=user_id)
+            bump_state_version(session, user_id)
     else:
         # Create empty feed with URL
         feed = Feed(url=feed_url)
@@ -36,6 +117,7 @@ def follow_feed(session: Session, user_id: UUID, feed_url: AnyUrl) -> Feed:
         # Add feed to user's feeds
         feed_user = FeedUser(feed_id=feed.uuid, user_id=user_id)
         session.add(feed_user)
+        bump_state_version(session, user_id)
 
     return feed
 
@@ -52,100 +134,740 @@ def unfollow_feed(user_id: UUID, feed_id: str) -> None:
         if feed_user:
             # Remove feed from user's feeds
             session.delete(feed_user)
+            bump_state_version(session, user_id)
             session.commit()
         else:
             raise NotFoundError("Feed not followed by user.")
 
+    if get_settings().TIMELINES_ENABLED:
+        try:
+            timelines.prune_feed(user_id, UUID(feed_id))
+        except RedisError:
+            # Listings skip the entries of unfollowed feeds until the timeline expires
+            logger.exception("Timelines unavailable, unfollowed feed not pruned")
+
+
+def backfill_timeline(session: Session, user_id: UUID, feed_id: UUID) -> None:
+    """Add the newest entries of a feed the user just followed to their timeline"""
+    if not get_settings().TIMELINES_ENABLED:
+        return
+    entries = load_timeline_entries(session, user_id, feed_id)
+    complete = len(entries) < get_settings().TIMELINE_SIZE
+    try:
+        timelines.push_entries([user_id], entries, complete)
+    except RedisError:
+        logger.exception("Timelines unavailable, followed feed not backfilled")
+
 
 def update_feed(feed: Feed, fetched_feed: ParsedFeed, session: Session) -> None:
     # Update only if feed has changed
     feed_dict = fetched_feed.feed
-    new_hash = get_hash(json.dumps(feed_dict))
+    new_hash = get_feed_fingerprint(feed_dict)
     if feed.hash != new_hash:
         feed.update(feed_dict, new_hash)
         session.add(feed)
 
+        # Archive the raw payload next to the feed
+        feed_raw = session.get(FeedRaw, feed.uuid)
+        if feed_raw:
+            feed_raw.payload = compress_payload(feed_dict)
+        else:
+            feed_raw = FeedRaw(feed_id=feed.uuid, payload=compress_payload(feed_dict))
+        session.add(feed_raw)
+
+
+def get_feed_lock_key(feed_id: UUID) -> int:
+    """Advisory lock key serializing the entry writes of a feed"""
+    return int.from_bytes(feed_id.bytes[:8], "big", signed=True)
+
 
 def update_or_create_feed_entries(
-    feed: Feed, fetched_feed: ParsedFeed, session: Session
-) -> None:
-    # Update or create FeedEntry instances
-    entries_for_update: List[FeedEntry] = []
+    feed: Feed,
+    fetched_feed: ParsedFeed,
+    session: Session,
+    written_entries: Optional[List[WrittenEntry]] = None,
+) -> int:
+    """
+    Write the fetched entries of a feed with a fixed number of statements:
+    one lookup of the stored hashes, one INSERT of the new entries and one
+    UPDATE ... FROM (VALUES ...) of the changed ones.
+
+    Args:
+        written_entries (Optional[List[WrittenEntry]]): Receives the created and
+            updated entries, to be announced once committed.
+
+    Returns:
+        int: Number of entries that were created or updated.
+    """
+    # Index incoming entries by GUID, the last occurrence wins if a feed repeats one
+    incoming_entries: Dict[str, Dict[str, Any]] = {}
     for entry in fetched_feed.entries:
-        # Try to find existing entry based on GUID
-        statement = select(FeedEntry).where(FeedEntry.guid == entry.get("guid"))
-        results = session.exec(statement)
-        existing_entry = results.first()
-
-        # If it exists, compare content hash to see if it needs to be updated
-        if existing_entry:
-            new_hash = get_hash(json.dumps(entry))
-
-            if existing_entry.hash != new_hash:
-                existing_entry.update(entry, new_hash)
-                entries_for_update.append(existing_entry)
-        else:
-            # Does not exist, create new entry
-            entries_for_update.append(
-                FeedEntry.create_from_dict(feed_id=feed.uuid, entry_dict=entry)
+        guid = get_entry_guid(entry)
+        if guid:
+            incoming_entries[guid] = entry
+
+    if not incoming_entries:
+        return 0
+
+    # GUIDs can't be unique across partitions, so concurrent writers of a feed (a
+    # forced refresh next to a scheduled one) wait for each other instead
+    session.execute(select(func.pg_advisory_xact_lock(get_feed_lock_key(feed.uuid))))
+
+    # Load the hashes of every incoming GUID that already exists for this feed
+    statement = select(FeedEntry.guid, FeedEntry.hash).where(
+        FeedEntry.feed_id == feed.uuid,
+        FeedEntry.guid.in_(incoming_entries),  # type: ignore
+    )
+    existing_hashes = dict(session.exec(statement).all())
+
+    # Only write entries that are new or whose content hash changed
+    new_rows: List[Dict[str, Any]] = []
+    changed_rows: List[Dict[str, Any]] = []
+    for guid, entry in incoming_entries.items():
+        new_hash = get_entry_fingerprint(entry)
+        if guid not in existing_hashes:
+            new_rows.append(FeedEntry.values_from_dict(feed.uuid, entry, new_hash))
+        elif existing_hashes[guid] != new_hash:
+            changed_rows.append(FeedEntry.values_from_dict(feed.uuid, entry, new_hash))
+
+    written: List[Any] = []
+    if new_rows:
+        insert_statement = (
+            insert(FeedEntry)
+            .values(new_rows)
+            .returning(*WRITTEN_ENTRY_COLUMNS)
+        )
+        written.extend(session.execute(insert_statement))
+
+        # New entries are unread for every follower. They are counted once on the
+        # feed instead of in every follower's row, which would take a row lock per
+        # follower under the feed's lock, see get_unread_count
+        session.execute(
+            update(Feed)
+            .where(Feed.uuid == feed.uuid)
+            .values(entries_inserted=Feed.entries_inserted + len(new_rows))
+        )
+
+    if changed_rows:
+        # Changed entries get a new sync date, which takes them above the read
+        # watermarks
+        count_resurfacing_entries(
+            session, feed.uuid, [row["guid"] for row in changed_rows]
+        )
+
+        table_columns = FeedEntry.__table__.columns  # type: ignore
+        incoming = values(
+            *(column(c, table_columns[c].type) for c in ENTRY_UPDATE_COLUMNS),
+            column("guid", table_columns["guid"].type),
+            name="incoming",
+        ).data(
+            [
+                tuple(row[c] for c in ENTRY_UPDATE_COLUMNS) + (row["guid"],)
+                for row in changed_rows
+            ]
+        )
+        update_statement = (
+            update(FeedEntry)
+            .where(
+                FeedEntry.feed_id == feed.uuid,
+                FeedEntry.guid == incoming.c.guid,
+                FeedEntry.hash.is_distinct_from(incoming.c.hash),  # type: ignore
+            )
+            # Values of a column that are all NULL would otherwise be typed as text
+            .values(
+                {
+                    c: cast(incoming.c[c], table_columns[c].type)
+                    for c in ENTRY_UPDATE_COLUMNS
+                }
             )
+            .returning(*WRITTEN_ENTRY_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+        written.extend(session.execute(update_statement))
+
+    if written_entries is not None:
+        written_entries.extend(
+            WrittenEntry(
+                uuid=entry_id,
+                feed_id=feed.uuid,
+                created_at=created_at,
+                updated_at=updated_at,
+                created=i < len(new_rows),
+            )
+            for i, (entry_id, _, created_at, updated_at) in enumerate(written)
+        )
+
+    if written:
+        feed.entries_updated_at = datetime.now()
+        session.add(feed)
+
+    FEED_ENTRIES_WRITTEN.labels("inserted").inc(len(new_rows))
+    FEED_ENTRIES_WRITTEN.labels("updated").inc(len(written) - len(new_rows))
+
+    # Archive the raw payloads of the written entries
+    if written:
+        archive_statement = insert(FeedEntryRaw).values(
+            [
+                {
+                    "feed_entry_id": entry_id,
+                    "entry_created_at": created_at,
+                    "payload": compress_payload(incoming_entries[guid]),
+                }
+                for entry_id, guid, created_at, _ in written
+            ]
+        )
+        archive_statement = archive_statement.on_conflict_do_update(
+            index_elements=[FeedEntryRaw.feed_entry_id, FeedEntryRaw.entry_created_at],
+            set_={"payload": archive_statement.excluded.payload},
+        )
+        session.execute(archive_statement)
+
+    # The writes bypass the ORM, so expire any entries already loaded for this feed
+    for loaded_entry in feed.__dict__.get("entries", []):
+        session.expire(loaded_entry)
+    session.expire(feed, ["entries"])
+
+    return len(written)
+
+
+def count_resurfacing_entries(
+    session: Session, feed_id: UUID, guids: Sequence[str]
+) -> None:
+    """
+    Count the entries about to be updated back as unread for the followers whose read
+    watermark covers them, unless they marked them individually.
+    """
+    resurfacing = (
+        select(FeedReadMarker.user_id, func.count().label("entries"))
+        .join(
+            FeedEntry,
+            and_(
+                FeedEntry.feed_id == FeedReadMarker.feed_id,
+                FeedEntry.updated_at <= FeedReadMarker.read_until,  # type: ignore
+            ),
+        )
+        .outerjoin(
+            FeedEntryUser,
+            and_(
+                FeedEntryUser.feed_entry_id == FeedEntry.uuid,
+                FeedEntryUser.entry_created_at == FeedEntry.created_at,
+                FeedEntryUser.user_id == FeedReadMarker.user_id,
+            ),
+        )
+        .where(
+            FeedReadMarker.feed_id == feed_id,
+            FeedEntry.guid.in_(guids),  # type: ignore
+            FeedEntryUser.feed_entry_id == None,  # noqa
+        )
+        .group_by(FeedReadMarker.user_id)
+        .subquery()
+    )
+    session.execute(
+        update(FeedUser)
+        .where(
+            FeedUser.feed_id == feed_id, FeedUser.user_id == resurfacing.c.user_id
+        )
+        .values(unread_count=FeedUser.unread_count + resurfacing.c.entries)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_latest_entry_hashes(
+    session: Session, feed_ids: Sequence[UUID], limit: int
+) -> Dict[UUID, Dict[str, int]]:
+    """
+    Hashes of the most recently published stored entries of each feed, by GUID.
+    These are the entries a newest-first feed lists right after its new ones.
+    """
+    statements = [
+        select(FeedEntry.feed_id, FeedEntry.guid, FeedEntry.hash)
+        .where(FeedEntry.feed_id == feed_id)
+        .order_by(FeedEntry.published_at.desc().nulls_last())  # type: ignore
+        .limit(limit)
+        for feed_id in feed_ids
+    ]
+    entry_hashes: Dict[UUID, Dict[str, int]] = {f: {} for f in feed_ids}
+    if not statements:
+        return entry_hashes
+
+    statement = statements[0] if len(statements) == 1 else union_all(*statements)
+    for row in session.execute(statement):
+        entry_hashes[row.feed_id][row.guid] = row.hash
+    return entry_hashes
 
-    # Bulk update or create entries
-    session.bulk_save_objects(entries_for_update)
+
+def get_feed_raw(session: Session, feed_id: UUID) -> Dict[str, Any]:
+    """Raw feedparser payload of a feed, as last fetched"""
+    feed_raw = session.get(FeedRaw, feed_id)
+    if not feed_raw:
+        raise NotFoundError("Raw feed not found.")
+    return decompress_payload(feed_raw.payload)
+
+
+def get_feed_entry_raw(session: Session, entry_id: UUID) -> Dict[str, Any]:
+    """Raw feedparser payload of a feed entry, as last fetched"""
+    statement = select(FeedEntryRaw).where(FeedEntryRaw.feed_entry_id == entry_id)
+    feed_entry_raw = session.exec(statement).first()
+    if not feed_entry_raw:
+        raise NotFoundError("Raw feed entry not found.")
+    return decompress_payload(feed_entry_raw.payload)
+
+
+def bump_state_version(session: Session, user_id: UUID) -> None:
+    """Invalidate the validators of the user's listings"""
+    result = session.execute(
+        update(User)
+        .where(User.uuid == user_id)
+        .values(state_version=User.state_version + 1)
+        .returning(User.username)
+        .execution_options(synchronize_session=False)
+    )
+    for username in result.scalars():
+        invalidate_user(username)
+
+
+def get_listing_validator(
+    session: Session,
+    user_id: UUID,
+    feed_id: Optional[UUID] = None,
+    followed_only: Optional[bool] = None,
+) -> str:
+    """
+    Cheap stand-in for the content of an entry listing, which changes whenever the
+    listing may: when entries of the feeds it covers are written, and when the
+    user's read state or followed feeds change.
+
+    Returns:
+        str: The user's state version and the last entry write in the feeds covered.
+    """
+    entries_updated_at = select(func.max(Feed.entries_updated_at))
+    if feed_id:
+        entries_updated_at = entries_updated_at.where(Feed.uuid == feed_id)
+    if followed_only:
+        entries_updated_at = entries_updated_at.join(
+            FeedUser,
+            and_(FeedUser.feed_id == Feed.uuid, FeedUser.user_id == user_id),
+        )
+
+    statement = select(
+        select(User.state_version).where(User.uuid == user_id).scalar_subquery(),
+        entries_updated_at.scalar_subquery(),
+    )
+    state_version, last_update = session.execute(statement).one()
+    return f"{state_version}:{last_update.isoformat() if last_update else ''}"
+
+
+def get_read_markers(
+    session: Session, user_id: UUID, feed_ids: Sequence[UUID]
+) -> Dict[UUID, datetime]:
+    """Read watermark of the user on each of the feeds that has one"""
+    statement = select(FeedReadMarker.feed_id, FeedReadMarker.read_until).where(
+        FeedReadMarker.user_id == user_id,
+        FeedReadMarker.feed_id.in_(feed_ids),  # type: ignore
+    )
+    return dict(session.exec(statement).all())
+
+
+def is_below_read_marker(
+    entry: FeedEntry | CachedFeedEntry, read_markers: Dict[UUID, datetime]
+) -> bool:
+    """Whether the entry is read according to the watermark of its feed alone"""
+    read_until = read_markers.get(entry.feed_id)
+    if read_until is None or entry.updated_at is None:
+        return False
+    return entry.updated_at <= read_until
 
 
 def update_feed_entry_user(
     session: Session, user_id: UUID, entry_id: UUID, is_read: bool
 ) -> None:
-    feed_entry = session.get(FeedEntry, entry_id)
+    feed_entry = session.exec(select(FeedEntry).where(FeedEntry.uuid == entry_id)).first()
     if not feed_entry:
         raise NotFoundError("Feed entry not found.")
 
+    read_markers = get_read_markers(session, user_id, [feed_entry.feed_id])
+    feed_entry_user = session.get(
+        FeedEntryUser, (entry_id, user_id, feed_entry.created_at)
+    )
+
+    # Keep the unread count of the feed in step
+    was_read = (
+        feed_entry_user.is_read
+        if feed_entry_user
+        else is_below_read_marker(feed_entry, read_markers)
+    )
+    if is_read != was_read:
+        session.execute(
+            update(FeedUser)
+            .where(FeedUser.feed_id == feed_entry.feed_id, FeedUser.user_id == user_id)
+            .values(unread_count=FeedUser.unread_count + (-1 if is_read else 1))
+        )
+        bump_state_version(session, user_id)
+
+    # Rows are only kept for entries that disagree with the feed's read watermark
+    if is_read == is_below_read_marker(feed_entry, read_markers):
+        if feed_entry_user:
+            session.delete(feed_entry_user)
+        return
+
     # Get or create and then update with is_read value
-    feed_entry_user = session.get(FeedEntryUser, (entry_id, user_id))
     if feed_entry_user:
         feed_entry_user.is_read = is_read
     else:
         feed_entry_user = FeedEntryUser(
-            feed_entry_id=entry_id, user_id=user_id, is_read=is_read
+            feed_entry_id=entry_id,
+            user_id=user_id,
+            entry_created_at=feed_entry.created_at,
+            is_read=is_read,
         )
     session.add(feed_entry_user)
 
 
-def list_feed_entries(
-    session: Session,
-    user_id: UUID,
-    read: Optional[bool] = None,
-    feed_id: Optional[UUID] = None,
-    followed_only: Optional[bool] = None,
-    limit: int = 50,
-    offset: int = 0,
-) -> List[FeedEntry]:
-    """Fetches a list of filtered feed entries."""
-    query = select(FeedEntry)
-    # Filter by read/unread status
-    if read:
-        query = query.join(FeedEntryUser).where(
-            FeedEntryUser.is_read == read, FeedEntryUser.user_id == user_id,
+def mark_feed_read(
+    session: Session, user_id: UUID, feed_id: UUID, read_until: Optional[datetime]
+) -> None:
+    """
+    Mark every entry of a feed synced up to read_until as read, by advancing the
+    user's read watermark on the feed. The watermark never moves back.
+
+    Args:
+        session (Session): The session to write with.
+        user_id (UUID): The user marking the feed as read.
+        feed_id (UUID): The feed to mark as read.
+        read_until (Optional[datetime]): Sync date of the last entry to mark as read,
+            the newest entry of the feed if None.
+
+    Raises:
+        NotFoundError: If the feed does not exist.
+    """
+    if not session.get(Feed, feed_id):
+        raise NotFoundError("Feed not found.")
+
+    if read_until is None:
+        statement = select(func.max(FeedEntry.updated_at)).where(
+            FeedEntry.feed_id == feed_id
+        )
+        read_until = session.exec(statement).one()
+        if read_until is None:
+            return  # Nothing to mark yet
+    else:
+        read_until = to_naive_local(read_until)
+
+    upsert_statement = insert(FeedReadMarker).values(
+        user_id=user_id, feed_id=feed_id, read_until=read_until
+    )
+    upsert_statement = upsert_statement.on_conflict_do_update(
+        index_elements=[FeedReadMarker.user_id, FeedReadMarker.feed_id],
+        set_={
+            "read_until": func.greatest(
+                FeedReadMarker.read_until, upsert_statement.excluded.read_until
+            )
+        },
+    )
+    session.execute(upsert_statement)
+
+    # Per-entry state below the watermark is superseded by it
+    marked_entries = select(FeedEntry.uuid).where(
+        FeedEntry.feed_id == feed_id,
+        FeedEntry.updated_at <= read_until,  # type: ignore
+    )
+    delete_statement = delete(FeedEntryUser).where(
+        FeedEntryUser.user_id == user_id,
+        FeedEntryUser.feed_entry_id.in_(marked_entries),  # type: ignore
+    )
+    session.execute(delete_statement.execution_options(synchronize_session="fetch"))
+
+    # What is left unread is the range above the watermark and a few exceptions
+    reconcile_unread_counts(session, [feed_id], user_id=user_id)
+    bump_state_version(session, user_id)
+
+
+def get_followed_feed_ids(session: Session, user_id: UUID) -> List[UUID]:
+    statement = select(FeedUser.feed_id).where(FeedUser.user_id == user_id)
+    return session.exec(statement).all()
+
+
+def get_feed_followers(
+    session: Session, feed_ids: Sequence[UUID]
+) -> Dict[UUID, List[UUID]]:
+    """IDs of the users following each of the feeds"""
+    statement = select(FeedUser.feed_id, FeedUser.user_id).where(
+        FeedUser.feed_id.in_(feed_ids)  # type: ignore
+    )
+    followers: Dict[UUID, List[UUID]] = {feed_id: [] for feed_id in feed_ids}
+    for feed_id, user_id in session.execute(statement):
+        followers[feed_id].append(user_id)
+    return followers
+
+
+def get_entries_inserted() -> ColumnElement:
+    """Running total of inserted entries of the feed of the FeedUser row in the query"""
+    return (
+        select(Feed.entries_inserted)
+        .where(Feed.uuid == FeedUser.feed_id)
+        .scalar_subquery()
+    )
+
+
+def get_unread_count() -> ColumnElement:
+    """
+    Unread count of the FeedUser row in the query.
+
+    Read state changes move the stored count, the entries inserted since it was last
+    recounted are added from the feed's running total.
+    """
+    return FeedUser.unread_count + get_entries_inserted() - FeedUser.entries_counted
+
+
+def get_unread_counts(session: Session, user_id: UUID) -> List[FeedUnreadCount]:
+    """Unread counts of the feeds the user follows, one row per feed"""
+    statement = select(
+        FeedUser.feed_id, get_unread_count().label("unread_count")
+    ).where(FeedUser.user_id == user_id)
+    return [FeedUnreadCount(**row._mapping) for row in session.execute(statement)]
+
+
+def reconcile_unread_counts(
+    session: Session, feed_ids: Sequence[UUID], user_id: Optional[UUID] = None
+) -> int:
+    """
+    Recount the unread entries of the followers of some feeds, or of a single one.
+
+    Returns:
+        int: Number of counts that had drifted and were corrected.
+    """
+    # Unread entries of the feed of the FeedUser row being updated
+    unread_entries = select(func.count()).select_from(FeedEntry)
+    unread_entries = filter_read_state(
+        session, unread_entries, FeedUser.user_id, read=False, feed_id=None
+    )
+    unread_count = unread_entries.where(
+        FeedEntry.feed_id == FeedUser.feed_id
+    ).scalar_subquery()
+
+    statement = (
+        update(FeedUser)
+        .where(
+            FeedUser.feed_id.in_(feed_ids),  # type: ignore
+            get_unread_count() != unread_count,
         )
-    elif read is False:
-        # Return FeedEntries that do not have a FeedEntryUser record
-        # This generalizes well if other columns were present (ex. is_starred)
+        .values(unread_count=unread_count, entries_counted=get_entries_inserted())
+        .execution_options(synchronize_session="fetch")
+    )
+    if user_id:
+        statement = statement.where(FeedUser.user_id == user_id)
+    return session.execute(statement).rowcount
+
+
+def get_entry_key(entry: FeedEntry | CachedFeedEntry) -> Tuple[datetime, UUID]:
+    """Sort key of an entry in listings, the same one the keyset cursor encodes"""
+    return entry.updated_at or datetime.min, entry.uuid
+
+
+def load_recent_entries(
+    session: Session, feed_ids: Sequence[UUID]
+) -> Dict[UUID, List[CachedFeedEntry]]:
+    """Load the newest entries of each feed, in one statement of per-feed index scans"""
+    cache_size = get_settings().ENTRY_CACHE_SIZE
+    statements = [
+        select(*RECENT_ENTRY_COLUMNS)
+        .where(FeedEntry.feed_id == feed_id)
+        .order_by(FeedEntry.updated_at.desc(), FeedEntry.uuid.desc())  # type: ignore
+        .limit(cache_size)
+        for feed_id in feed_ids
+    ]
+    statement = statements[0] if len(statements) == 1 else union_all(*statements)
+
+    recent_entries: Dict[UUID, List[CachedFeedEntry]] = {f: [] for f in feed_ids}
+    for row in session.execute(statement):
+        recent_entries[row.feed_id].append(CachedFeedEntry(**row._mapping))
+    for entries in recent_entries.values():
+        entries.sort(key=get_entry_key, reverse=True)
+    return recent_entries
+
+
+def get_recent_entries(
+    session: Session, feed_ids: Sequence[UUID]
+) -> List[List[CachedFeedEntry]]:
+    """Read-through access to the recent entries cache, newest entries first"""
+    versions, recent_entries = entry_cache.get_recent_entries(feed_ids)
+
+    missing = [i for i, entries in enumerate(recent_entries) if entries is None]
+    if missing:
+        missing_feed_ids = [feed_ids[i] for i in missing]
+
+        # Loaded entries are cached under the versions read above, which refreshes
+        # bump once committed on the primary: a lagging replica would have them cached
+        # without the refreshed entries for the whole TTL
+        with get_primary_session(session) as primary_session:
+            loaded = load_recent_entries(primary_session, missing_feed_ids)
+        entry_cache.set_recent_entries(
+            missing_feed_ids,
+            [versions[i] for i in missing],
+            [loaded[feed_id] for feed_id in missing_feed_ids],
+        )
+        for i in missing:
+            recent_entries[i] = loaded[feed_ids[i]]
+
+    return [entries or [] for entries in recent_entries]
+
+
+def filter_read_state(
+    session: Session,
+    query: Any,
+    user_id: UUID | ColumnElement,
+    read: bool,
+    feed_id: Optional[UUID],
+) -> Any:
+    """
+    Filter entries by the user's read state: the watermark of their feed, unless the
+    entry has its own FeedEntryUser row. These rows are few, so the outer join is cheap.
+    The user is either an ID or the user column of an enclosing statement.
+    """
+    # Matching the partition keys lets the join go partition by partition
+    query = query.outerjoin(
+        FeedEntryUser,
+        and_(
+            FeedEntryUser.feed_entry_id == FeedEntry.uuid,
+            FeedEntryUser.entry_created_at == FeedEntry.created_at,
+            FeedEntryUser.user_id == user_id,
+        ),
+    )
+
+    below_marker: ColumnElement
+    above_marker: ColumnElement
+    if feed_id:
+        # A single watermark is a plain bound on the feed's sync date index
+        read_until = get_read_markers(session, user_id, [feed_id]).get(feed_id)
+        if read_until is None:
+            below_marker, above_marker = false(), true()
+        else:
+            below_marker = FeedEntry.updated_at <= read_until  # type: ignore
+            above_marker = FeedEntry.updated_at > read_until  # type: ignore
+    else:
         query = query.outerjoin(
-            FeedEntryUser,
-            # Define ON condition
+            FeedReadMarker,
             and_(
-                FeedEntryUser.feed_entry_id == FeedEntry.uuid,
-                FeedEntryUser.user_id == user_id,
+                FeedReadMarker.feed_id == FeedEntry.feed_id,
+                FeedReadMarker.user_id == user_id,
             ),
-        ).where(
-            # Fetch all the records that have is_read=False or have no FeedEntryUser record
-            # This way we can support FeedEntryUsers with multiple metadata columns
+        )
+        below_marker = FeedEntry.updated_at <= FeedReadMarker.read_until  # type: ignore
+        above_marker = or_(
+            FeedReadMarker.read_until == None,  # noqa
+            FeedEntry.updated_at > FeedReadMarker.read_until,  # type: ignore
+        )
+
+    no_entry_state = FeedEntryUser.feed_entry_id == None  # noqa
+    if read:
+        return query.where(
             or_(
-                FeedEntryUser.is_read == False,  # noqa
-                FeedEntryUser.feed_entry_id == None,  # noqa
+                FeedEntryUser.is_read == True,  # noqa
+                and_(no_entry_state, below_marker),
             )
         )
+    return query.where(
+        or_(
+            FeedEntryUser.is_read == False,  # noqa
+            and_(no_entry_state, above_marker),
+        )
+    )
+
+
+def list_recent_feed_entries(
+    session: Session,
+    user_id: UUID,
+    read: Optional[bool],
+    feed_id: Optional[UUID],
+    followed_only: Optional[bool],
+    limit: int,
+    offset: int,
+    cursor_key: Optional[Tuple[datetime, UUID]],
+    since: Optional[datetime] = None,
+) -> Optional[List[CachedFeedEntry]]:
+    """
+    Serve a listing of one or more feeds from the recent entries cache,
+    merging the user's read state afterwards.
+
+    Returns:
+        Optional[List[CachedFeedEntry]]: The page, or None if it reaches past the
+        cached entries and has to be served from the database.
+    """
+    feed_ids: List[UUID] = [feed_id] if feed_id else []
+    if followed_only:
+        followed_feed_ids = get_followed_feed_ids(session, user_id)
+        if feed_id:
+            feed_ids = [feed_id] if feed_id in followed_feed_ids else []
+        else:
+            feed_ids = list(followed_feed_ids)
+
+    if not feed_ids:
+        return []
+    if len(feed_ids) > get_settings().ENTRY_CACHE_MAX_FEEDS:
+        return None
+
+    recent_entries = get_recent_entries(session, feed_ids)
+
+    # A full cache left out entries older than its oldest one, which may belong on the page
+    cache_size = get_settings().ENTRY_CACHE_SIZE
+    floor = max(
+        (get_entry_key(e[-1]) for e in recent_entries if len(e) >= cache_size),
+        default=None,
+    )
+
+    # Merge the feeds in listing order and apply the cursor
+    candidates = sorted(
+        (entry for entries in recent_entries for entry in entries),
+        key=get_entry_key,
+        reverse=True,
+    )
+    if cursor_key:
+        candidates = [e for e in candidates if get_entry_key(e) < cursor_key]
+
+    if since:
+        # Entries cached before creation dates were kept can't be placed
+        if any(e.created_at is None for e in candidates):
+            return None
+        candidates = [e for e in candidates if e.created_at >= since]  # type: ignore
+
+        # Entries left out of the cache were created before its floor
+        if floor is not None and floor[0] < since:
+            floor = None
+
+    # Merge the read state of the candidates, per-entry state overrides the watermarks
+    if read is not None and candidates:
+        read_markers = get_read_markers(session, user_id, feed_ids)
+        statement = select(FeedEntryUser.feed_entry_id, FeedEntryUser.is_read).where(
+            FeedEntryUser.user_id == user_id,
+            FeedEntryUser.feed_entry_id.in_([e.uuid for e in candidates]),  # type: ignore
+        )
+        entry_read_state = dict(session.exec(statement).all())
+        candidates = [
+            e
+            for e in candidates
+            if entry_read_state.get(e.uuid, is_below_read_marker(e, read_markers))
+            == read
+        ]
+
+    page = candidates[offset : offset + limit]
+    if floor is not None and (len(page) < limit or get_entry_key(page[-1]) < floor):
+        return None
+    return page
+
+
+def filter_feed_entries(
+    session: Session,
+    query: Any,
+    user_id: UUID,
+    read: Optional[bool],
+    feed_id: Optional[UUID],
+    followed_only: Optional[bool],
+    since: Optional[datetime] = None,
+) -> Any:
+    """Apply the listing filters to a query of feed entries"""
+    # Filter by read/unread status
+    if read is not None:
+        query = filter_read_state(session, query, user_id, read, feed_id)
 
     # Filter by feed ID
     if feed_id:
@@ -155,15 +877,296 @@ def list_feed_entries(
     if followed_only:
         query = query.join(
             FeedUser,
-            FeedUser.feed_id == FeedEntry.feed_id,
-            FeedUser.user_id == user_id,
+            and_(FeedUser.feed_id == FeedEntry.feed_id, FeedUser.user_id == user_id),
+        )
+
+    # Filter by creation date, which skips the partitions of older months
+    if since:
+        query = query.where(FeedEntry.created_at >= since)  # type: ignore
+
+    return query
+
+
+def push_to_timelines(session: Session, entries: Sequence[WrittenEntry]) -> None:
+    """
+    Fan committed entry writes out to the timelines of the feeds' followers.
+
+    Timelines are a best effort, failing to push does not fail the refresh. Pushes
+    lost that way show up once the timeline expires and is built again.
+    """
+    if not entries or not get_settings().TIMELINES_ENABLED:
+        return
+
+    entries_by_feed: Dict[UUID, List[WrittenEntry]] = defaultdict(list)
+    for entry in entries:
+        entries_by_feed[entry.feed_id].append(entry)
+    followers = get_feed_followers(session, list(entries_by_feed))
+    try:
+        for feed_id, feed_entries in entries_by_feed.items():
+            timelines.push_entries(followers[feed_id], feed_entries)
+    except RedisError:
+        logger.exception("Timelines unavailable, entries not pushed")
+
+
+def evict_expired_entries(session: Session, feed_ids: Sequence[UUID]) -> None:
+    """
+    Evict the cached entries of feeds that lost entries to retention, once committed.
+
+    Their recent entries are loaded again, and the timelines of their followers are
+    built again, instead of listing entries that no longer exist.
+    """
+    if not feed_ids:
+        return
+
+    try:
+        for feed_id in feed_ids:
+            entry_cache.invalidate_recent_entries(feed_id)
+        if get_settings().TIMELINES_ENABLED:
+            followers = get_feed_followers(session, feed_ids)
+            user_ids = {user_id for users in followers.values() for user_id in users}
+            timelines.delete_timelines(list(user_ids))
+    except RedisError:
+        logger.exception("Cache unavailable, expired entries not evicted")
+
+
+def load_timeline_entries(
+    session: Session, user_id: UUID, feed_id: Optional[UUID] = None
+) -> List[WrittenEntry]:
+    """The newest entries of the feeds a user follows, or of one of them, newest first"""
+    statement = select(*WRITTEN_ENTRY_COLUMNS, FeedEntry.feed_id)
+    if feed_id:
+        statement = statement.where(FeedEntry.feed_id == feed_id)
+    else:
+        statement = statement.join(
+            FeedUser,
+            and_(FeedUser.feed_id == FeedEntry.feed_id, FeedUser.user_id == user_id),
+        )
+    statement = statement.order_by(
+        FeedEntry.updated_at.desc(), FeedEntry.uuid.desc()  # type: ignore
+    ).limit(get_settings().TIMELINE_SIZE)
+    return [
+        WrittenEntry(
+            uuid=row.uuid,
+            feed_id=row.feed_id,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+            created=False,
+        )
+        for row in session.execute(statement)
+    ]
+
+
+def list_timeline_entries(
+    session: Session,
+    user_id: UUID,
+    read: Optional[bool],
+    limit: int,
+    offset: int,
+    cursor_key: Optional[Tuple[datetime, UUID]],
+    since: Optional[datetime] = None,
+) -> Optional[List[Row]]:
+    """
+    Serve the followed-only listing from the user's timeline, building it first if
+    it expired. Listed entries are hydrated by primary key, with the listing filters
+    applied, so entries of unfollowed feeds or that were archived are skipped.
+
+    Returns:
+        Optional[List[Row]]: The page, or None if it reaches below the timeline's
+        floor, or the timeline is being built, and has to be served from the database.
+    """
+    floor = timelines.get_floor(user_id)
+    if floor is None and timelines.start_build(user_id):
+        # Entries committed before the build was claimed were not pushed to it, so it
+        # is loaded from the primary: a lagging replica would leave them out for good
+        with get_primary_session(session) as primary_session:
+            entries = load_timeline_entries(primary_session, user_id)
+        complete = len(entries) < get_settings().TIMELINE_SIZE
+        timelines.finish_build(user_id, entries, complete)
+        floor = timelines.get_floor(user_id)
+    if floor is None or floor == timelines.BUILDING:
+        return None
+
+    # Entries at or below the floor may be missing. Entries are synced after they are
+    # created, so the ones created since the page's start date are all there if it
+    # is above the floor.
+    floor_score = timelines.parse_score(floor)
+    min_score: int | str = f"({floor_score}"
+    complete = floor_score == 0
+    if since and timelines.get_score(since) > floor_score:
+        min_score = timelines.get_score(since)
+        complete = True
+    max_score: int | str = "+inf"
+    if cursor_key:
+        max_score = timelines.get_score(cursor_key[0])
+
+    wanted = offset + limit
+    chunk_size = max(wanted, 200)
+    rows: List[Row] = []
+    start = 0
+    while len(rows) < wanted:
+        members = timelines.read_timeline(
+            user_id, max_score, min_score, start, chunk_size
+        )
+        start += len(members)
+
+        pairs = []
+        for member, score in members:
+            entry_id, _, created_at = timelines.parse_member(member)
+            if cursor_key and score == max_score and entry_id >= cursor_key[1]:
+                continue
+            if since and created_at < since:
+                continue
+            pairs.append((entry_id, created_at))
+
+        if pairs:
+            query = select(*RECENT_ENTRY_COLUMNS).where(
+                tuple_(FeedEntry.uuid, FeedEntry.created_at).in_(pairs)
+            )
+            query = filter_feed_entries(
+                session, query, user_id, read, None, True, since
+            )
+            query = query.order_by(
+                FeedEntry.updated_at.desc(), FeedEntry.uuid.desc()  # type: ignore
+            )
+            rows.extend(session.exec(query).all())
+
+        if len(members) < chunk_size:
+            # Past the oldest trusted entry, the rest of the page may be missing
+            if len(rows) < wanted and not complete:
+                return None
+            break
+
+    return rows[offset:wanted]
+
+
+def list_feed_entries(
+    session: Session,
+    user_id: UUID,
+    read: Optional[bool] = None,
+    feed_id: Optional[UUID] = None,
+    followed_only: Optional[bool] = None,
+    limit: int = 50,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+) -> Sequence[Row | CachedFeedEntry]:
+    """Fetches a list of filtered feed entries, starting after the cursor if given.
+
+    Listings of one feed or of the followed feeds are served from the recent
+    entries cache when the page falls within it, the followed-only listing from
+    the user's timeline first when timelines are enabled.
+    """
+    cursor_key = decode_cursor(cursor) if cursor else None
+    since = to_naive_local(since) if since else None
+
+    if followed_only and not feed_id and get_settings().TIMELINES_ENABLED:
+        try:
+            timeline_entries = list_timeline_entries(
+                session, user_id, read, limit, offset, cursor_key, since
+            )
+            if timeline_entries is not None:
+                return timeline_entries
+        except RedisError:
+            logger.exception("Timelines unavailable, reading from database")
+
+    if (feed_id or followed_only) and offset + limit <= get_settings().ENTRY_CACHE_SIZE:
+        try:
+            cached_entries = list_recent_feed_entries(
+                session,
+                user_id,
+                read,
+                feed_id,
+                followed_only,
+                limit,
+                offset,
+                cursor_key,
+                since,
+            )
+            if cached_entries is not None:
+                return cached_entries
+        except RedisError:
+            logger.exception("Recent entries cache unavailable, reading from database")
+
+    # Plain rows of the columns listings need, without ORM instances to build
+    query = select(*RECENT_ENTRY_COLUMNS)
+    query = filter_feed_entries(
+        session, query, user_id, read, feed_id, followed_only, since
+    )
+
+    # Continue right after the cursor, the row comparison follows the ordering below.
+    # Entries are never synced before they are created, so the cursor also bounds
+    # the creation date, which skips the partitions of later months.
+    if cursor_key:
+        query = query.where(
+            tuple_(FeedEntry.updated_at, FeedEntry.uuid) < tuple_(*cursor_key),
+            FeedEntry.created_at <= cursor_key[0],  # type: ignore
         )
 
     # Order by last update of feed entry (not published date, but sync date)
-    query = query.order_by(FeedEntry.updated_at.desc())  # type: ignore
+    # The UUID breaks ties so that keyset pagination never skips or repeats entries
+    query = query.order_by(
+        FeedEntry.updated_at.desc(), FeedEntry.uuid.desc()  # type: ignore
+    )
 
     # Limit and offset
     query = query.limit(limit).offset(offset)
     entries = session.exec(query).all()
 
     return entries
+
+
+def search_feed_entries(
+    session: Session,
+    user_id: UUID,
+    text: str,
+    read: Optional[bool] = None,
+    feed_id: Optional[UUID] = None,
+    followed_only: Optional[bool] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+) -> List[Row]:
+    """
+    Full-text search of entry titles and descriptions, best matches first.
+
+    Args:
+        session (Session): The session to read with.
+        user_id (UUID): The user searching, for the read and followed filters.
+        text (str): Search terms, in web search syntax ("quoted phrases", or, -word).
+        read (Optional[bool]): Filter by read/unread status.
+        feed_id (Optional[UUID]): Filter by feed ID.
+        followed_only (Optional[bool]): Filter by followed feeds only.
+        limit (int): Maximum number of results.
+        cursor (Optional[str]): Continue right after the result it points to.
+        since (Optional[datetime]): Only search entries created since then.
+
+    Returns:
+        List[Row]: The columns of the matching entries, and their rank.
+
+    Raises:
+        ValidationError: If the cursor is malformed.
+    """
+    since = to_naive_local(since) if since else None
+    ts_query = func.websearch_to_tsquery("english", text)
+    rank = func.ts_rank_cd(FeedEntry.search_vector, ts_query)
+
+    # The match goes through the GIN index, only the matches are ranked
+    query = (
+        select(*RECENT_ENTRY_COLUMNS, rank.label("rank"))
+        .where(FeedEntry.search_vector.op("@@")(ts_query))  # type: ignore
+    )
+    query = filter_feed_entries(
+        session, query, user_id, read, feed_id, followed_only, since
+    )
+
+    if cursor:
+        # Ranks are REAL, compare at that precision so that ties stay ties
+        cursor_rank, cursor_uuid = decode_search_cursor(cursor)
+        query = query.where(
+            tuple_(rank, FeedEntry.uuid) < tuple_(cast(cursor_rank, REAL), cursor_uuid)
+        )
+
+    query = query.order_by(
+        rank.desc(), FeedEntry.uuid.desc()  # type: ignore
+    ).limit(limit)
+    return session.execute(query).all()
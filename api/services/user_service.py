@@ -1,7 +1,7 @@
 from fastapi import HTTPException
 from sqlmodel import Session
 
-from api.auth import check_user, get_password_hash
+from api.auth import check_user, get_password_hash, invalidate_user
 from api.models import User, UserCreate
 
 
@@ -16,4 +16,5 @@ def create_user(session: Session, user_in: UserCreate) -> User:
         username=user_in.username, hashed_password=get_password_hash(user_in.password),
     )
     session.add(new_user)
+    invalidate_user(new_user.username)
     return new_user
@@ -0,0 +1,125 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import UUID
+
+from sqlmodel import Session
+
+from api.errors import ValidationError
+from api.models import Feed, WrittenEntry
+from background.parsing import get_stream_limits
+from background.pipeline import parse_feed_body, store_pushed_feed
+from background.websub import is_requested, verify_callback_token, verify_signature
+from config import get_settings
+from metrics import WEBSUB_PUSHES
+
+logger = logging.getLogger(__name__)
+
+
+def verify_intent(
+    session: Session,
+    feed_id: UUID,
+    mode: str,
+    topic: str,
+    token: str,
+    lease_seconds: Optional[int] = None,
+) -> bool:
+    """
+    Check a request a hub is verifying with us, and start confirmed subscriptions.
+
+    Args:
+        session (Session): Database session, committed by the caller.
+        feed_id (UUID): Feed of the callback URL.
+        mode (str): "subscribe", "unsubscribe", or "denied" when the hub refuses.
+        topic (str): Topic URL of the request.
+        token (str): Token of the callback URL, subscriptions are only confirmed or
+            denied by the hub we gave it to.
+        lease_seconds (Optional[int]): Lease granted by the hub to a subscription,
+            capped to the lease we request.
+
+    Returns:
+        bool: Whether the request is one we want, the hub is answered with its
+        challenge if so, and with a 404 otherwise.
+    """
+    feed = session.get(Feed, feed_id)
+    if not feed:
+        return False
+
+    # Only the subscription to the feed's current topic is wanted
+    wanted = (
+        feed.websub_hub is not None
+        and feed.websub_secret is not None
+        and feed.websub_topic == topic
+    )
+    if mode == "unsubscribe":
+        return not wanted
+    if not wanted or mode not in ("subscribe", "denied"):
+        return False
+    if not verify_callback_token(feed.websub_secret, token):  # type: ignore
+        return False
+
+    now = datetime.now()
+    if mode == "denied":
+        # Polling as usual, a new request is sent after a while
+        feed.websub_requested_at = now
+        feed.websub_expires_at = None
+    else:
+        # Only a pending request is confirmed, and only once
+        if not is_requested(feed, now):
+            return False
+        feed.websub_requested_at = None
+
+        # Never longer than what we ask for, however long the hub claims it is
+        max_lease_seconds = get_settings().WEBSUB_LEASE_SECONDS
+        lease_seconds = min(lease_seconds or max_lease_seconds, max_lease_seconds)
+        feed.websub_expires_at = now + timedelta(seconds=lease_seconds)
+    session.add(feed)
+    return True
+
+
+def store_pushed_content(
+    session: Session,
+    feed_id: UUID,
+    body: bytes,
+    signature: Optional[str],
+    written_entries: Optional[List[WrittenEntry]] = None,
+) -> int:
+    """
+    Store the content a hub pushed for a feed, if signed with the feed's secret.
+
+    Pushes that are not signed properly are ignored without telling the sender, as
+    the WebSub specification recommends.
+
+    Args:
+        session (Session): Database session, committed by the caller.
+        feed_id (UUID): Feed of the callback URL.
+        body (bytes): The pushed feed document.
+        signature (Optional[str]): The X-Hub-Signature header.
+        written_entries (Optional[List[WrittenEntry]]): Receives the created and
+            updated entries, to be announced once committed.
+
+    Returns:
+        int: Number of entries created or updated. Once committed, those have to be
+        invalidated in the recent entries cache.
+
+    Raises:
+        ValidationError: If the signed body is not a valid feed.
+    """
+    feed = session.get(Feed, feed_id)
+    if not feed or not feed.websub_secret:
+        WEBSUB_PUSHES.labels("rejected").inc()
+        return 0
+    if not verify_signature(feed.websub_secret, body, signature):
+        logger.info(f"{feed_id} ignored a push with an invalid signature.")
+        WEBSUB_PUSHES.labels("rejected").inc()
+        return 0
+
+    try:
+        fetched_feed, _ = parse_feed_body(body, get_stream_limits())
+    except ValueError:
+        WEBSUB_PUSHES.labels("invalid").inc()
+        raise ValidationError("Pushed content is not a valid feed.")
+
+    written = store_pushed_feed(feed, fetched_feed, session, written_entries)
+    WEBSUB_PUSHES.labels("stored").inc()
+    return written
@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Dict, Iterator, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+
+@dataclass
+class RequestTimings:
+    """Time spent in each phase of a request, in seconds"""
+
+    started_at: float = field(default_factory=time.perf_counter)
+    phases: Dict[str, float] = field(default_factory=dict)
+    db_statements: int = 0
+    endpoint_finished_at: Optional[float] = None
+    response_started_at: Optional[float] = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def start_response(self) -> None:
+        """Close the request phases once the response headers are about to be sent"""
+        self.response_started_at = time.perf_counter()
+
+        # Anything between the endpoint returning and the headers going out is the
+        # validation and encoding of the returned value
+        if self.endpoint_finished_at is not None:
+            self.add(
+                "serialize", self.response_started_at - self.endpoint_finished_at
+            )
+
+    @property
+    def total(self) -> float:
+        return (self.response_started_at or time.perf_counter()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Phase durations in milliseconds"""
+        timings = {phase: round(s * 1000, 3) for phase, s in self.phases.items()}
+        timings["total"] = round(self.total * 1000, 3)
+        return timings
+
+    def to_server_timing(self) -> str:
+        """Format the phases as a Server-Timing header value"""
+        metrics = []
+        for phase, duration in self.to_dict().items():
+            metric = f"{phase};dur={duration}"
+            if phase == "db":
+                metric += f';desc="{self.db_statements} statements"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+# Timings of the request being handled, set by the middleware. Threadpool calls run
+# in a copy of the context, which still points to the same RequestTimings object.
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_timing(phase: str, seconds: float) -> None:
+    """Add time to a phase of the current request, if there is one"""
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def record_db_statement(seconds: float) -> None:
+    """Count a database statement and its time towards the current request"""
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add("db", seconds)
+        timings.db_statements += 1
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Time the enclosed block as a phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+def mark_endpoint_finished() -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        timings.endpoint_finished_at = time.perf_counter()
+
+
+class TimedRoute(APIRoute):
+    """
+    Route that marks when its endpoint returns, so that the time FastAPI spends
+    validating and serializing the result can be told apart from the endpoint itself.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        endpoint = self.dependant.call
+        assert endpoint is not None, "dependant.call must be a function"
+
+        # FastAPI runs sync endpoints in the threadpool, so the wrapper must keep
+        # the endpoint's flavour
+        if asyncio.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+                result = await endpoint(*args, **kwargs)  # type: ignore
+                mark_endpoint_finished()
+                return result
+
+        else:
+
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args: Any, **kwargs: Any) -> Any:
+                result = endpoint(*args, **kwargs)  # type: ignore
+                mark_endpoint_finished()
+                return result
+
+        self.dependant.call = timed_endpoint
+        return super().get_route_handler()
@@ -1,6 +1,163 @@
+import base64
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Generic, Mapping, Optional, Sequence, Tuple, TypeVar
+from uuid import UUID
+
 import xxhash
 
+from api.errors import ValidationError
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+# Fields that make up the content of feeds and entries, anything else the publisher
+# sends (build dates, tracking parameters in detail dicts, ...) is not compared
+FEED_FINGERPRINT_FIELDS = ("title", "link", "description")
+ENTRY_FINGERPRINT_FIELDS = ("title", "link", "description", "updated_parsed")
+
+# Separates the fields, so that moving text from one field to the next changes the hash
+FIELD_SEPARATOR = "\x1f"
+
+
+def normalize_field(value: Any) -> str:
+    """Order-stable text form of a field, with insignificant whitespace removed"""
+    if value is None:
+        return ""
+    if isinstance(value, time.struct_time):
+        return datetime(*value[:6]).isoformat()
+    return " ".join(str(value).split())
+
+
+def get_fingerprint(values: Mapping[str, Any], fields: Sequence[str]) -> int:
+    """Fast content hash of the given fields, as a signed 64 bit integer for BIGINT columns"""
+    canonical = FIELD_SEPARATOR.join(normalize_field(values.get(f)) for f in fields)
+    return int.from_bytes(xxhash.xxh64_digest(canonical), "big", signed=True)
+
+
+def get_feed_fingerprint(feed_dict: Mapping[str, Any]) -> int:
+    return get_fingerprint(feed_dict, FEED_FINGERPRINT_FIELDS)
+
+
+def get_entry_fingerprint(entry: Mapping[str, Any]) -> int:
+    return get_fingerprint(entry, ENTRY_FINGERPRINT_FIELDS)
+
+
+def compress_payload(payload: Mapping[str, Any]) -> bytes:
+    """Serialize a raw feedparser payload for the archive tables"""
+    return zlib.compress(json.dumps(payload).encode())
+
+
+def decompress_payload(data: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(data))
+
+
+def get_entry_guid(entry: Dict[str, Any]) -> Optional[str]:
+    """Identifier of a feed entry, falling back to its link when the feed has no GUIDs"""
+    return entry.get("guid") or entry.get("link")
+
+
+def to_naive_local(value: datetime) -> datetime:
+    """Convert an aware datetime to the naive local times stored in the database"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def get_etag(*parts: str) -> str:
+    """Weak entity tag identifying a response by what it was computed from"""
+    return f'W/"{xxhash.xxh64_hexdigest(FIELD_SEPARATOR.join(parts))}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the entity tag, weakly compared"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def encode_cursor(updated_at: datetime, uuid: UUID) -> str:
+    """Opaque pagination cursor pointing right after the given entry"""
+    payload = json.dumps([updated_at.isoformat(), str(uuid)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Decode a pagination cursor produced by encode_cursor.
+
+    Raises:
+        ValidationError: If the cursor is malformed.
+    """
+    try:
+        updated_at, uuid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(updated_at), UUID(uuid)
+    except (ValueError, TypeError) as e:
+        raise ValidationError("Invalid cursor.") from e
+
+
+def encode_search_cursor(rank: float, uuid: UUID) -> str:
+    """Opaque pagination cursor pointing right after the given search result"""
+    payload = json.dumps([rank, str(uuid)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, UUID]:
+    """
+    Decode a pagination cursor produced by encode_search_cursor.
+
+    Raises:
+        ValidationError: If the cursor is malformed.
+    """
+    try:
+        rank, uuid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), UUID(uuid)
+    except (ValueError, TypeError) as e:
+        raise ValidationError("Invalid cursor.") from e
+
+
+class TTLCache(Generic[K, V]):
+    """Thread-safe in-process LRU cache whose items expire after a time to live"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used item if the cache is full"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key: K) -> None:
+        with self._lock:
+            self._items.pop(key, None)
 
-def get_hash(s: str) -> str:
-    """Fast hashing function"""
-    return xxhash.xxh64(s).hexdigest()
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
@@ -1,13 +1,55 @@
+import os
+from typing import Any
+
 from celery.app.base import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_shutdown, worker_ready
 
 from config import get_settings
+from metrics import mark_process_dead, start_metrics_server
 
 app = Celery("tasks", broker=get_settings().REDIS_DSN)
 
+# Batch refreshes parse on a process pool, which the children of Celery's default
+# prefork pool can't start: they go to workers of their own running --pool=solo
+PIPELINE_QUEUE = "pipeline"
+app.conf.task_routes = {
+    "background.tasks.refresh_feeds_batch": {"queue": PIPELINE_QUEUE},
+}
+
 app.conf.beat_schedule = {
-    "refresh-every-5-minutes": {
-        "task": "background.tasks.refresh_all_feeds",
-        "schedule": crontab(minute="*/5"),
+    # Feeds carry their own jittered refresh times, each tick only picks the due ones
+    "refresh-due-feeds-every-minute": {
+        "task": "background.tasks.refresh_due_feeds",
+        "schedule": crontab(minute="*"),
+    },
+    # Unread counts are maintained incrementally, this corrects whatever drifted
+    "reconcile-unread-counts-every-hour": {
+        "task": "background.tasks.reconcile_unread_counts",
+        "schedule": crontab(minute=30),
+    },
+    # Subscribes feeds to the WebSub hubs they advertise, and renews the leases
+    "renew-websub-subscriptions-every-ten-minutes": {
+        "task": "background.tasks.renew_websub_subscriptions",
+        "schedule": crontab(minute="*/10"),
+    },
+    # Keeps entry partitions ahead of time and applies the retention settings
+    "maintain-entry-partitions-every-day": {
+        "task": "background.tasks.maintain_entry_partitions",
+        "schedule": crontab(hour=3, minute=15),
     },
 }
+
+
+@worker_ready.connect
+def start_worker_metrics_server(**kwargs: Any) -> None:
+    """Export the metrics of the worker and its pool processes once the worker is up"""
+    port = get_settings().WORKER_METRICS_PORT
+    if port:
+        start_metrics_server(port)
+
+
+@worker_process_shutdown.connect
+def remove_worker_process_metrics(**kwargs: Any) -> None:
+    """Drop the live series of a pool process as it exits, recycled ones included"""
+    mark_process_dead(os.getpid())
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+from uuid import UUID
+
+import httpx
+import requests
+
+FETCH_TIMEOUT_SECONDS = 30
+
+
+@dataclass
+class FetchRequest:
+    """Feed to download, with the validators returned by its previous fetch"""
+
+    feed_id: UUID
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Hashes of its latest stored entries by GUID, for the streaming parser
+    entry_hashes: Optional[Dict[str, int]] = None
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a conditional HTTP GET for a feed"""
+
+    status: int
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    max_age: Optional[int] = None  # Seconds the server allows the response to be cached
+    elapsed: float = 0.0  # Seconds from sending the request to reading the body
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def content_length(self) -> int:
+        return len(self.body)
+
+
+def get_conditional_headers(
+    etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> Dict[str, str]:
+    """Build the request validators from the ones the server returned last time"""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def get_max_age(headers: Mapping[str, str]) -> Optional[int]:
+    """Freshness lifetime in seconds from the Cache-Control or Expires headers"""
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name.lower() == "max-age" and value.strip().isdigit():
+            return int(value)
+
+    expires = headers.get("Expires")
+    if not expires:
+        return None
+    try:
+        expires_at = parsedate_to_datetime(expires)
+    except (TypeError, ValueError):
+        return None
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return max(0, int((expires_at - datetime.now(timezone.utc)).total_seconds()))
+
+
+def build_fetch_result(
+    status: int, body: bytes, headers: Mapping[str, str], elapsed: float = 0.0
+) -> FetchResult:
+    return FetchResult(
+        status=status,
+        body=body,
+        etag=headers.get("ETag"),
+        last_modified=headers.get("Last-Modified"),
+        max_age=get_max_age(headers),
+        elapsed=elapsed,
+    )
+
+
+def fetch_feed(
+    url: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    timeout: float = FETCH_TIMEOUT_SECONDS,
+) -> FetchResult:
+    """
+    Download a feed, sending the validators from the previous fetch so that
+    unchanged feeds can be answered with a bodyless 304 Not Modified.
+
+    Raises:
+        requests.HTTPError: If the server answers with an error status.
+    """
+    started_at = time.perf_counter()
+    response = requests.get(
+        url, headers=get_conditional_headers(etag, last_modified), timeout=timeout
+    )
+    response.raise_for_status()
+    return build_fetch_result(
+        response.status_code,
+        response.content,
+        response.headers,
+        elapsed=time.perf_counter() - started_at,
+    )
+
+
+async def fetch_feed_async(
+    client: httpx.AsyncClient,
+    url: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> FetchResult:
+    """
+    Async counterpart of fetch_feed, sharing the connection pool of the given client.
+
+    Raises:
+        httpx.HTTPStatusError: If the server answers with an error status.
+    """
+    started_at = time.perf_counter()
+    response = await client.get(
+        url, headers=get_conditional_headers(etag, last_modified)
+    )
+    # httpx treats anything outside 2xx as an error, including 304
+    if response.status_code != 304:
+        response.raise_for_status()
+    return build_fetch_result(
+        response.status_code,
+        response.content,
+        response.headers,
+        elapsed=time.perf_counter() - started_at,
+    )
+
+
+async def fetch_feeds(
+    fetch_requests: Sequence[FetchRequest],
+    concurrency: int,
+    timeout: float,
+    results: asyncio.Queue[Tuple[FetchRequest, FetchResult | Exception]],
+) -> None:
+    """
+    Download many feeds concurrently on the running event loop.
+
+    A request keeps its concurrency slot until its result is queued, so a bounded
+    queue that nobody drains holds back further downloads.
+
+    Args:
+        fetch_requests (Sequence[FetchRequest]): Feeds to download.
+        concurrency (int): Maximum number of requests in flight at the same time.
+        timeout (float): Deadline in seconds for each request, from connect to last byte.
+        results (asyncio.Queue): Receives each request paired with its result, or with
+            the exception it failed with, as soon as it completes.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        timeout=timeout, limits=limits, follow_redirects=True
+    ) as client:
+
+        async def fetch_one(fetch_request: FetchRequest) -> None:
+            async with semaphore:
+                result: FetchResult | Exception
+                try:
+                    result = await asyncio.wait_for(
+                        fetch_feed_async(
+                            client,
+                            fetch_request.url,
+                            etag=fetch_request.etag,
+                            last_modified=fetch_request.last_modified,
+                        ),
+                        timeout=timeout,
+                    )
+                except Exception as e:
+                    result = e
+                await results.put((fetch_request, result))
+
+        await asyncio.gather(*(fetch_one(r) for r in fetch_requests))
@@ -0,0 +1,357 @@
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape
+
+from feedparser import FeedParserDict
+from feedparser.html import _cp1252
+from feedparser.mixin import _FeedParserMixin
+from feedparser.sanitizer import _sanitize_html
+from feedparser.urls import make_safe_absolute_uri, resolve_relative_uris
+
+from api.models import ParsedFeed
+from api.utils import get_entry_fingerprint, get_entry_guid
+from config import get_settings
+
+# Streaming alternative to feedparser for RSS 2.0 and Atom documents. Entries are read
+# one element at a time and discarded once converted, and parsing stops as soon as a
+# limit is reached or the feed goes back to entries that are already stored unchanged.
+# Entries use feedparser's key names and values, so that the rest of the refresh is
+# unchanged and fingerprints do not depend on the parser: markup goes through
+# feedparser's own URI resolver and sanitizer.
+
+ATOM_NAMESPACE = "{http://www.w3.org/2005/Atom}"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
+# Bytes handed to the XML parser at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedFeedError(Exception):
+    """Document is not a format the streaming parser handles, use feedparser instead"""
+
+
+@dataclass(frozen=True)
+class StreamLimits:
+    max_bytes: int
+    max_entries: int
+    # Stop after this many consecutive known and unchanged entries, 0 to read them all
+    stop_after_known: int
+
+
+def get_stream_limits() -> Optional[StreamLimits]:
+    """Limits of the streaming parser from the settings, None if it is disabled"""
+    settings = get_settings()
+    if not settings.REFRESH_STREAMING_PARSER:
+        return None
+    return StreamLimits(
+        max_bytes=settings.REFRESH_STREAM_MAX_BYTES,
+        max_entries=settings.REFRESH_STREAM_MAX_ENTRIES,
+        stop_after_known=settings.REFRESH_STREAM_STOP_AFTER_KNOWN,
+    )
+
+
+def get_local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def get_child_text(element: ET.Element, *names: str) -> Optional[str]:
+    """Text of the first child with one of the given local names, in order of preference"""
+    texts = {get_local_name(child.tag): child.text for child in element}
+    for name in names:
+        if texts.get(name) is not None:
+            return (texts[name] or "").strip()
+    return None
+
+
+def set_base(element: ET.Element, parent: Optional[ET.Element]) -> None:
+    """Resolve the element's xml:base against its parent's, as feedparser does"""
+    parent_base = parent.get(XML_BASE, "") if parent is not None else ""
+    base = element.get(XML_BASE) or parent_base
+    if parent_base:
+        base = make_safe_absolute_uri(parent_base, base) or parent_base
+    else:
+        base = urljoin(parent_base, base)
+    if base:
+        element.set(XML_BASE, base)
+
+
+def resolve_uri(element: ET.Element, uri: str) -> str:
+    return urljoin(element.get(XML_BASE, ""), uri)
+
+
+def serialize_xhtml(element: ET.Element) -> str:
+    """Markup of the element's children, without namespaces"""
+    pieces = [escape(element.text or "")]
+    for child in element:
+        tag = get_local_name(child.tag)
+        attributes = "".join(
+            f' {name}="{escape(value, {chr(34): "&quot;"})}"'
+            for name, value in child.items()
+            if not name.startswith("{")
+        )
+        pieces.append(f"<{tag}{attributes}>{serialize_xhtml(child)}</{tag}>")
+        pieces.append(escape(child.tail or ""))
+    return "".join(pieces)
+
+
+def get_content_type(element: ET.Element, default: str) -> str:
+    content_type = _FeedParserMixin.map_content_type(element.get("type", default))
+    if len(element) and not content_type.endswith("xml"):
+        # Declared as escaped markup, but it is inline markup
+        return "application/xhtml+xml"
+    return content_type
+
+
+def get_text_construct(element: ET.Element, default_type: str, is_atom: bool) -> str:
+    """
+    Value of a title, summary or content element as feedparser stores it.
+
+    Args:
+        element (ET.Element): The element.
+        default_type (str): Its content type when it has no type attribute.
+        is_atom (bool): Whether the document is Atom, RSS plain text may be HTML.
+
+    Returns:
+        str: The text, or the markup with its URIs resolved and sanitized.
+    """
+    content_type = get_content_type(element, default_type)
+    if content_type != "application/xhtml+xml":
+        value = (element.text or "").strip()
+    else:
+        div = element[0] if len(element) == 1 else None
+        if (
+            is_atom
+            and div is not None
+            and get_local_name(div.tag) == "div"
+            and not (element.text or "").strip()
+            and not (div.tail or "").strip()
+        ):
+            # Atom wraps xhtml content in a div, which is not part of the content
+            value = serialize_xhtml(div).strip()
+        else:
+            value = serialize_xhtml(element).strip()
+
+    if not is_atom and content_type == "text/plain":
+        if _FeedParserMixin.looks_like_html(value):
+            content_type = "text/html"
+    if content_type in _FeedParserMixin.html_types:
+        base = element.get(XML_BASE, "")
+        value = resolve_relative_uris(value, base, "utf-8", content_type)
+        value = _sanitize_html(value, "utf-8", content_type)
+
+    # Same fix-ups of double encoded UTF-8 and Windows-1252 characters as feedparser
+    try:
+        value = value.encode("iso-8859-1").decode("utf-8")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        pass
+    return value.translate(_cp1252)
+
+
+def parse_date(value: Optional[str]) -> Optional[time.struct_time]:
+    """Parse an RFC 822 (RSS) or RFC 3339 (Atom) date into a UTC struct_time"""
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            date = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.utctimetuple()
+
+
+def is_alternate_link(element: ET.Element) -> bool:
+    """Atom links without a rel are alternate links, RSS links have no rel at all"""
+    if get_local_name(element.tag) != "link":
+        return False
+    return element.get("rel", "alternate") == "alternate"
+
+
+def get_atom_link(element: ET.Element) -> Optional[str]:
+    for child in element:
+        if is_alternate_link(child) and child.get("href"):
+            return resolve_uri(child, child.get("href", ""))
+    return None
+
+
+def set_dates(
+    values: FeedParserDict, published: Optional[str], updated: Optional[str]
+) -> None:
+    """Set the date strings and their parsed values under feedparser's keys"""
+    for key, value in (("published", published), ("updated", updated)):
+        if value:
+            values[key] = value
+            parsed = parse_date(value)
+            if parsed:
+                values[f"{key}_parsed"] = parsed
+
+
+def parse_entry(element: ET.Element) -> FeedParserDict:
+    """Convert an RSS item or Atom entry element"""
+    entry = FeedParserDict()
+    is_atom = element.tag.startswith(ATOM_NAMESPACE)
+    children: Dict[str, ET.Element] = {
+        get_local_name(child.tag): child for child in element
+    }
+
+    if "title" in children:
+        entry["title"] = get_text_construct(children["title"], "text/plain", is_atom)
+
+    if is_atom:
+        link = get_atom_link(element)
+    elif children.get("link") is not None:
+        link = resolve_uri(children["link"], (children["link"].text or "").strip())
+    else:
+        link = None
+
+    guid_element = children.get("id" if is_atom else "guid")
+    if guid_element is not None and guid_element.text:
+        guid = guid_element.text.strip()
+        if guid_element.get("isPermaLink", "true") == "true":
+            # Permalink GUIDs are URIs, and stand in for a missing link
+            guid = resolve_uri(guid_element, guid)
+            link = link or guid
+        entry["id"] = guid
+
+    if link:
+        entry["link"] = link
+
+    # A summary or description takes precedence over the full content
+    summary = children.get("summary")
+    if summary is not None:
+        entry["summary"] = get_text_construct(summary, "text/plain", is_atom)
+    elif children.get("description") is not None:
+        description = children["description"]
+        entry["summary"] = get_text_construct(description, "text/html", is_atom)
+    else:
+        content = children.get("content" if is_atom else "encoded")
+        default_type = "text/plain" if is_atom else "text/html"
+        if content is not None and get_content_type(content, default_type) in (
+            "text/plain",
+            *_FeedParserMixin.html_types,
+        ):
+            entry["summary"] = get_text_construct(content, default_type, is_atom)
+
+    if is_atom:
+        set_dates(
+            entry,
+            get_child_text(element, "published"),
+            get_child_text(element, "updated"),
+        )
+    else:
+        set_dates(entry, get_child_text(element, "pubDate"), None)
+
+    return entry
+
+
+def iter_elements(body: bytes, max_bytes: int) -> Iterator[Tuple[str, ET.Element]]:
+    """Feed the document to an incremental XML parser and yield its start/end events"""
+    parser = ET.XMLPullParser(events=("start", "end"))
+    end = min(len(body), max_bytes)
+    for offset in range(0, end, CHUNK_SIZE):
+        parser.feed(body[offset : min(offset + CHUNK_SIZE, end)])
+        yield from parser.read_events()  # type: ignore
+
+    # A document cut at max_bytes is left unclosed, its complete entries are kept
+    if end == len(body):
+        parser.close()
+        yield from parser.read_events()  # type: ignore
+
+
+def parse_feed_stream(
+    body: bytes, limits: StreamLimits, entry_hashes: Mapping[str, int] = {}
+) -> ParsedFeed:
+    """
+    Parse an RSS 2.0 or Atom document incrementally.
+
+    Args:
+        body (bytes): The document.
+        limits (StreamLimits): Caps on the document size and number of entries, and
+            the run of known entries after which the rest of the document is skipped.
+        entry_hashes (Mapping[str, int]): Fingerprint of the stored entries by GUID.
+
+    Returns:
+        ParsedFeed: The feed metadata and the entries read, in document order.
+
+    Raises:
+        UnsupportedFeedError: If the document is neither RSS 2.0 nor Atom.
+        xml.etree.ElementTree.ParseError: If the document is not well-formed.
+    """
+    feed = FeedParserDict()
+    entries: List[FeedParserDict] = []
+    stack: List[ET.Element] = []
+
+    # Skipping the rest of the document is only safe when it is sorted newest first
+    newest_first = True
+    previous_date: Optional[time.struct_time] = None
+    known_run = 0
+
+    for event, element in iter_elements(body, limits.max_bytes):
+        name = get_local_name(element.tag)
+        if event == "start":
+            if not stack and name not in ("rss", "feed"):
+                raise UnsupportedFeedError(name)
+            set_base(element, stack[-1] if stack else None)
+            stack.append(element)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            continue
+
+        parent_name = get_local_name(parent.tag)
+        if name in ("item", "entry") and parent_name in ("channel", "feed"):
+            entry = parse_entry(element)
+            entries.append(entry)
+
+            # Done with the element, drop it to keep memory flat
+            parent.remove(element)
+
+            # Read directly, feedparser warns about its updated/published fallback
+            date = dict.get(entry, "updated_parsed") or dict.get(
+                entry, "published_parsed"
+            )
+            if not date or (previous_date and date > previous_date):
+                newest_first = False
+            previous_date = date
+
+            stored_hash = entry_hashes.get(get_entry_guid(entry) or "")
+            if stored_hash is not None and stored_hash == get_entry_fingerprint(entry):
+                known_run += 1
+            else:
+                known_run = 0
+
+            if len(entries) >= limits.max_entries:
+                break
+            if newest_first and 0 < limits.stop_after_known <= known_run:
+                break
+
+        elif parent_name in ("channel", "feed") and not entries:
+            # Feed metadata comes before the entries
+            is_atom = element.tag.startswith(ATOM_NAMESPACE)
+            if name == "title":
+                feed["title"] = get_text_construct(element, "text/plain", is_atom)
+            elif is_alternate_link(element):
+                link = element.get("href") or (element.text or "").strip()
+                feed["link"] = resolve_uri(element, link)
+            elif name == "link" and element.get("rel") in ("hub", "self"):
+                # WebSub discovery, Atom links also appear in RSS channels
+                links = feed.setdefault("links", [])
+                links.append({"rel": element.get("rel"), "href": element.get("href")})
+            elif name == "description":
+                feed["subtitle"] = get_text_construct(element, "text/html", is_atom)
+            elif name == "subtitle":
+                feed["subtitle"] = get_text_construct(element, "text/plain", is_atom)
+            elif name in ("lastBuildDate", "updated"):
+                set_dates(feed, None, element.text)
+
+    return ParsedFeed(feed=feed, entries=entries, bozo=False, bozo_exception=None)
@@ -0,0 +1,379 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+import feedparser
+from sqlmodel import Session, select
+
+from api.db import get_session
+from api.models import Feed, ParsedFeed, WrittenEntry
+from api.services import feed_service
+from background.fetcher import FetchRequest, FetchResult, fetch_feeds
+from background.parsing import (
+    StreamLimits,
+    UnsupportedFeedError,
+    get_stream_limits,
+    parse_feed_stream,
+)
+from background.scheduling import get_entry_dates, schedule_next_refresh
+from background.websub import update_hub
+from config import get_settings
+from entry_cache import invalidate_recent_entries
+from entry_stream import publish_new_entries
+from metrics import FEED_REFRESHES, REFRESH_PHASE_DURATION
+
+# Refreshing a feed goes through three stages, each bound by a different resource:
+# downloading (network, on the event loop), parsing (CPU, on a process pool) and
+# persisting (database, in batches on a single connection). Bounded queues connect
+# them, so that a slow stage holds back the ones feeding it.
+
+# Each refresh ends up paired with the error it failed with, or None
+RefreshOutcome = Tuple[FetchRequest, Optional[Exception]]
+
+
+@dataclass
+class ParsedFetch:
+    """Downloaded feed on its way to the persist stage"""
+
+    fetch_request: FetchRequest
+    fetch_result: FetchResult
+    fetched_feed: Optional[ParsedFeed]  # None when the server answered 304
+
+
+def parse_feed_body(
+    body: bytes,
+    stream_limits: Optional[StreamLimits] = None,
+    entry_hashes: Optional[Mapping[str, int]] = None,
+) -> Tuple[ParsedFeed, float]:
+    """
+    Parse a feed body, meant to run in a worker process.
+
+    Args:
+        body (bytes): The downloaded document.
+        stream_limits (Optional[StreamLimits]): Use the streaming parser with these
+            limits, feedparser parses the whole document otherwise. Documents left
+            to feedparser still have to fit in the byte limit.
+        entry_hashes (Optional[Mapping[str, int]]): Fingerprints of the latest stored
+            entries by GUID, which let the streaming parser stop early.
+
+    Returns:
+        Tuple[ParsedFeed, float]: The parsed feed, and the seconds spent parsing it.
+
+    Raises:
+        ValueError: If the body is not a valid feed, or is too large for feedparser.
+            The parser's own exceptions cannot be sent back from a worker process.
+    """
+    started_at = time.perf_counter()
+    if stream_limits:
+        try:
+            fetched_feed = parse_feed_stream(body, stream_limits, entry_hashes or {})
+            return fetched_feed, time.perf_counter() - started_at
+        except (UnsupportedFeedError, ET.ParseError):
+            # Other formats and broken documents are left to the more lenient
+            # feedparser, which reads the whole document: larger ones are refused
+            if len(body) > stream_limits.max_bytes:
+                raise ValueError(f"Document exceeds {stream_limits.max_bytes} bytes")
+
+    fetched_feed = feedparser.parse(body)
+
+    # Check if any parsing or fetching errors were encountered
+    if fetched_feed.bozo:
+        raise ValueError(repr(fetched_feed.bozo_exception))
+
+    return fetched_feed, time.perf_counter() - started_at
+
+
+def parse_fetch_result(
+    fetch_result: FetchResult, entry_hashes: Optional[Mapping[str, int]] = None
+) -> ParsedFeed:
+    """Parse a downloaded feed body in the current process"""
+    fetched_feed, elapsed = parse_feed_body(
+        fetch_result.body, get_stream_limits(), entry_hashes
+    )
+    REFRESH_PHASE_DURATION.labels("parse").observe(elapsed)
+    return fetched_feed
+
+
+def add_entry_hashes(session: Session, fetch_requests: Sequence[FetchRequest]) -> None:
+    """Attach the hashes that let the streaming parser stop early, when it is enabled"""
+    stream_limits = get_stream_limits()
+    if not stream_limits or not stream_limits.stop_after_known:
+        return
+
+    # Some slack for entries sharing a publication date or having none
+    entry_hashes = feed_service.get_latest_entry_hashes(
+        session,
+        [fetch_request.feed_id for fetch_request in fetch_requests],
+        limit=2 * stream_limits.stop_after_known,
+    )
+    for fetch_request in fetch_requests:
+        fetch_request.entry_hashes = entry_hashes[fetch_request.feed_id]
+
+
+@lru_cache
+def get_parse_executor() -> Tuple[Executor, int]:
+    """
+    Pool parsing feeds for the pipelines of this process, and its number of workers.
+
+    Batch refreshes are routed to workers of the solo pool, which run them in the
+    main process. Processes of Celery's prefork pool are daemonic and cannot start
+    children, should they run a pipeline they parse on a single thread instead.
+    """
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=1), 1
+
+    workers = get_settings().REFRESH_PARSE_WORKERS or os.cpu_count() or 1
+    return ProcessPoolExecutor(max_workers=workers), workers
+
+
+def store_fetch_result(
+    feed: Feed,
+    fetch_result: FetchResult,
+    fetched_feed: ParsedFeed,
+    session: Session,
+    written_entries: Optional[List[WrittenEntry]] = None,
+) -> int:
+    """Update the feed and its entries from its parsed body
+
+    Returns the number of entries created or updated. Once committed, those
+    have to be invalidated in the recent entries cache, and the ones collected
+    in written_entries announced and pushed to timelines.
+    """
+    # Update feed and feed entries
+    feed_service.update_feed(feed, fetched_feed, session)
+    written = feed_service.update_or_create_feed_entries(
+        feed, fetched_feed, session, written_entries
+    )
+
+    # Keep the validators so that the next refresh can be conditional
+    feed.etag = fetch_result.etag
+    feed.last_modified = fetch_result.last_modified
+
+    # Feeds advertising a WebSub hub get subscribed by renew_websub_subscriptions
+    update_hub(feed, fetched_feed.feed)
+
+    schedule_next_refresh(
+        feed,
+        changed=written > 0,
+        entry_dates=get_entry_dates(fetched_feed.entries),
+        max_age=fetch_result.max_age,
+    )
+    session.add(feed)
+
+    return written
+
+
+def store_pushed_feed(
+    feed: Feed,
+    fetched_feed: ParsedFeed,
+    session: Session,
+    written_entries: Optional[List[WrittenEntry]] = None,
+) -> int:
+    """Update the feed and its entries from content pushed by its WebSub hub
+
+    Returns the number of entries created or updated, like store_fetch_result. The
+    refresh schedule and the HTTP validators are left to the safety polls.
+    """
+    feed_service.update_feed(feed, fetched_feed, session)
+    written = feed_service.update_or_create_feed_entries(
+        feed, fetched_feed, session, written_entries
+    )
+    session.add(feed)
+    return written
+
+
+def store_not_modified(feed: Feed, fetch_result: FetchResult, session: Session) -> None:
+    """Back off the refresh schedule of a feed the server reported as unchanged"""
+    schedule_next_refresh(feed, changed=False, max_age=fetch_result.max_age)
+    session.add(feed)
+
+
+def persist_batch(parsed_fetches: Sequence[ParsedFetch]) -> List[RefreshOutcome]:
+    """
+    Store a batch of downloaded feeds in a single transaction.
+
+    Every feed is written in its own savepoint, so that one failing feed does not
+    take the rest of the batch down with it. The connection is only held for as long
+    as the writes take.
+
+    Returns:
+        List[RefreshOutcome]: Each feed of the batch with the error it failed with, or
+        None. Feeds that no longer exist are not an error.
+    """
+    feed_ids = [p.fetch_request.feed_id for p in parsed_fetches]
+    errors: List[Optional[Exception]] = []
+    written: List[int] = []
+    written_entries: List[List[WrittenEntry]] = []
+
+    with get_session() as session:
+        statement = select(Feed).where(Feed.uuid.in_(feed_ids))  # type: ignore
+        feeds = {feed.uuid: feed for feed in session.exec(statement)}
+
+        for parsed_fetch in parsed_fetches:
+            feed = feeds.get(parsed_fetch.fetch_request.feed_id)
+            feed_written = 0
+            feed_written_entries: List[WrittenEntry] = []
+            try:
+                persist_timer = REFRESH_PHASE_DURATION.labels("persist").time()
+                with persist_timer, session.begin_nested():
+                    if feed and parsed_fetch.fetched_feed is None:
+                        store_not_modified(feed, parsed_fetch.fetch_result, session)
+                    elif feed and parsed_fetch.fetched_feed is not None:
+                        feed_written = store_fetch_result(
+                            feed,
+                            parsed_fetch.fetch_result,
+                            parsed_fetch.fetched_feed,
+                            session,
+                            feed_written_entries,
+                        )
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+            written.append(feed_written)
+            written_entries.append(feed_written_entries)
+
+        try:
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            return [(p.fetch_request, e) for p in parsed_fetches]
+
+        # Entries of the feeds whose savepoint was rolled back were not written
+        feed_service.push_to_timelines(
+            session,
+            [
+                entry
+                for feed_written_entries, error in zip(written_entries, errors)
+                if error is None
+                for entry in feed_written_entries
+            ],
+        )
+
+    for parsed_fetch, error, feed_written, feed_written_entries in zip(
+        parsed_fetches, errors, written, written_entries
+    ):
+        if error is not None:
+            continue
+        if feed_written:
+            invalidate_recent_entries(parsed_fetch.fetch_request.feed_id)
+            publish_new_entries(
+                parsed_fetch.fetch_request.feed_id,
+                [entry.uuid for entry in feed_written_entries if entry.created],
+            )
+        if parsed_fetch.fetched_feed is None:
+            FEED_REFRESHES.labels("not_modified").inc()
+        else:
+            FEED_REFRESHES.labels("changed" if feed_written else "unchanged").inc()
+
+    return [(p.fetch_request, e) for p, e in zip(parsed_fetches, errors)]
+
+
+async def parse_stage(
+    fetched: asyncio.Queue[Optional[Tuple[FetchRequest, FetchResult | Exception]]],
+    parsed: asyncio.Queue[Optional[ParsedFetch]],
+    executor: Executor,
+    stream_limits: Optional[StreamLimits],
+    outcomes: List[RefreshOutcome],
+) -> None:
+    """Parse downloaded feeds until the download stage signals its end with None"""
+    loop = asyncio.get_running_loop()
+    while (item := await fetched.get()) is not None:
+        fetch_request, fetch_result = item
+        if isinstance(fetch_result, Exception):
+            outcomes.append((fetch_request, fetch_result))
+            continue
+
+        # Downloads are measured as they come out of the queue, with the time they took
+        REFRESH_PHASE_DURATION.labels("fetch").observe(fetch_result.elapsed)
+        if fetch_result.not_modified:
+            await parsed.put(ParsedFetch(fetch_request, fetch_result, None))
+            continue
+
+        try:
+            fetched_feed, elapsed = await loop.run_in_executor(
+                executor,
+                parse_feed_body,
+                fetch_result.body,
+                stream_limits,
+                fetch_request.entry_hashes,
+            )
+        except Exception as e:
+            outcomes.append((fetch_request, e))
+            continue
+        REFRESH_PHASE_DURATION.labels("parse").observe(elapsed)
+        await parsed.put(ParsedFetch(fetch_request, fetch_result, fetched_feed))
+
+
+async def persist_stage(
+    parsed: asyncio.Queue[Optional[ParsedFetch]],
+    batch_size: int,
+    outcomes: List[RefreshOutcome],
+) -> None:
+    """Persist parsed feeds in batches of whatever is queued, until None is received"""
+    finished = False
+    while not finished:
+        batch: List[ParsedFetch] = []
+        item = await parsed.get()
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= batch_size or parsed.empty():
+                break
+            item = parsed.get_nowait()
+        finished = item is None
+
+        # The database work is blocking, keep the event loop downloading meanwhile
+        if batch:
+            outcomes.extend(await asyncio.to_thread(persist_batch, batch))
+
+
+async def run_refresh_pipeline(
+    fetch_requests: Sequence[FetchRequest],
+) -> List[RefreshOutcome]:
+    """
+    Download, parse and persist feeds, each stage running concurrently with the others.
+
+    Returns:
+        List[RefreshOutcome]: Every request with the error it failed with, or None.
+    """
+    settings = get_settings()
+    executor, parse_workers = get_parse_executor()
+    fetched: asyncio.Queue[
+        Optional[Tuple[FetchRequest, FetchResult | Exception]]
+    ] = asyncio.Queue(settings.REFRESH_QUEUE_SIZE)
+    parsed: asyncio.Queue[Optional[ParsedFetch]] = asyncio.Queue(
+        settings.REFRESH_QUEUE_SIZE
+    )
+    stream_limits = get_stream_limits()
+    outcomes: List[RefreshOutcome] = []
+
+    async def download() -> None:
+        await fetch_feeds(
+            fetch_requests,
+            concurrency=settings.REFRESH_CONCURRENCY,
+            timeout=settings.REFRESH_TIMEOUT_SECONDS,
+            results=fetched,  # type: ignore
+        )
+        for _ in range(parse_workers):
+            await fetched.put(None)
+
+    async def parse() -> None:
+        await asyncio.gather(
+            *(
+                parse_stage(fetched, parsed, executor, stream_limits, outcomes)
+                for _ in range(parse_workers)
+            )
+        )
+        await parsed.put(None)
+
+    await asyncio.gather(
+        download(),
+        parse(),
+        persist_stage(parsed, settings.REFRESH_PERSIST_BATCH_SIZE, outcomes),
+    )
+    return outcomes
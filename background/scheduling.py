@@ -0,0 +1,95 @@
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from api.models import Feed
+from config import get_settings
+
+# How the interval reacts to a refresh that found no changes, or changes without dates
+BACKOFF_FACTOR = 1.5
+SPEEDUP_FACTOR = 0.75
+
+# Spread next refresh times by +/- this fraction of the interval
+JITTER = 0.1
+
+# Number of most recent entries considered when measuring how often a feed posts
+POSTING_RATE_SAMPLE_SIZE = 10
+
+
+def get_entry_dates(entries: Sequence[Dict[str, Any]]) -> List[datetime]:
+    """Publication dates of the parsed feed entries that have one"""
+    return [
+        datetime(*entry["updated_parsed"][:6])
+        for entry in entries
+        if entry.get("updated_parsed")
+    ]
+
+
+def get_mean_entry_gap(entry_dates: Sequence[datetime]) -> Optional[float]:
+    """Average time in seconds between the most recent entries of a feed"""
+    recent = sorted(entry_dates, reverse=True)[: POSTING_RATE_SAMPLE_SIZE + 1]
+    if len(recent) < 2:
+        return None
+    return (recent[0] - recent[-1]).total_seconds() / (len(recent) - 1)
+
+
+def learn_refresh_interval(
+    current_interval: Optional[int],
+    changed: bool,
+    entry_dates: Sequence[datetime] = (),
+    max_age: Optional[int] = None,
+) -> int:
+    """
+    Adapt a feed's refresh interval to how often it actually changes.
+
+    Args:
+        current_interval (Optional[int]): Interval in seconds used so far, if any.
+        changed (bool): Whether the last refresh found new or updated entries.
+        entry_dates (Sequence[datetime]): Publication dates of the fetched entries.
+        max_age (Optional[int]): Freshness lifetime announced by the server, in seconds.
+
+    Returns:
+        int: The next refresh interval in seconds, within the configured bounds.
+    """
+    settings = get_settings()
+    interval = float(current_interval or settings.REFRESH_DEFAULT_INTERVAL_SECONDS)
+
+    if changed:
+        # Move halfway towards the posting rate observed in the feed itself
+        mean_gap = get_mean_entry_gap(entry_dates)
+        interval = (interval + mean_gap) / 2 if mean_gap else interval * SPEEDUP_FACTOR
+    else:
+        interval *= BACKOFF_FACTOR
+
+    # No point in asking again before the server says the content may change
+    if max_age:
+        interval = max(interval, max_age)
+
+    return int(
+        min(
+            max(interval, settings.REFRESH_MIN_INTERVAL_SECONDS),
+            settings.REFRESH_MAX_INTERVAL_SECONDS,
+        )
+    )
+
+
+def schedule_next_refresh(
+    feed: Feed,
+    changed: bool,
+    entry_dates: Sequence[datetime] = (),
+    max_age: Optional[int] = None,
+) -> None:
+    """Learn the feed's refresh interval and set its next, jittered, refresh time"""
+    interval = learn_refresh_interval(
+        feed.refresh_interval, changed, entry_dates, max_age
+    )
+    feed.refresh_interval = interval
+
+    # Pushed feeds are only polled as a safety net, the learned interval is kept for
+    # when the subscription lapses
+    if feed.is_pushed:
+        interval = max(interval, get_settings().WEBSUB_POLL_INTERVAL_SECONDS)
+
+    feed.next_refresh_at = datetime.now() + timedelta(
+        seconds=interval * random.uniform(1 - JITTER, 1 + JITTER)
+    )
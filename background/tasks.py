@@ -1,14 +1,33 @@
+import asyncio
 import logging
+from datetime import datetime, timedelta
+from typing import List, Sequence
+from uuid import UUID
 
-import feedparser
-from sqlmodel import Session
+import httpx
+from celery import group
+from sqlalchemy import update
+from sqlmodel import Session, or_, select
+from sqlmodel.sql.expression import SelectOfScalar
 
-from api.db import get_session
+from api import partitions
+from api.db import engine, get_session
 from api.errors import NotFoundError
-from api.models import Feed, ParsedFeed
+from api.models import Feed, FeedUser
 from api.services import feed_service
+from background import websub
 from background.celery import app
-from cache import acquire_lock, release_lock
+from background.fetcher import FetchRequest, fetch_feed
+from background.pipeline import (
+    ParsedFetch,
+    add_entry_hashes,
+    parse_fetch_result,
+    persist_batch,
+    run_refresh_pipeline,
+)
+from cache import acquire_locks, release_lock
+from config import get_settings
+from metrics import FEED_REFRESH_FAILURES, FEED_REFRESHES
 
 logger = logging.getLogger(__name__)
 
@@ -43,43 +62,59 @@ class RefreshFeedWithRetry(app.Task):  # type: ignore
                 release_lock(task_identifier)
                 return
 
-            try:
-                # Fetch feed
-                fetched_feed: ParsedFeed = feedparser.parse(feed.url)
+            fetch_request = FetchRequest(
+                feed.uuid, feed.url, etag=feed.etag, last_modified=feed.last_modified
+            )
+            add_entry_hashes(session, [fetch_request])
 
-                # Check if any parsing or fetching errors were encountered
-                if fetched_feed.bozo:
-                    raise Exception(fetched_feed.bozo_exception)
+        # No database connection is held while downloading and parsing
+        try:
+            # Fetch feed conditionally, nothing to do if the server reports no changes
+            fetch_result = fetch_feed(
+                fetch_request.url,
+                etag=fetch_request.etag,
+                last_modified=fetch_request.last_modified,
+            )
+            fetched_feed = (
+                None
+                if fetch_result.not_modified
+                else parse_fetch_result(fetch_result, fetch_request.entry_hashes)
+            )
+            [(_, error)] = persist_batch(
+                [ParsedFetch(fetch_request, fetch_result, fetched_feed)]
+            )
+            if error is not None:
+                raise error
+            release_lock(task_identifier)
 
-                # Update feed and feed entries
-                feed_service.update_feed(feed, fetched_feed, session)
-                feed_service.update_or_create_feed_entries(feed, fetched_feed, session)
+        # If any errors occur, retry the task with a custom delay
+        except Exception as e:
+            FEED_REFRESHES.labels("failed").inc()
+            retries = self.request.retries
+            max_allowed_retries = len(self.retry_delays)
 
-                session.commit()
-                release_lock(task_identifier)
-
-            # If any errors occur, retry the task with a custom delay
-            except Exception as e:
-                retries = self.request.retries
-                max_allowed_retries = len(self.retry_delays)
-
-                # If number of retries exceeds max allowed, revent retrying for this feed
-                if retries >= max_allowed_retries:
-                    feed.should_retry = False
-                    session.add(feed)
-                    session.commit()
+            # If number of retries exceeds max allowed, revent retrying for this feed
+            if retries >= max_allowed_retries:
+                FEED_REFRESH_FAILURES.labels("give_up").inc()
+                with get_session() as session:
+                    feed = session.get(Feed, feed_id)
+                    if feed:
+                        feed.should_retry = False
+                        session.add(feed)
+                        session.commit()
 
-                    # Release lock so that the task can be scheduled again
-                    release_lock(task_identifier)
+                # Release lock so that the task can be scheduled again
+                release_lock(task_identifier)
 
-                # Retry with specific countdown
-                if retries < len(self.retry_delays):
-                    delay = (
-                        self.retry_delays[retries] * 60  # convert to seconds
-                        if retries < len(self.retry_delays)
-                        else None
-                    )
-                    raise self.retry(exc=e, countdown=delay)
+            # Retry with specific countdown
+            if retries < len(self.retry_delays):
+                delay = (
+                    self.retry_delays[retries] * 60  # convert to seconds
+                    if retries < len(self.retry_delays)
+                    else None
+                )
+                FEED_REFRESH_FAILURES.labels("retry").inc()
+                raise self.retry(exc=e, countdown=delay)
 
 
 @app.task(bind=True, base=RefreshFeedWithRetry)
@@ -88,19 +123,214 @@ def refresh_feed(self: RefreshFeedWithRetry, feed_id: str) -> None:  # type: ign
 
 
 @app.task(bind=True)
-def refresh_all_feeds(self) -> None:  # type: ignore
-    """Refresh all feeds by submitting a refresh job for each feed"""
-    session = get_session()
-    feeds = session.query(Feed).all()
-    for feed in feeds:
-        # Lock feed to prevent multiple refresh jobs from running at the same time
-        task_identifier = get_refresh_task_identifier(feed.uuid)
-        acquired = acquire_lock(task_identifier)
-        if not acquired:
-            logger.info(f"{feed.uuid} refresh job is already running.")
+def refresh_feeds_batch(self, feed_ids: List[str]) -> None:  # type: ignore
+    """Refresh a chunk of feeds through the download, parse and persist pipeline
+
+    The caller holds the refresh lock of every feed in the chunk. Feeds that fail
+    to download or to persist are handed over to refresh_feed, which takes over
+    the lock and the retry logic.
+    """
+    with get_session() as session:
+        statement = select(Feed.uuid, Feed.url, Feed.etag, Feed.last_modified).where(
+            Feed.uuid.in_(feed_ids), Feed.should_retry == True  # type: ignore # noqa
+        )
+        fetch_requests = [FetchRequest(*row) for row in session.exec(statement)]
+        add_entry_hashes(session, fetch_requests)
+
+    # Feeds that were removed or stopped retrying in the meantime
+    for feed_id in set(feed_ids) - {str(r.feed_id) for r in fetch_requests}:
+        release_lock(get_refresh_task_identifier(feed_id))
+
+    try:
+        outcomes = asyncio.run(run_refresh_pipeline(fetch_requests))
+    except Exception as e:
+        # Refreshing twice is harmless, hand over every feed if the pipeline broke down
+        outcomes = [(fetch_request, e) for fetch_request in fetch_requests]
+
+    first_retry_delay = RefreshFeedWithRetry.retry_delays[0] * 60
+    for fetch_request, error in outcomes:
+        if error is None:
+            release_lock(get_refresh_task_identifier(fetch_request.feed_id))
             continue
-        refresh_feed.delay(feed.uuid)
-    session.close()
+
+        FEED_REFRESHES.labels("failed").inc()
+        FEED_REFRESH_FAILURES.labels("handover").inc()
+        logger.info(f"{fetch_request.feed_id} batch refresh failed: {error!r}")
+        refresh_feed.apply_async(
+            (str(fetch_request.feed_id),), countdown=first_retry_delay
+        )
+
+
+def dispatch_feed_refresh_chunk(feed_ids: Sequence[UUID]) -> None:
+    """Lock a chunk of feeds and submit batch refresh jobs for the ones not already running"""
+    # Lock feeds to prevent multiple refresh jobs from running at the same time
+    task_identifiers = [get_refresh_task_identifier(feed_id) for feed_id in feed_ids]
+    acquired = acquire_locks(task_identifiers)
+    locked_feed_ids = [
+        str(feed_id) for feed_id, is_acquired in zip(feed_ids, acquired) if is_acquired
+    ]
+    if len(locked_feed_ids) < len(feed_ids):
+        logger.info(
+            f"{len(feed_ids) - len(locked_feed_ids)} refresh jobs are already running."
+        )
+    if not locked_feed_ids:
+        return
+
+    # Publish all the batch jobs of this chunk at once
+    batch_size = get_settings().REFRESH_BATCH_SIZE
+    group(
+        refresh_feeds_batch.s(locked_feed_ids[i : i + batch_size])
+        for i in range(0, len(locked_feed_ids), batch_size)
+    ).apply_async()
+
+
+def dispatch_feed_refreshes(statement: SelectOfScalar[UUID]) -> None:
+    """Stream the feed IDs selected by the statement and dispatch them chunk by chunk
+
+    A server-side cursor keeps memory flat regardless of the number of feeds.
+    """
+    chunk_size = get_settings().REFRESH_DISPATCH_CHUNK_SIZE
+    with get_session() as session:
+        results = session.exec(
+            statement.execution_options(stream_results=True, max_row_buffer=chunk_size)
+        )
+        for feed_ids in results.partitions(chunk_size):
+            dispatch_feed_refresh_chunk(feed_ids)
+
+
+@app.task(bind=True)
+def refresh_due_feeds(self) -> None:  # type: ignore
+    """Refresh the feeds whose adaptive refresh time has passed"""
+    statement = select(Feed.uuid).where(
+        Feed.should_retry == True,  # noqa
+        or_(
+            Feed.next_refresh_at == None,  # noqa
+            Feed.next_refresh_at <= datetime.now(),  # type: ignore
+        ),
+    )
+    dispatch_feed_refreshes(statement)
+
+
+@app.task(bind=True)
+def refresh_all_feeds(self) -> None:  # type: ignore
+    """Refresh all feeds regardless of their schedule by submitting batch refresh jobs"""
+    dispatch_feed_refreshes(select(Feed.uuid))
+
+
+@app.task(bind=True)
+def reconcile_unread_counts(self) -> None:  # type: ignore
+    """Recount the unread entries of every followed feed, a batch of feeds at a time"""
+    batch_size = get_settings().UNREAD_COUNT_RECONCILE_BATCH_SIZE
+    statement = select(FeedUser.feed_id).distinct().order_by(FeedUser.feed_id)
+    with get_session() as session:
+        feed_ids = session.exec(statement).all()
+
+    corrected = 0
+    for i in range(0, len(feed_ids), batch_size):
+        with get_session() as session:
+            corrected += feed_service.reconcile_unread_counts(
+                session, feed_ids[i : i + batch_size]
+            )
+            session.commit()
+    if corrected:
+        logger.info(f"Corrected {corrected} drifted unread counts.")
+
+
+@app.task(bind=True)
+def maintain_entry_partitions(self) -> None:  # type: ignore
+    """Create the coming months' entry partitions and expire the old ones"""
+    settings = get_settings()
+    with engine.begin() as connection:
+        partitions.create_partitions(connection, settings.ENTRY_PARTITION_MONTHS_AHEAD)
+        raw_months, entry_months, feed_ids = partitions.expire_partitions(
+            connection,
+            settings.ENTRY_RETENTION_MONTHS,
+            settings.ENTRY_RAW_RETENTION_MONTHS,
+            settings.ENTRY_RETENTION_MODE,
+        )
+        if feed_ids:
+            # Listings of these feeds may have lost entries, invalidate them
+            connection.execute(
+                update(Feed)
+                .where(Feed.uuid.in_(feed_ids))  # type: ignore
+                .values(entries_updated_at=datetime.now())
+            )
+    if feed_ids:
+        with get_session() as session:
+            feed_service.evict_expired_entries(session, list(feed_ids))
+    if raw_months or entry_months:
+        logger.info(
+            f"Expired {raw_months} months of raw payloads, and entries of "
+            f"{len(feed_ids)} feeds in {entry_months} months "
+            f"({settings.ENTRY_RETENTION_MODE})."
+        )
+
+
+@app.task(bind=True)
+def subscribe_feed(self, feed_id: str) -> None:  # type: ignore
+    """Ask the WebSub hub of a feed to push its updates to our callback"""
+    settings = get_settings()
+    with get_session() as session:
+        feed = session.get(Feed, feed_id)
+        if (
+            not settings.WEBSUB_CALLBACK_URL
+            or not feed
+            or not websub.needs_subscription(feed, datetime.now())
+        ):
+            return
+
+        # Kept across renewals, pushes signed before the hub switches stay valid
+        feed.websub_secret = feed.websub_secret or websub.create_secret()
+        feed.websub_requested_at = datetime.now()
+        session.add(feed)
+        session.commit()
+        hub_url, topic, secret = feed.websub_hub, feed.websub_topic, feed.websub_secret
+    callback_url = websub.get_callback_url(feed_id, secret)
+
+    # The hub verifies the request through the callback before it is effective
+    with httpx.Client(timeout=settings.REFRESH_TIMEOUT_SECONDS) as client:
+        websub.request_subscription(
+            client,
+            hub_url,  # type: ignore
+            topic,  # type: ignore
+            callback_url,  # type: ignore
+            secret,
+            settings.WEBSUB_LEASE_SECONDS,
+        )
+
+
+@app.task(bind=True)
+def renew_websub_subscriptions(self) -> None:  # type: ignore
+    """Subscribe the feeds advertising a WebSub hub, and renew expiring subscriptions
+
+    Requests the hub did not verify are sent again after a while, the same goes for
+    hubs that denied them.
+    """
+    settings = get_settings()
+    if not settings.WEBSUB_CALLBACK_URL:
+        return
+
+    now = datetime.now()
+    renew_at = now + timedelta(seconds=settings.WEBSUB_RENEW_BEFORE_SECONDS)
+    retry_at = now - timedelta(seconds=websub.RESUBSCRIBE_AFTER_SECONDS)
+    statement = select(Feed.uuid).where(
+        Feed.websub_hub != None,  # noqa
+        or_(
+            Feed.websub_expires_at == None,  # noqa
+            Feed.websub_expires_at <= renew_at,  # type: ignore
+        ),
+        or_(
+            Feed.websub_requested_at == None,  # noqa
+            Feed.websub_requested_at <= retry_at,  # type: ignore
+        ),
+    )
+    with get_session() as session:
+        feed_ids = session.exec(statement).all()
+
+    for feed_id in feed_ids:
+        subscribe_feed.delay(str(feed_id))
+    if feed_ids:
+        logger.info(f"Requested {len(feed_ids)} WebSub subscriptions.")
 
 
 def force_refresh_feed(session: Session, feed_id: str) -> None:  # type: ignore
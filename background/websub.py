@@ -0,0 +1,140 @@
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+import httpx
+
+from api.models import Feed
+from config import get_settings
+
+# WebSub (formerly PubSubHubbub) lets a feed push its updates through a hub instead of
+# being polled. Feeds advertising a hub are subscribed with a callback URL pointing to
+# the /websub routes, which verify the subscription and receive the pushed content.
+# Pushed feeds are still polled now and then, in case a push got lost.
+
+SIGNATURE_HEADER = "X-Hub-Signature"
+SIGNATURE_ALGORITHMS = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "sha384": hashlib.sha384,
+    "sha512": hashlib.sha512,
+}
+
+# Subscription requests the hub has not verified by then are sent again
+RESUBSCRIBE_AFTER_SECONDS = 60 * 60
+
+
+def get_feed_links(feed_dict: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Hub and self URLs advertised in the metadata of a parsed feed"""
+    links: Dict[str, str] = {}
+    for link in feed_dict.get("links", []):
+        rel, href = link.get("rel"), link.get("href")
+        if rel in ("hub", "self") and href:
+            links.setdefault(rel, href)
+    return links.get("hub"), links.get("self")
+
+
+def update_hub(feed: Feed, feed_dict: Dict[str, Any]) -> None:
+    """Keep the hub advertised by the feed, a new hub or topic needs a new subscription"""
+    hub, topic = get_feed_links(feed_dict)
+    # Hubs know the feed by its self URL, the fetched URL is the best guess otherwise
+    topic = (topic or feed.url) if hub else None
+    if (hub, topic) == (feed.websub_hub, feed.websub_topic):
+        return
+
+    feed.websub_hub = hub
+    feed.websub_topic = topic
+    feed.websub_secret = None
+    feed.websub_requested_at = None
+    feed.websub_expires_at = None
+
+
+def needs_subscription(feed: Feed, now: datetime) -> bool:
+    """Whether the feed has a hub but no subscription, or one about to expire"""
+    settings = get_settings()
+    if not feed.websub_hub:
+        return False
+    renew_at = now + timedelta(seconds=settings.WEBSUB_RENEW_BEFORE_SECONDS)
+    if feed.websub_expires_at and feed.websub_expires_at > renew_at:
+        return False
+    return not is_requested(feed, now)
+
+
+def is_requested(feed: Feed, now: datetime) -> bool:
+    """Whether a subscription request of the feed awaits verification by the hub"""
+    retry_at = now - timedelta(seconds=RESUBSCRIBE_AFTER_SECONDS)
+    return bool(feed.websub_requested_at and feed.websub_requested_at > retry_at)
+
+
+def get_callback_token(secret: str) -> str:
+    """Token in the callback URL of a subscription, which only the hub is given"""
+    return hmac.new(secret.encode(), b"callback", hashlib.sha256).hexdigest()
+
+
+def verify_callback_token(secret: str, token: str) -> bool:
+    return hmac.compare_digest(get_callback_token(secret), token)
+
+
+def get_callback_url(feed_id: UUID | str, secret: str) -> Optional[str]:
+    """
+    Callback URL of a feed's subscription, None if push is disabled.
+
+    It carries a token derived from the subscription's secret, so that verification
+    requests can't come from anyone who merely knows the feed ID. The token stays the
+    same across renewals, which the hub tells apart from new subscriptions by URL.
+    """
+    base_url = get_settings().WEBSUB_CALLBACK_URL
+    if not base_url:
+        return None
+    return f"{base_url.rstrip('/')}/{feed_id}?token={get_callback_token(secret)}"
+
+
+def create_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def sign_payload(secret: str, body: bytes, algorithm: str = "sha256") -> str:
+    """Signature of a pushed body, in the format of the X-Hub-Signature header"""
+    digest = hmac.new(secret.encode(), body, SIGNATURE_ALGORITHMS[algorithm])
+    return f"{algorithm}={digest.hexdigest()}"
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """Check the X-Hub-Signature header of a pushed body against our secret"""
+    algorithm, _, _ = (signature or "").partition("=")
+    if algorithm not in SIGNATURE_ALGORITHMS:
+        return False
+    return hmac.compare_digest(sign_payload(secret, body, algorithm), signature or "")
+
+
+def request_subscription(
+    client: httpx.Client,
+    hub_url: str,
+    topic: str,
+    callback_url: str,
+    secret: str,
+    lease_seconds: int,
+) -> None:
+    """
+    Ask a hub to push the updates of a topic to our callback.
+
+    The hub only accepts the request here, it confirms it later by sending a challenge
+    to the callback, which is when the subscription starts.
+
+    Raises:
+        httpx.HTTPStatusError: If the hub refuses the request.
+    """
+    response = client.post(
+        hub_url,
+        data={
+            "hub.mode": "subscribe",
+            "hub.topic": topic,
+            "hub.callback": callback_url,
+            "hub.secret": secret,
+            "hub.lease_seconds": str(lease_seconds),
+        },
+    )
+    response.raise_for_status()
@@ -1,8 +1,10 @@
 import logging
+from typing import List, Sequence
 
 import redis
 
 from config import get_settings
+from metrics import LOCK_ATTEMPTS
 
 redis_client = redis.Redis(
     host=get_settings().REDIS_HOST, port=get_settings().REDIS_PORT
@@ -16,8 +18,25 @@ def acquire_lock(lock_name: str) -> bool:
     """
     status = redis_client.set(lock_name, "lock", nx=True)
     logger.info(f"Acquired lock {lock_name}: {status}")
+    count_lock_attempts([status is not None])
     return status is not None
 
 
+def acquire_locks(lock_names: Sequence[str]) -> List[bool]:
+    """Try to acquire many locks in a single round-trip, returns whether each was acquired"""
+    pipeline = redis_client.pipeline(transaction=False)
+    for lock_name in lock_names:
+        pipeline.set(lock_name, "lock", nx=True)
+    acquired = [status is not None for status in pipeline.execute()]
+    count_lock_attempts(acquired)
+    return acquired
+
+
+def count_lock_attempts(acquired: Sequence[bool]) -> None:
+    locked = sum(acquired)
+    LOCK_ATTEMPTS.labels("acquired").inc(locked)
+    LOCK_ATTEMPTS.labels("contended").inc(len(acquired) - locked)
+
+
 def release_lock(lock_name: str) -> None:
     redis_client.delete(lock_name)
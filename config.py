@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal, Optional
 
 from pydantic import BaseSettings, PostgresDsn
 
@@ -7,9 +8,92 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRY_MINUTES: int = 60 * 24 * 7  # 1 week
+    # Trust the user ID claim of valid tokens instead of looking the user up
+    JWT_TRUST_USER_ID_CLAIM: bool = False
+
+    # Threads verifying passwords, and password checks allowed to wait for one
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_LIMIT: int = 64
+
+    # In-process cache of decoded tokens and authenticated users
+    AUTH_CACHE_MAX_SIZE: int = 10_000
+    AUTH_CACHE_TTL_SECONDS: int = 60
     REDIS_HOST: str
     REDIS_PORT: int
     POSTGRES_DSN: PostgresDsn
+    POSTGRES_REPLICA_DSN: Optional[PostgresDsn] = None
+
+    # Connection pool of each engine, and logging of every statement
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_ECHO: bool = False
+
+    # Feed refresh: feed IDs streamed per dispatch round, feeds per batch task,
+    # requests in flight per worker, per-request deadline
+    REFRESH_DISPATCH_CHUNK_SIZE: int = 5000
+    REFRESH_BATCH_SIZE: int = 200
+    REFRESH_CONCURRENCY: int = 100
+    REFRESH_TIMEOUT_SECONDS: float = 20
+
+    # Refresh pipeline: parsing processes (defaults to the number of cores), feeds
+    # waiting between two stages, feeds written per transaction
+    REFRESH_PARSE_WORKERS: Optional[int] = None
+    REFRESH_QUEUE_SIZE: int = 100
+    REFRESH_PERSIST_BATCH_SIZE: int = 50
+
+    # Streaming parser for RSS 2.0 and Atom, instead of feedparser: largest document
+    # and number of entries read, run of known unchanged entries that ends the read
+    REFRESH_STREAMING_PARSER: bool = False
+    REFRESH_STREAM_MAX_BYTES: int = 10 * 1024 * 1024
+    REFRESH_STREAM_MAX_ENTRIES: int = 1000
+    REFRESH_STREAM_STOP_AFTER_KNOWN: int = 5
+
+    # Redis cache of the newest entries of every feed, used for listings of up to
+    # ENTRY_CACHE_MAX_FEEDS feeds
+    ENTRY_CACHE_SIZE: int = 100
+    ENTRY_CACHE_TTL_SECONDS: int = 60 * 60
+    ENTRY_CACHE_MAX_FEEDS: int = 50
+
+    # Personal timelines in Redis serving the followed-only listing: entries kept per
+    # user, and seconds before a timeline is rebuilt from the database
+    TIMELINES_ENABLED: bool = False
+    TIMELINE_SIZE: int = 1000
+    TIMELINE_TTL_SECONDS: int = 24 * 60 * 60
+
+    # Adaptive refresh schedule: bounds and starting point of the learned interval
+    REFRESH_MIN_INTERVAL_SECONDS: int = 5 * 60
+    REFRESH_DEFAULT_INTERVAL_SECONDS: int = 15 * 60
+    REFRESH_MAX_INTERVAL_SECONDS: int = 24 * 60 * 60
+
+    # Followed feeds whose unread counts are recomputed per transaction by the
+    # periodic reconciliation
+    UNREAD_COUNT_RECONCILE_BATCH_SIZE: int = 500
+
+    # Monthly partitions of feed entries: months created ahead, full months of entries
+    # and of their raw payloads kept (forever if None), and whether expired entries
+    # are compacted down to those with user state, or months without any user state
+    # dropped whole
+    ENTRY_PARTITION_MONTHS_AHEAD: int = 2
+    ENTRY_RETENTION_MONTHS: Optional[int] = None
+    ENTRY_RAW_RETENTION_MONTHS: Optional[int] = None
+    ENTRY_RETENTION_MODE: Literal["compact", "drop"] = "compact"
+
+    # Streams of new entries: seconds between keepalives, which also reload the
+    # followed feeds, and announcements queued for a slow client before dropping
+    STREAM_KEEPALIVE_SECONDS: int = 30
+    STREAM_QUEUE_SIZE: int = 100
+
+    # WebSub push: public URL of the callback routes (/websub), push is disabled
+    # without it; lease asked of hubs, subscriptions renewed this long before they
+    # expire, and refresh interval of pushed feeds, a safety net for missed pushes
+    WEBSUB_CALLBACK_URL: Optional[str] = None
+    WEBSUB_LEASE_SECONDS: int = 10 * 24 * 60 * 60
+    WEBSUB_RENEW_BEFORE_SECONDS: int = 24 * 60 * 60
+    WEBSUB_POLL_INTERVAL_SECONDS: int = 12 * 60 * 60
+
+    # Port of the Prometheus exporter started by Celery workers, 0 to disable
+    WORKER_METRICS_PORT: int = 9540
 
     @property
     def REDIS_DSN(self) -> str:
@@ -0,0 +1,78 @@
+import json
+import logging
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from pydantic import parse_raw_as
+from pydantic.json import pydantic_encoder
+from redis import RedisError
+
+from api.models import CachedFeedEntry
+from cache import redis_client
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Cached lists are stored under a per-feed version. Invalidating bumps the version,
+# so that a reader filling the cache with rows it read before the bump writes to a
+# key nobody reads anymore instead of resurrecting stale entries.
+
+
+def get_version_key(feed_id: UUID) -> str:
+    return f"feed:{feed_id}:recent:version"
+
+
+def get_entries_key(feed_id: UUID, version: int) -> str:
+    return f"feed:{feed_id}:recent:{version}"
+
+
+def get_recent_entries(
+    feed_ids: Sequence[UUID],
+) -> Tuple[List[int], List[Optional[List[CachedFeedEntry]]]]:
+    """
+    Get the cached recent entries of several feeds in two round-trips.
+
+    Returns:
+        Tuple[List[int], List[Optional[List[CachedFeedEntry]]]]: The current cache
+        version of each feed, and its cached entries, newest first, or None on a miss.
+    """
+    versions = [
+        int(version) if version else 0
+        for version in redis_client.mget([get_version_key(f) for f in feed_ids])
+    ]
+    values = redis_client.mget(
+        [get_entries_key(f, v) for f, v in zip(feed_ids, versions)]
+    )
+    entries = [
+        parse_raw_as(List[CachedFeedEntry], value) if value is not None else None
+        for value in values
+    ]
+    return versions, entries
+
+
+def set_recent_entries(
+    feed_ids: Sequence[UUID],
+    versions: Sequence[int],
+    entries: Sequence[List[CachedFeedEntry]],
+) -> None:
+    """Cache the recent entries of several feeds, under the versions read before loading them"""
+    ttl = get_settings().ENTRY_CACHE_TTL_SECONDS
+    pipeline = redis_client.pipeline(transaction=False)
+    for feed_id, version, feed_entries in zip(feed_ids, versions, entries):
+        value = json.dumps(
+            [entry.dict() for entry in feed_entries], default=pydantic_encoder
+        )
+        pipeline.set(get_entries_key(feed_id, version), value, ex=ttl)
+    pipeline.execute()
+
+
+def invalidate_recent_entries(feed_id: UUID) -> None:
+    """Drop the cached recent entries of a feed, to be called after its entries change
+
+    Called once the change is committed, which must not fail because of the cache:
+    without Redis, the cached entries go stale until they expire.
+    """
+    try:
+        redis_client.incr(get_version_key(feed_id))
+    except RedisError as e:
+        logger.warning(f"{feed_id} recent entries not invalidated: {e!r}")
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import AbstractSet, AsyncIterator, Callable, Dict, Optional, Sequence, Set
+from uuid import UUID
+
+import orjson
+import redis.asyncio
+from redis import RedisError
+
+from cache import redis_client
+from config import get_settings
+
+# Entries created by refreshes and pushes are announced on a single Redis channel,
+# once committed. Every API process holds one subscription to it and hands each
+# announcement to the streams of its users that follow the feed, so that thousands
+# of open streams cost one Redis connection per process.
+
+ENTRY_CHANNEL = "entries:new"
+
+logger = logging.getLogger(__name__)
+
+
+def publish_new_entries(feed_id: UUID, entry_ids: Sequence[UUID]) -> None:
+    """Announce the created entries of a feed, to be called once they are committed
+
+    Streams are a best effort, failing to announce does not fail the refresh. Clients
+    catch up through the entries listing.
+    """
+    if not entry_ids:
+        return
+    message = orjson.dumps({"feed_id": feed_id, "entry_ids": entry_ids})
+    try:
+        redis_client.publish(ENTRY_CHANNEL, message)
+    except RedisError as e:
+        logger.warning(f"{feed_id} new entries not announced: {e!r}")
+
+
+class EntryStreams:
+    """
+    Streams of new entries open in this process, fed by a single subscription.
+
+    Each stream is a queue registered under the feeds it wants. Announcements are
+    routed by feed ID, and dropped for streams too slow to keep up with them.
+    """
+
+    def __init__(self) -> None:
+        self.queues: Dict[str, Set[asyncio.Queue[bytes]]] = defaultdict(set)
+        self.listener: Optional[asyncio.Task[None]] = None
+
+    def subscribe(self, queue: asyncio.Queue[bytes], feed_ids: AbstractSet[str]) -> None:
+        for feed_id in feed_ids:
+            self.queues[feed_id].add(queue)
+        self.start_listener()
+
+    def unsubscribe(
+        self, queue: asyncio.Queue[bytes], feed_ids: AbstractSet[str]
+    ) -> None:
+        for feed_id in feed_ids:
+            queues = self.queues.get(feed_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.queues[feed_id]
+
+    def start_listener(self) -> None:
+        """Subscribe to the channel on the running event loop, unless already done"""
+        loop = asyncio.get_running_loop()
+        if self.listener and not self.listener.done():
+            if self.listener.get_loop() is loop:
+                return
+            self.listener.cancel()
+        self.listener = loop.create_task(self.listen())
+
+    def dispatch(self, message: bytes) -> None:
+        feed_id = orjson.loads(message)["feed_id"]
+        for queue in self.queues.get(feed_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                pass
+
+    async def listen(self) -> None:
+        """Hand every announcement to the streams of its feed, reconnecting as needed"""
+        settings = get_settings()
+        while True:
+            client = redis.asyncio.Redis(
+                host=settings.REDIS_HOST, port=settings.REDIS_PORT
+            )
+            try:
+                async with client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(ENTRY_CHANNEL)
+                    async for message in pubsub.listen():
+                        self.dispatch(message["data"])
+            except RedisError as e:
+                logger.warning(f"Entry stream subscription lost: {e!r}")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()  # type: ignore
+
+
+entry_streams = EntryStreams()
+
+
+async def stream_entry_events(
+    load_feed_ids: Callable[[], Set[str]]
+) -> AsyncIterator[bytes]:
+    """
+    Server-sent events announcing the entries created in a set of feeds.
+
+    Every event carries the feed ID and the IDs of its new entries as JSON. A comment
+    is sent when nothing happened for a while, which keeps proxies from closing the
+    connection and is when the feeds are loaded again, streams being open for hours.
+
+    Args:
+        load_feed_ids (Callable[[], Set[str]]): Blocking function returning the IDs
+            of the feeds to stream, run in a thread.
+
+    Yields:
+        bytes: Chunks of the text/event-stream response.
+    """
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[bytes] = asyncio.Queue(settings.STREAM_QUEUE_SIZE)
+    feed_ids: Set[str] = set()
+    try:
+        while True:
+            followed = await asyncio.to_thread(load_feed_ids)
+            entry_streams.unsubscribe(queue, feed_ids - followed)
+            entry_streams.subscribe(queue, followed - feed_ids)
+            feed_ids = followed
+            yield b": keepalive\n\n"
+
+            deadline = loop.time() + settings.STREAM_KEEPALIVE_SECONDS
+            while (timeout := deadline - loop.time()) > 0:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                yield b"event: entries\ndata: " + message + b"\n\n"
+    finally:
+        entry_streams.unsubscribe(queue, feed_ids)
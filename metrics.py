@@ -0,0 +1,108 @@
+import logging
+import os
+from typing import Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics shared by the API and the Celery workers. Both run several
+# processes in production (uvicorn workers, prefork pool), in which case the
+# PROMETHEUS_MULTIPROC_DIR environment variable has to point to a directory shared by
+# the processes of a host, so that the exporter can aggregate all of them.
+
+# API
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, by route",
+    ["method", "route", "status"],
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing database statements per request",
+    ["route"],
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Database statements executed per request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+
+# Feed refresh
+REFRESH_PHASE_DURATION = Histogram(
+    "feed_refresh_phase_duration_seconds",
+    "Time spent downloading, parsing and persisting a feed",
+    ["phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+FEED_REFRESHES = Counter(
+    "feed_refreshes_total",
+    "Refreshes by outcome: changed, unchanged (same content), not_modified (304), failed",
+    ["outcome"],
+)
+FEED_REFRESH_FAILURES = Counter(
+    "feed_refresh_failures_total",
+    "Failed refreshes by what happens next: retry, give_up, or handover from a batch",
+    ["action"],
+)
+FEED_ENTRIES_WRITTEN = Counter(
+    "feed_entries_written_total",
+    "Feed entries written by refreshes, inserted or updated",
+    ["operation"],
+)
+WEBSUB_PUSHES = Counter(
+    "websub_pushes_total",
+    "Content pushed by WebSub hubs: stored, rejected (bad signature) or invalid",
+    ["result"],
+)
+LOCK_ATTEMPTS = Counter(
+    "lock_attempts_total",
+    "Lock attempts, acquired or contended (already held), mostly feed refresh locks",
+    ["result"],
+)
+
+
+def get_registry() -> CollectorRegistry:
+    """Registry to export, aggregating all processes when running in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)  # type: ignore
+    return registry
+
+
+def observe_request(
+    method: str,
+    route: Optional[str],
+    status_code: int,
+    duration: float,
+    db_duration: float,
+    db_statements: int,
+) -> None:
+    # Requests that matched no route are grouped to keep the number of series bounded
+    route = route or "unmatched"
+    REQUEST_DURATION.labels(method, route, status_code).observe(duration)
+    REQUEST_DB_DURATION.labels(route).observe(db_duration)
+    REQUEST_DB_STATEMENTS.labels(route).observe(db_statements)
+
+
+def start_metrics_server(port: int) -> None:
+    """Serve the metrics of this host's processes over HTTP, for processes without an API"""
+    try:
+        start_http_server(port, registry=get_registry())
+    except OSError as e:
+        logger.warning(f"Metrics server not started on port {port}: {e!r}")
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live series of an exited process in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)  # type: ignore
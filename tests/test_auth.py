@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from api import auth
+from api.dependencies import create_access_token, get_current_user
+from api.models import User
+from api.services import feed_service
+
+
+def test_run_password_task_verifies_off_the_event_loop() -> None:
+    # Arrange: Hash a password
+    hashed_password = auth.get_password_hash("secret")
+
+    # Act: Verify it on the password pool
+    verified = asyncio.run(
+        auth.run_password_task(auth.verify_password, "secret", hashed_password)
+    )
+
+    # Assert: Password matches
+    assert verified
+
+
+def test_run_password_task_rejects_when_queue_is_full(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Arrange: Every slot of the password pool is taken
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(auth, "password_slots", slots)
+
+    # Act: Try to verify a password
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(auth.run_password_task(auth.verify_password, "secret", "hash"))
+
+    # Assert: Request is turned away instead of queueing forever
+    assert exc_info.value.status_code == 503
+
+
+def test_get_current_user_reads_missing_users_off_the_event_loop(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Arrange: A token of a user who is not cached yet
+    user = User(username=f"reader-{uuid4()}")
+    lookup_threads = []
+
+    def get_user(username: str, primary: bool = False) -> User:
+        lookup_threads.append(threading.current_thread())
+        return user
+
+    monkeypatch.setattr(auth, "get_user", get_user)
+    token = create_access_token({"sub": user.username})
+
+    try:
+        # Act: Authenticate the token twice
+        first = asyncio.run(get_current_user(token))
+        second = asyncio.run(get_current_user(token))
+
+        # Assert: One lookup, which ran on a worker thread, then the cached user
+        assert first is second is user
+        assert len(lookup_threads) == 1
+        assert lookup_threads[0] is not threading.main_thread()
+    finally:
+        auth.invalidate_user(user.username)
+
+
+def test_writing_a_user_evicts_them_from_the_user_cache(session: Session) -> None:
+    # Arrange: A cached user
+    user = User(username=f"reader-{uuid4()}")
+    session.add(user)
+    session.flush()
+    auth.user_cache.set(user.username, user)
+
+    # Act: Change their read state version
+    feed_service.bump_state_version(session, user.uuid)
+
+    # Assert: The next request reads them again
+    assert auth.user_cache.get(user.username) is None
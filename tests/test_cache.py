@@ -0,0 +1,37 @@
+from typing import Any
+from uuid import uuid4
+
+import pytest
+from redis import RedisError
+
+from cache import acquire_lock, acquire_locks, redis_client, release_lock
+from entry_cache import invalidate_recent_entries
+
+
+def test_acquire_locks_skips_locks_already_held() -> None:
+    # Arrange: One of two locks is already held
+    lock_names = [f"test-lock:{uuid4()}", f"test-lock:{uuid4()}"]
+    acquire_lock(lock_names[0])
+
+    try:
+        # Act: Acquire both locks at once
+        acquired = acquire_locks(lock_names)
+
+        # Assert: Only the free lock is acquired
+        assert acquired == [False, True]
+    finally:
+        for lock_name in lock_names:
+            release_lock(lock_name)
+
+
+def test_invalidate_recent_entries_survives_redis_errors(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Arrange: Redis is unavailable
+    def fail(*args: Any, **kwargs: Any) -> None:
+        raise RedisError("Connection refused")
+
+    monkeypatch.setattr(redis_client, "incr", fail)
+
+    # Act / Assert: Invalidating after a commit does not raise
+    invalidate_recent_entries(uuid4())
@@ -0,0 +1,43 @@
+import asyncio
+from typing import List, Set
+from uuid import uuid4
+
+import orjson
+
+from cache import redis_client
+from entry_stream import ENTRY_CHANNEL, publish_new_entries, stream_entry_events
+
+
+def test_stream_entry_events_relays_announcements_of_followed_feeds() -> None:
+    # Arrange: Stream of one followed feed, next to a feed it doesn't follow
+    followed_feed_id, other_feed_id = uuid4(), uuid4()
+    entry_ids = [uuid4(), uuid4()]
+
+    def load_feed_ids() -> Set[str]:
+        return {str(followed_feed_id)}
+
+    async def read_stream() -> List[bytes]:
+        events = stream_entry_events(load_feed_ids)
+        chunks = [await events.__anext__()]
+
+        # Announce once the process subscribed to the channel
+        while not redis_client.pubsub_numsub(ENTRY_CHANNEL)[0][1]:
+            await asyncio.sleep(0.01)
+        publish_new_entries(other_feed_id, [uuid4()])
+        publish_new_entries(followed_feed_id, entry_ids)
+
+        chunks.append(await asyncio.wait_for(events.__anext__(), timeout=5))
+        await events.aclose()
+        return chunks
+
+    # Act: Open the stream and announce entries of both feeds
+    keepalive, event = asyncio.run(read_stream())
+
+    # Assert: Only the followed feed's entries come through, as one event
+    assert keepalive.startswith(b":")
+    name, data = event.removesuffix(b"\n\n").split(b"\n")
+    assert name == b"event: entries"
+    assert orjson.loads(data.removeprefix(b"data: ")) == {
+        "feed_id": str(followed_feed_id),
+        "entry_ids": [str(entry_id) for entry_id in entry_ids],
+    }
@@ -0,0 +1,57 @@
+from typing import Generator
+from uuid import uuid4
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+from sqlmodel import Session
+
+from api.db import create_db_engine, get_session
+from api.dependencies import get_current_user, read_session_dep
+from api.models import User
+from api.routers.feed import router
+from api.services import feed_service
+from config import get_settings
+
+
+def test_listing_is_validated_against_the_primary() -> None:
+    # Arrange: A user, and a replica whose snapshot is taken before their next write
+    user = User(username=f"reader-{uuid4()}")
+    with get_session() as session:
+        session.add(user)
+        session.commit()
+        session.refresh(user)
+
+    replica_engine = create_db_engine(get_settings().POSTGRES_DSN).execution_options(
+        isolation_level="REPEATABLE READ"
+    )
+    replica_session = Session(replica_engine)
+    replica_session.get(User, user.uuid)
+
+    def replica_session_dep() -> Generator[Session, None, None]:
+        yield replica_session
+
+    app = FastAPI()
+    app.include_router(router, prefix="/feed")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[read_session_dep] = replica_session_dep
+    client = TestClient(app)
+
+    try:
+        etag = client.get("/feed/entries").headers["ETag"]
+
+        # Act: The user changes their read state, which the replica has not seen yet
+        with get_session() as session:
+            feed_service.bump_state_version(session, user.uuid)
+            session.commit()
+        response = client.get("/feed/entries", headers={"If-None-Match": etag})
+
+        # Assert: The listing is sent again, tagged with the state it was read at
+        assert response.status_code == 200
+        assert response.headers["ETag"] == etag
+    finally:
+        replica_session.close()
+        replica_engine.dispose()
+        with get_session() as session:
+            session.execute(delete(User).where(User.uuid == user.uuid))
+            session.commit()
@@ -1,8 +1,20 @@
+from uuid import uuid4
+
 import feedparser
+from sqlalchemy import update
 from sqlmodel import Session, select
 
-from api.models import Feed, FeedEntry, ParsedFeed
+from api.db import create_db_engine
+from api.models import Feed, FeedEntry, FeedUser, ParsedFeed, User
 from api.services import feed_service
+from api.utils import (
+    encode_cursor,
+    encode_search_cursor,
+    get_entry_fingerprint,
+    get_feed_fingerprint,
+)
+from config import get_settings
+from entry_cache import get_recent_entries, invalidate_recent_entries
 
 
 def test_update_empty_feed(
@@ -16,9 +28,9 @@ def test_update_empty_feed(
 
     # Assert: Feed metadata is populated
     assert feed.title == fetched_feed.feed.get("title")
-    assert feed.hash != ""
+    assert feed.hash == get_feed_fingerprint(fetched_feed.feed)
     assert feed.published_at is not None
-    assert feed.raw is not None
+    assert feed_service.get_feed_raw(session, feed.uuid)["title"] == feed.title
 
 
 def test_update_existing_feed(
@@ -54,8 +66,13 @@ def test_update_or_create_feed_entries(
     entries = results.all()
     assert len(entries) > 0
     assert all(entry.title != "" for entry in entries)
-    assert all(entry.hash != "" for entry in entries)
-    assert all(entry.raw is not None for entry in entries)
+    assert sorted(entry.hash for entry in entries) == sorted(
+        get_entry_fingerprint(entry) for entry in fetched_feed.entries
+    )
+    assert all(
+        feed_service.get_feed_entry_raw(session, entry.uuid)["title"] == entry.title
+        for entry in entries
+    )
 
 
 def test_update_or_create_feed_entries_updates_existing_entries_when_content_different(
@@ -78,4 +95,299 @@ def test_update_or_create_feed_entries_updates_existing_entries_when_content_dif
     entries = feed.entries
     assert len(entries) > 0
     assert set(entry.title for entry in entries) != old_titles
-    assert all(entry.raw is not None for entry in entries)
+    assert all(
+        feed_service.get_feed_entry_raw(session, entry.uuid)["title"] == entry.title
+        for entry in entries
+    )
+
+
+def test_update_or_create_feed_entries_scopes_guids_by_feed(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create two feeds publishing the same entries
+    feed, fetched_feed = base_feed
+    other_feed = Feed(url="whatever-else")
+    session.add(other_feed)
+
+    # Act: Create feed entries for both feeds
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    feed_service.update_or_create_feed_entries(
+        feed=other_feed, fetched_feed=fetched_feed, session=session
+    )
+
+    # Assert: Each feed owns its own copy of the entries
+    assert len(feed.entries) == len(fetched_feed.entries)
+    assert len(other_feed.entries) == len(fetched_feed.entries)
+
+
+def test_update_or_create_feed_entries_skips_unchanged_entries(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create feed and feed entries
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    old_updated_at = {entry.uuid: entry.updated_at for entry in feed.entries}
+
+    # Act: Refresh with the exact same content
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+
+    # Assert: No entry was rewritten
+    assert {entry.uuid: entry.updated_at for entry in feed.entries} == old_updated_at
+
+
+def test_list_feed_entries_paginates_with_cursor(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create feed entries
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    user_id = uuid4()
+
+    # Act: Walk through the entries one page at a time
+    seen = []
+    cursor = None
+    while True:
+        page = feed_service.list_feed_entries(
+            session, user_id=user_id, feed_id=feed.uuid, limit=1, cursor=cursor
+        )
+        if not page:
+            break
+        seen.extend(entry.uuid for entry in page)
+        cursor = encode_cursor(page[-1].updated_at, page[-1].uuid)
+
+    # Assert: Every entry is returned exactly once
+    assert sorted(seen) == sorted(entry.uuid for entry in feed.entries)
+
+
+def test_recent_entries_cache_is_filled_from_the_primary(rss_base: bytes) -> None:
+    # Arrange: Entries only a replica session sees, as if the primary lagged behind
+    feed = Feed(url="whatever")
+    fetched_feed: ParsedFeed = feedparser.parse(rss_base)
+    replica_engine = create_db_engine(get_settings().POSTGRES_DSN)
+    replica_session = Session(replica_engine)
+    replica_session.add(feed)
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=replica_session
+    )
+
+    try:
+        # Act: List the feed on the replica session, missing the cache
+        entries = feed_service.list_feed_entries(
+            replica_session, user_id=uuid4(), feed_id=feed.uuid
+        )
+
+        # Assert: The cache holds what the primary has, not what the replica read
+        assert entries == []
+        assert get_recent_entries([feed.uuid])[1] == [[]]
+    finally:
+        invalidate_recent_entries(feed.uuid)
+        replica_session.rollback()
+        replica_session.close()
+        replica_engine.dispose()
+
+
+def test_list_feed_entries_merges_read_state_into_cached_entries(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create feed entries and mark the newest one as read
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    user = User(username=f"reader-{uuid4()}")
+    session.add(user)
+    all_entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid
+    )
+    feed_service.update_feed_entry_user(session, user.uuid, all_entries[0].uuid, True)
+    session.flush()
+
+    # Act: List read and unread entries of the feed from the recent entries cache
+    read_entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid, read=True
+    )
+    unread_entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid, read=False
+    )
+
+    # Assert: Read state is applied to the cached entries
+    assert [entry.uuid for entry in read_entries] == [all_entries[0].uuid]
+    assert [entry.uuid for entry in unread_entries] == [
+        entry.uuid for entry in all_entries[1:]
+    ]
+
+
+def test_mark_feed_read_combines_watermark_with_entry_state(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create feed entries, then mark the feed as read up to the second newest
+    # one and the newest one as read on its own
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    user = User(username=f"reader-{uuid4()}")
+    session.add(user)
+    all_entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid
+    )
+    feed_service.mark_feed_read(
+        session, user.uuid, feed.uuid, read_until=all_entries[1].updated_at
+    )
+    feed_service.update_feed_entry_user(session, user.uuid, all_entries[0].uuid, True)
+    feed_service.update_feed_entry_user(session, user.uuid, all_entries[1].uuid, False)
+    session.flush()
+
+    # Act: List unread entries from the recent entries cache and from the database
+    cached_unread = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid, read=False
+    )
+    stored_unread = feed_service.list_feed_entries(
+        session, user_id=user.uuid, read=False, limit=1000
+    )
+
+    # Assert: Only the entry marked unread below the watermark is unread
+    assert [entry.uuid for entry in cached_unread] == [all_entries[1].uuid]
+    feed_entry_ids = {entry.uuid for entry in all_entries}
+    assert [e.uuid for e in stored_unread if e.uuid in feed_entry_ids] == [
+        all_entries[1].uuid
+    ]
+
+
+def test_unread_counts_follow_entries_and_read_state(
+    session: Session, base_feed: tuple[Feed, ParsedFeed], rss_updated_entries: bytes
+) -> None:
+    # Arrange: Follow a feed that already has entries
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    user = User(username=f"reader-{uuid4()}")
+    session.add(user)
+    session.flush()
+    feed_service.follow_feed(session, user.uuid, feed.url)  # type: ignore
+    entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid
+    )
+
+    def get_unread_count() -> int:
+        counts = feed_service.get_unread_counts(session, user.uuid)
+        return counts[0].unread_count
+
+    # Act & Assert: Every change of read state moves the counter
+    assert get_unread_count() == len(entries)
+    feed_service.update_feed_entry_user(session, user.uuid, entries[0].uuid, True)
+    assert get_unread_count() == len(entries) - 1
+    feed_service.mark_feed_read(session, user.uuid, feed.uuid, read_until=None)
+    assert get_unread_count() == 0
+
+    # Updated entries come back above the watermark
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=feedparser.parse(rss_updated_entries), session=session
+    )
+    invalidate_recent_entries(feed.uuid)
+    unread_entries = feed_service.list_feed_entries(
+        session, user_id=user.uuid, feed_id=feed.uuid, read=False
+    )
+    assert get_unread_count() == len(unread_entries) > 0
+
+    # Drifted counters are corrected by the reconciliation
+    session.execute(
+        update(FeedUser)
+        .where(FeedUser.feed_id == feed.uuid)  # type: ignore
+        .values(unread_count=1000)
+    )
+    assert feed_service.reconcile_unread_counts(session, [feed.uuid]) == 1
+    assert get_unread_count() == len(unread_entries)
+
+
+def test_inserting_entries_does_not_write_followers_rows(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: A feed with many followers
+    feed, fetched_feed = base_feed
+    users = [User(username=f"reader-{uuid4()}") for _ in range(200)]
+    session.add_all(users)
+    session.flush()
+    session.add_all(FeedUser(feed_id=feed.uuid, user_id=user.uuid) for user in users)
+    session.flush()
+
+    # Act: Insert the feed's entries
+    inserted = feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+
+    # Assert: The stored counts are untouched, the inserted entries are counted
+    statement = select(FeedUser.unread_count).where(FeedUser.feed_id == feed.uuid)
+    assert set(session.exec(statement).all()) == {0}
+    for user in users[:3]:
+        counts = feed_service.get_unread_counts(session, user.uuid)
+        assert counts[0].unread_count == inserted > 0
+    assert feed_service.reconcile_unread_counts(session, [feed.uuid]) == 0
+
+
+def test_search_feed_entries_ranks_and_paginates(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Create feed entries and pick a word of the first entry's title
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    title = fetched_feed.entries[0]["title"]
+    word = max(title.split(), key=len)
+
+    # Act: Search for the word one result at a time
+    results = feed_service.search_feed_entries(
+        session, user_id=uuid4(), text=word, feed_id=feed.uuid, limit=1
+    )
+    entry = results[0]
+    next_page = feed_service.search_feed_entries(
+        session,
+        user_id=uuid4(),
+        text=word,
+        feed_id=feed.uuid,
+        limit=1,
+        cursor=encode_search_cursor(entry.rank, entry.uuid),
+    )
+    no_match = feed_service.search_feed_entries(
+        session, user_id=uuid4(), text="zzyzx-nothing", feed_id=feed.uuid
+    )
+
+    # Assert: The title match comes first and the cursor moves past it
+    assert entry.title == title and entry.rank > 0
+    assert all(e.uuid != entry.uuid for e in next_page)
+    assert no_match == []
+
+
+def test_listing_validator_changes_with_entries_and_read_state(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Follow a feed and take the validator of its listing
+    feed, fetched_feed = base_feed
+    user = User(username=f"reader-{uuid4()}")
+    session.add(user)
+    session.flush()
+    feed_service.follow_feed(session, user.uuid, feed.url)  # type: ignore
+    validator = feed_service.get_listing_validator(session, user.uuid, feed.uuid)
+
+    # Act: Write the feed's entries, then mark the feed as read
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    session.flush()
+    refreshed = feed_service.get_listing_validator(session, user.uuid, feed.uuid)
+    feed_service.mark_feed_read(session, user.uuid, feed.uuid, read_until=None)
+    read = feed_service.get_listing_validator(session, user.uuid, feed.uuid)
+
+    # Assert: Every change invalidates the previous validator, reading doesn't
+    assert len({validator, refreshed, read}) == 3
+    assert feed_service.get_listing_validator(session, user.uuid, feed.uuid) == read
@@ -0,0 +1,51 @@
+import asyncio
+
+import httpx
+
+from background.fetcher import FetchResult, fetch_feed_async, get_conditional_headers
+
+
+def test_get_conditional_headers_sends_stored_validators() -> None:
+    # Act: Build headers from validators of a previous fetch
+    headers = get_conditional_headers(
+        etag='"abc"', last_modified="Wed, 21 Oct 2015 07:28:00 GMT"
+    )
+
+    # Assert: Both validators are sent back to the server
+    assert headers == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+
+
+def test_get_conditional_headers_empty_for_unfetched_feed() -> None:
+    # Act: Build headers for a feed that was never fetched
+    headers = get_conditional_headers(etag=None, last_modified=None)
+
+    # Assert: Request is unconditional
+    assert headers == {}
+
+
+def test_fetch_feed_async_returns_not_modified(rss_base: bytes) -> None:
+    # Arrange: Server that only answers 304 when the ETag matches
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, content=rss_base, headers={"ETag": '"v1"'})
+
+    async def fetch_twice() -> tuple[FetchResult, FetchResult]:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            first = await fetch_feed_async(client, "http://feed.test/rss")
+            second = await fetch_feed_async(
+                client, "http://feed.test/rss", etag=first.etag
+            )
+            return first, second
+
+    # Act: Fetch once, then again with the returned validator
+    first, second = asyncio.run(fetch_twice())
+
+    # Assert: First fetch has the body, second one is a bodyless 304
+    assert not first.not_modified
+    assert first.content_length == len(rss_base)
+    assert second.not_modified
+    assert second.body == b""
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from api.errors import NotFoundError
+from api.middleware import SERVER_TIMING_HEADER, ExceptionHandlerMiddleware
+from api.timing import TimedRoute, timed
+
+
+def create_app() -> FastAPI:
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.get("/ok")
+    def ok() -> dict:
+        with timed("auth"):
+            pass
+        return {"status": "ok"}
+
+    @router.get("/missing")
+    def missing() -> dict:
+        raise NotFoundError("Feed not found.")
+
+    app = FastAPI()
+    app.add_middleware(ExceptionHandlerMiddleware)
+    app.include_router(router)
+    return app
+
+
+def test_middleware_reports_phase_timings() -> None:
+    # Arrange: App with a route that records an auth phase
+    client = TestClient(create_app())
+
+    # Act: Call the route
+    response = client.get("/ok")
+
+    # Assert: Response is untouched and carries the phases it went through
+    assert response.json() == {"status": "ok"}
+    server_timing = response.headers[SERVER_TIMING_HEADER]
+    assert "auth;dur=" in server_timing
+    assert "serialize;dur=" in server_timing
+    assert "total;dur=" in server_timing
+
+
+def test_middleware_maps_errors_to_json() -> None:
+    # Arrange: App with a route that raises a domain error
+    client = TestClient(create_app())
+
+    # Act: Call the route
+    response = client.get("/missing")
+
+    # Assert: Error keeps the standard JSON shape, timings included
+    assert response.status_code == 404
+    assert response.json() == {"error": "not_found", "message": "Feed not found."}
+    assert SERVER_TIMING_HEADER in response.headers
+
+
+def test_middleware_observes_route_latency() -> None:
+    # Arrange: App with a route, and the requests it has seen so far
+    client = TestClient(create_app())
+    labels = {"method": "GET", "route": "/ok", "status": "200"}
+    before = REGISTRY.get_sample_value("http_request_duration_seconds_count", labels)
+
+    # Act: Call the route
+    client.get("/ok")
+
+    # Assert: Request is counted in the latency histogram of its route
+    after = REGISTRY.get_sample_value("http_request_duration_seconds_count", labels)
+    assert after == (before or 0) + 1
@@ -0,0 +1,130 @@
+import feedparser
+
+from api.utils import get_entry_fingerprint, get_entry_guid, get_feed_fingerprint
+from background.parsing import StreamLimits, parse_feed_stream
+
+NO_LIMITS = StreamLimits(max_bytes=10**7, max_entries=1000, stop_after_known=0)
+
+
+def build_rss(count: int) -> bytes:
+    """RSS document with `count` items, newest first"""
+    items = "".join(
+        f"<item><title>Item {i}</title><guid>item-{i}</guid>"
+        f"<pubDate>Wed, 25 Oct 2023 {23 - i % 24:02d}:00:00 GMT</pubDate></item>"
+        for i in range(count)
+    )
+    return f"<rss><channel><title>Feed</title>{items}</channel></rss>".encode()
+
+
+RSS_WITH_HTML = b"""<rss version="2.0"><channel>
+<title>Feed</title><link>http://example.com/</link>
+<description>&lt;b&gt;Bold&lt;/b&gt; feed</description>
+<item>
+<title>A &lt;i&gt;styled&lt;/i&gt; title</title><guid>http://example.com/1</guid>
+<description><![CDATA[<p><a href="/a">A</a><script>alert(1)</script></p>]]></description>
+</item>
+<item>
+<title>Inline</title><guid isPermaLink="false">2</guid>
+<description>Some <b onclick="x()">inline</b> markup</description>
+</item>
+<item>
+<title>Full content</title><guid isPermaLink="false">3</guid>
+<content:encoded xmlns:content="http://purl.org/rss/1.0/modules/content/"
+>&lt;p onclick="x()"&gt;Full&lt;/p&gt;</content:encoded>
+</item>
+</channel></rss>"""
+
+ATOM_WITH_CONTENT = b"""<feed xmlns="http://www.w3.org/2005/Atom" xml:base="http://example.com/blog/">
+<title type="html">&lt;em&gt;Blog&lt;/em&gt;</title><link href="/"/><id>urn:blog</id>
+<entry>
+<title>Html</title><link href="posts/1"/><id>tag:1</id>
+<content type="html">&lt;a href="img.png"&gt;A&lt;/a&gt;&lt;script&gt;x()&lt;/script&gt;</content>
+</entry>
+<entry>
+<title type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">An <b>xhtml</b> title</div></title>
+<link href="posts/2"/><id>tag:2</id>
+<content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">
+<p><a href="rel" onclick="x()">Link</a><br/></p><script>x()</script>
+</div></content>
+</entry>
+<entry>
+<title>Text</title><id>http://example.com/3</id>
+<summary>A &lt;b&gt;text&lt;/b&gt; summary</summary><content type="html">Content</content>
+</entry>
+<entry xml:base="http://other.example.com/">
+<title>Base</title><link href="4"/><id>tag:4</id>
+<summary type="html">&lt;a href="s"&gt;S&lt;/a&gt;</summary>
+</entry>
+</feed>"""
+
+
+def assert_same_as_feedparser(body: bytes) -> None:
+    """The streaming parser stores the same values and fingerprints as feedparser"""
+    expected = feedparser.parse(body)
+    parsed = parse_feed_stream(body, NO_LIMITS)
+
+    assert get_feed_fingerprint(parsed.feed) == get_feed_fingerprint(expected.feed)
+    assert len(parsed.entries) == len(expected.entries)
+    for entry, expected_entry in zip(parsed.entries, expected.entries):
+        for key in ("title", "link", "id", "summary"):
+            assert entry.get(key) == expected_entry.get(key)
+        assert get_entry_fingerprint(entry) == get_entry_fingerprint(expected_entry)
+
+
+def test_parse_feed_stream_matches_feedparser(rss_base: bytes) -> None:
+    # Act: Parse the same document with both parsers
+    expected = feedparser.parse(rss_base)
+    parsed = parse_feed_stream(rss_base, NO_LIMITS)
+
+    # Assert: Fields used by the refresh are the same
+    assert parsed.feed["title"] == expected.feed["title"]
+    assert len(parsed.entries) == len(expected.entries)
+    for entry, expected_entry in zip(parsed.entries, expected.entries):
+        for key in ("title", "link", "guid", "description", "published_parsed"):
+            assert entry.get(key) == expected_entry.get(key)
+
+
+def test_parse_feed_stream_stops_after_known_entries() -> None:
+    # Arrange: Items 2 and up are already stored unchanged
+    body = build_rss(20)
+    stored = parse_feed_stream(body, NO_LIMITS).entries[2:]
+    entry_hashes = {get_entry_guid(e): get_entry_fingerprint(e) for e in stored}
+    limits = StreamLimits(max_bytes=10**7, max_entries=1000, stop_after_known=3)
+
+    # Act: Parse the document knowing the stored entries
+    parsed = parse_feed_stream(body, limits, entry_hashes)
+
+    # Assert: Parsing stops after the two new items and three known ones
+    assert [e["title"] for e in parsed.entries] == [f"Item {i}" for i in range(5)]
+
+
+def test_parse_feed_stream_caps_entries() -> None:
+    # Act: Parse a large feed with an entry cap
+    limits = StreamLimits(max_bytes=10**7, max_entries=10, stop_after_known=0)
+    parsed = parse_feed_stream(build_rss(100), limits)
+
+    # Assert: Only the first entries are read
+    assert len(parsed.entries) == 10
+
+
+def test_parse_feed_stream_sanitizes_html_like_feedparser() -> None:
+    # Act / Assert: RSS titles and descriptions holding escaped and inline markup
+    assert_same_as_feedparser(RSS_WITH_HTML)
+
+    # Assert: Scripts and event handlers are not kept
+    entries = parse_feed_stream(RSS_WITH_HTML, NO_LIMITS).entries
+    assert entries[0]["summary"] == '<p><a href="/a">A</a></p>'
+    assert entries[1]["summary"] == "Some <b>inline</b> markup"
+    assert entries[2]["summary"] == "<p>Full</p>"
+
+
+def test_parse_feed_stream_reads_atom_content_like_feedparser() -> None:
+    # Act / Assert: Atom html, xhtml and text constructs, under xml:base
+    assert_same_as_feedparser(ATOM_WITH_CONTENT)
+
+    # Assert: xhtml content is kept, with its relative URIs resolved
+    entries = parse_feed_stream(ATOM_WITH_CONTENT, NO_LIMITS).entries
+    assert entries[1]["link"] == "http://example.com/blog/posts/2"
+    assert entries[1]["summary"] == (
+        '<p><a href="http://example.com/blog/rel">Link</a><br /></p>'
+    )
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session, select
+
+from api import partitions
+from api.models import Feed, FeedEntry, FeedEntryUser, User
+
+
+@pytest.fixture
+def old_entries(session: Session) -> tuple[FeedEntry, FeedEntry]:
+    """Two entries created a year ago, the first one with read state"""
+    month = partitions.add_months(partitions.get_month_start(datetime.now()), -12)
+    partitions.create_partition(session.connection(), month)
+
+    feed = Feed(url="whatever")
+    user = User(username="whoever")
+    created_at = month + timedelta(days=1)
+    read_entry = FeedEntry(feed_id=feed.uuid, guid="read", created_at=created_at)
+    other_entry = FeedEntry(feed_id=feed.uuid, guid="other", created_at=created_at)
+    session.add_all([feed, user, read_entry, other_entry])
+    session.flush()
+    session.add(
+        FeedEntryUser(
+            feed_entry_id=read_entry.uuid,
+            user_id=user.uuid,
+            entry_created_at=created_at,
+            is_read=True,
+        )
+    )
+    session.flush()
+    return read_entry, other_entry
+
+
+def test_expire_partitions_compacts_entries_without_user_state(
+    session: Session, old_entries: tuple[FeedEntry, FeedEntry]
+) -> None:
+    # Act: Keep six months of entries
+    _, entry_months, feed_ids = partitions.expire_partitions(
+        session.connection(), 6, None, "compact"
+    )
+
+    # Assert: Only the entry with read state is left, and its feed is reported
+    statement = select(FeedEntry.guid).where(
+        FeedEntry.uuid.in_([entry.uuid for entry in old_entries])  # type: ignore
+    )
+    assert entry_months == 1
+    assert feed_ids == {old_entries[0].feed_id}
+    assert session.exec(statement).all() == ["read"]
+
+    # Act: Run the retention again
+    _, entry_months, feed_ids = partitions.expire_partitions(
+        session.connection(), 6, None, "compact"
+    )
+
+    # Assert: Nothing left to expire, no feed is reported again
+    assert entry_months == 0
+    assert feed_ids == set()
+
+
+def test_expire_partitions_drops_months_without_user_state(
+    session: Session, old_entries: tuple[FeedEntry, FeedEntry]
+) -> None:
+    # Arrange: An older month without any read state
+    stateless_month = partitions.add_months(
+        partitions.get_month_start(old_entries[0].created_at), -1
+    )
+    partitions.create_partition(session.connection(), stateless_month)
+    feed = Feed(url="stateless")
+    session.add(feed)
+    session.flush()
+    session.add(FeedEntry(feed_id=feed.uuid, guid="old", created_at=stateless_month))
+    session.flush()
+
+    # Act: Keep six months of entries
+    _, entry_months, feed_ids = partitions.expire_partitions(
+        session.connection(), 6, None, "drop"
+    )
+
+    # Assert: The stateless month is gone from every entry table
+    for table in partitions.ENTRY_TABLES:
+        months = partitions.list_partition_months(session.connection(), table)
+        assert stateless_month not in months
+
+    # Assert: The month with read state is compacted instead, keeping the state
+    statement = select(FeedEntry.guid).where(
+        FeedEntry.uuid.in_([entry.uuid for entry in old_entries])  # type: ignore
+    )
+    state_statement = select(FeedEntryUser.feed_entry_id).where(
+        FeedEntryUser.feed_entry_id == old_entries[0].uuid
+    )
+    assert session.exec(statement).all() == ["read"]
+    assert session.exec(state_statement).all() == [old_entries[0].uuid]
+    assert entry_months == 2
+    assert feed_ids == {feed.uuid, old_entries[0].feed_id}
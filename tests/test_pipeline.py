@@ -0,0 +1,100 @@
+import asyncio
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import delete, event
+
+from api.db import engine, get_session
+from api.models import Feed
+from background import pipeline
+from background.fetcher import FetchRequest, FetchResult
+from background.parsing import StreamLimits
+from background.pipeline import parse_feed_body
+
+
+def test_parse_feed_body_returns_parsed_feed(rss_base: bytes) -> None:
+    # Act: Parse a valid feed body the way the process pool does
+    fetched_feed, elapsed = parse_feed_body(rss_base)
+
+    # Assert: Feed survives the trip back from a worker process
+    assert pickle.loads(pickle.dumps(fetched_feed)).entries == fetched_feed.entries
+    assert elapsed >= 0
+
+
+def test_parse_feed_body_raises_picklable_error() -> None:
+    # Act: Parse a truncated feed body
+    with pytest.raises(ValueError) as exc_info:
+        parse_feed_body(b"<rss><channel><item><title>Truncated</title></chan")
+
+    # Assert: Error can be sent back from a worker process
+    assert isinstance(pickle.loads(pickle.dumps(exc_info.value)), ValueError)
+
+
+def test_parse_feed_body_caps_documents_left_to_feedparser() -> None:
+    # Arrange: A large RDF document, which the streaming parser does not handle
+    items = "".join(f"<item><title>Item {i}</title></item>" for i in range(100))
+    namespace = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    body = f'<rdf:RDF xmlns:rdf="{namespace}">{items}</rdf:RDF>'
+    limits = StreamLimits(max_bytes=1024, max_entries=1000, stop_after_known=0)
+
+    # Act / Assert: It is refused instead of being parsed in full by feedparser
+    with pytest.raises(ValueError):
+        parse_feed_body(body.encode(), limits)
+
+
+def test_not_modified_refresh_only_reschedules_the_feed(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # Arrange: A stored feed whose server answers 304 to its validator
+    with get_session() as session:
+        feed = Feed(url=f"http://feed.test/{uuid4()}", etag='"v1"')
+        session.add(feed)
+        session.commit()
+        session.refresh(feed)
+    fetch_request = FetchRequest(feed_id=feed.uuid, url=feed.url, etag=feed.etag)
+
+    async def answer_not_modified(
+        fetch_requests: List[FetchRequest], results: asyncio.Queue, **kwargs: Any
+    ) -> None:
+        for fetch_request in fetch_requests:
+            result = FetchResult(status=304, body=b"", etag='"v1"', last_modified=None)
+            await results.put((fetch_request, result))
+
+    parsed_bodies: List[bytes] = []
+    statements: List[str] = []
+    monkeypatch.setattr(pipeline, "fetch_feeds", answer_not_modified)
+    monkeypatch.setattr(
+        pipeline, "get_parse_executor", lambda: (ThreadPoolExecutor(1), 1)
+    )
+    monkeypatch.setattr(
+        pipeline, "parse_feed_body", lambda body, *args: parsed_bodies.append(body)
+    )
+
+    def record_statement(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        # Act: Refresh the feed
+        outcomes = asyncio.run(pipeline.run_refresh_pipeline([fetch_request]))
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+        with get_session() as session:
+            session.execute(delete(Feed).where(Feed.uuid == feed.uuid))
+            session.commit()
+
+    # Assert: Nothing is parsed, and the only write is the feed's schedule
+    assert outcomes == [(fetch_request, None)]
+    assert parsed_bodies == []
+    writes = [
+        statement
+        for statement in statements
+        if statement.split()[0] in ("INSERT", "UPDATE", "DELETE")
+    ]
+    assert writes == [
+        "UPDATE feed SET next_refresh_at=%(next_refresh_at)s, "
+        "refresh_interval=%(refresh_interval)s WHERE feed.uuid = %(feed_uuid)s"
+    ]
@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Any, List
+from uuid import uuid4
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from api.models import CachedFeedEntry, Feed, FeedEntryRead, ParsedFeed
+from api.responses import RowsResponse
+from api.services import feed_service
+
+
+def test_rows_response_matches_response_model_output(
+    session: Session, base_feed: tuple[Feed, ParsedFeed]
+) -> None:
+    # Arrange: Listed rows, cached entries with edge cases in their values, and two
+    # routes returning them through the response model and as a RowsResponse
+    feed, fetched_feed = base_feed
+    feed_service.update_or_create_feed_entries(
+        feed=feed, fetched_feed=fetched_feed, session=session
+    )
+    rows = feed_service.list_feed_entries(session, user_id=uuid4(), limit=100)
+    cached_entries = [
+        CachedFeedEntry(
+            uuid=uuid4(),
+            feed_id=feed.uuid,
+            title='Çà "quoted" \\ </script>   \x1f 🌶️',
+            link=None,
+            description="",
+            published_at=datetime(2023, 10, 17, 8, 30),
+            updated_at=datetime(2023, 10, 17, 8, 30, 0, 123456),
+            created_at=None,
+        )
+    ]
+    listings: List[Any] = [rows, cached_entries, []]
+
+    app = FastAPI()
+
+    @app.get("/model/{i}", response_model=List[FeedEntryRead])
+    def list_with_model(i: int) -> Any:
+        return listings[i]
+
+    @app.get("/rows/{i}", response_model=List[FeedEntryRead])
+    def list_with_rows(i: int) -> Any:
+        return RowsResponse(listings[i], FeedEntryRead)
+
+    client = TestClient(app)
+
+    # Act & Assert: Both paths produce the same bytes and content type
+    for i in range(len(listings)):
+        expected = client.get(f"/model/{i}")
+        actual = client.get(f"/rows/{i}")
+        assert actual.content == expected.content
+        assert actual.headers["content-type"] == expected.headers["content-type"]
+    assert len(rows) > 0
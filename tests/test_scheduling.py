@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from background.scheduling import learn_refresh_interval
+from config import get_settings
+
+
+def test_learn_refresh_interval_backs_off_when_unchanged() -> None:
+    # Act: Refresh found nothing new
+    interval = learn_refresh_interval(current_interval=600, changed=False)
+
+    # Assert: Feed is polled less often
+    assert interval > 600
+
+
+def test_learn_refresh_interval_follows_posting_rate() -> None:
+    # Arrange: Feed that posts every hour
+    now = datetime.now()
+    entry_dates = [now - timedelta(hours=i) for i in range(10)]
+
+    # Act: Refresh found changes while polling every 6 hours
+    interval = learn_refresh_interval(
+        current_interval=6 * 3600, changed=True, entry_dates=entry_dates
+    )
+
+    # Assert: Interval moves towards the hourly posting rate
+    assert 3600 < interval < 6 * 3600
+
+
+def test_learn_refresh_interval_stays_within_bounds() -> None:
+    # Arrange: Server asks to be left alone for a week
+    settings = get_settings()
+
+    # Act: Compute interval honoring the server's max-age
+    interval = learn_refresh_interval(
+        current_interval=None, changed=True, max_age=7 * 24 * 3600
+    )
+
+    # Assert: Interval is capped by the configured maximum
+    assert interval == settings.REFRESH_MAX_INTERVAL_SECONDS
@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+from typing import List
+from uuid import UUID
+
+import pytest
+from sqlmodel import Session
+
+import entry_cache
+import timelines
+from api.db import create_db_engine
+from api.models import Feed, FeedEntry, FeedUser, User, WrittenEntry
+from api.services import feed_service
+from api.utils import encode_cursor
+from cache import redis_client
+from config import get_settings
+
+
+def list_all_entries(session: Session, user_id: UUID, limit: int) -> List[UUID]:
+    """IDs of the whole followed-only listing, walked one page at a time"""
+    seen: List[UUID] = []
+    cursor = None
+    while True:
+        page = feed_service.list_feed_entries(
+            session, user_id=user_id, followed_only=True, limit=limit, cursor=cursor
+        )
+        if not page:
+            return seen
+        seen.extend(entry.uuid for entry in page)
+        cursor = encode_cursor(page[-1].updated_at, page[-1].uuid)
+
+
+def test_timeline_listing_matches_database_listing(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Arrange: A user following a feed with more entries than their timeline holds
+    user = User(username="timeline-reader")
+    feed = Feed(url="whatever")
+    now = datetime.now()
+    entries = [
+        FeedEntry(
+            feed_id=feed.uuid,
+            guid=f"entry-{i}",
+            created_at=now - timedelta(hours=i),
+            updated_at=now - timedelta(hours=i),
+        )
+        for i in range(5)
+    ]
+    session.add_all([user, feed, *entries])
+    session.flush()
+    session.add(FeedUser(feed_id=feed.uuid, user_id=user.uuid))
+    session.flush()
+    stored_entry_ids = list_all_entries(session, user.uuid, limit=2)
+
+    monkeypatch.setattr(get_settings(), "TIMELINES_ENABLED", True)
+    monkeypatch.setattr(get_settings(), "TIMELINE_SIZE", 3)
+    try:
+        # Act: Build the timeline, and list through its floor into the database
+        listed_entry_ids = list_all_entries(session, user.uuid, limit=2)
+
+        # Assert: Same listing, the timeline holds the newest entries
+        assert listed_entry_ids == stored_entry_ids
+        members = timelines.read_timeline(user.uuid, "+inf", "-inf", 0, 10)
+        assert [timelines.parse_member(m)[0] for m, _ in members] == [
+            entry.uuid for entry in entries[:3]
+        ]
+
+        # Act: Push a new entry of the feed
+        new_entry = FeedEntry(feed_id=feed.uuid, guid="new", created_at=datetime.now())
+        session.add(new_entry)
+        session.flush()
+        feed_service.push_to_timelines(
+            session,
+            [
+                WrittenEntry(
+                    uuid=new_entry.uuid,
+                    feed_id=feed.uuid,
+                    created_at=new_entry.created_at,
+                    updated_at=new_entry.updated_at,  # type: ignore
+                    created=True,
+                )
+            ],
+        )
+
+        # Assert: It comes first, and the timeline stays capped
+        page = feed_service.list_feed_entries(
+            session, user_id=user.uuid, followed_only=True, limit=1
+        )
+        assert [entry.uuid for entry in page] == [new_entry.uuid]
+        assert redis_client.zcard(timelines.get_timeline_key(user.uuid)) == 3
+
+        # Act: Prune the feed from the timeline
+        timelines.prune_feed(user.uuid, feed.uuid)
+
+        # Assert: The timeline is empty
+        assert not redis_client.exists(timelines.get_timeline_key(user.uuid))
+    finally:
+        redis_client.delete(
+            timelines.get_timeline_key(user.uuid), timelines.get_floor_key(user.uuid)
+        )
+
+
+def test_timeline_is_built_from_the_primary(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange: A followed entry only a replica session sees, as if the primary lagged
+    user = User(username="timeline-reader")
+    feed = Feed(url="whatever")
+    entry = FeedEntry(feed_id=feed.uuid, guid="entry", created_at=datetime.now())
+    replica_engine = create_db_engine(get_settings().POSTGRES_DSN)
+    replica_session = Session(replica_engine)
+    replica_session.add_all([user, feed, entry])
+    replica_session.flush()
+    replica_session.add(FeedUser(feed_id=feed.uuid, user_id=user.uuid))
+    replica_session.flush()
+    monkeypatch.setattr(get_settings(), "TIMELINES_ENABLED", True)
+
+    try:
+        # Act: Build the timeline through a listing on the replica session
+        feed_service.list_feed_entries(replica_session, user.uuid, followed_only=True)
+
+        # Assert: The timeline holds what the primary has, not what the replica read
+        assert timelines.get_floor(user.uuid) == "0"
+        assert not redis_client.exists(timelines.get_timeline_key(user.uuid))
+    finally:
+        redis_client.delete(
+            timelines.get_timeline_key(user.uuid), timelines.get_floor_key(user.uuid)
+        )
+        replica_session.rollback()
+        replica_session.close()
+        replica_engine.dispose()
+
+
+def test_evict_expired_entries_drops_followers_timelines(
+    session: Session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Arrange: A built timeline of a follower of the feed
+    user = User(username="timeline-reader")
+    feed = Feed(url="whatever")
+    session.add_all([user, feed])
+    session.flush()
+    session.add(FeedUser(feed_id=feed.uuid, user_id=user.uuid))
+    session.flush()
+    monkeypatch.setattr(get_settings(), "TIMELINES_ENABLED", True)
+    feed_service.list_feed_entries(session, user.uuid, followed_only=True)
+    version = entry_cache.get_version_key(feed.uuid)
+    cached_version = int(redis_client.get(version) or 0)
+
+    try:
+        # Act: Evict the feed after retention deleted some of its entries
+        feed_service.evict_expired_entries(session, [feed.uuid])
+
+        # Assert: The timeline is built again, and the recent entries reloaded
+        assert timelines.get_floor(user.uuid) is None
+        assert int(redis_client.get(version) or 0) == cached_version + 1
+    finally:
+        redis_client.delete(
+            timelines.get_timeline_key(user.uuid), timelines.get_floor_key(user.uuid)
+        )
@@ -0,0 +1,52 @@
+import time
+
+from api.utils import TTLCache, get_entry_fingerprint
+
+
+def test_ttl_cache_evicts_least_recently_used_item() -> None:
+    # Arrange: Fill a cache of two items and use the oldest one again
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    # Act: Add a third item
+    cache.set("c", 3)
+
+    # Assert: The least recently used item was evicted
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_items() -> None:
+    # Arrange: Cache an item for a very short time
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+
+    # Act: Wait for the item to expire
+    time.sleep(0.02)
+
+    # Assert: The item is gone
+    assert cache.get("a") is None
+
+
+def test_entry_fingerprint_ignores_volatile_fields() -> None:
+    # Arrange: Same entry, reformatted and with a different set of extra fields
+    entry = {"title": "Pepper X", "link": "https://example.com/a", "id": "a"}
+    refetched = {
+        "comments": "https://example.com/a#comments",
+        "link": "https://example.com/a",
+        "title": "  Pepper\n X ",
+        "id": "a",
+    }
+
+    # Act: Fingerprint both versions, and one with a changed title
+    fingerprint = get_entry_fingerprint(entry)
+    refetched_fingerprint = get_entry_fingerprint(refetched)
+    changed_fingerprint = get_entry_fingerprint({**entry, "title": "Pepper Y"})
+
+    # Assert: Only meaningful changes change the fingerprint, which fits in a BIGINT
+    assert fingerprint == refetched_fingerprint
+    assert fingerprint != changed_fingerprint
+    assert -(2**63) <= fingerprint < 2**63
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import feedparser
+import httpx
+from sqlmodel import Session
+
+from api.models import Feed
+from api.services import websub_service
+from background import websub
+from background.parsing import StreamLimits, parse_feed_stream
+from config import get_settings
+
+WEBSUB_RSS = b"""<?xml version="1.0"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+  <channel>
+    <title>Pushed</title>
+    <link>http://feed.test/</link>
+    <atom:link rel="hub" href="http://hub.test/"/>
+    <atom:link rel="self" href="http://feed.test/rss" type="application/rss+xml"/>
+    <item><guid>1</guid><title>First</title></item>
+  </channel>
+</rss>"""
+
+
+def test_hub_is_detected_by_both_parsers() -> None:
+    # Arrange: Feed document as read by feedparser and by the streaming parser
+    limits = StreamLimits(max_bytes=1024 * 1024, max_entries=100, stop_after_known=0)
+    feed_dicts = [
+        feedparser.parse(WEBSUB_RSS).feed,
+        parse_feed_stream(WEBSUB_RSS, limits).feed,
+    ]
+
+    for feed_dict in feed_dicts:
+        # Act: Keep the links of a feed fetched from another URL than its own
+        feed = Feed(url="http://mirror.test/rss")
+        websub.update_hub(feed, feed_dict)
+
+        # Assert: Hub is known by the advertised self URL, and needs a subscription
+        assert feed.websub_hub == "http://hub.test/"
+        assert feed.websub_topic == "http://feed.test/rss"
+        assert websub.needs_subscription(feed, datetime.now())
+
+
+def test_subscription_and_push_through_stand_in_hub(
+    session: Session, rss_base: bytes
+) -> None:
+    # Arrange: Feed with a requested subscription, and a hub that verifies requests
+    # against our callback before accepting them
+    feed = Feed(
+        url="whatever",
+        websub_hub="http://hub.test/",
+        websub_topic="http://feed.test/rss",
+        websub_secret=websub.create_secret(),
+        websub_requested_at=datetime.now(),
+    )
+    session.add(feed)
+    session.flush()
+    token = websub.get_callback_token(feed.websub_secret)  # type: ignore
+    lease_seconds = 2 * 24 * 60 * 60
+    subscriptions = {}
+
+    def hub(request: httpx.Request) -> httpx.Response:
+        form = {k: v[0] for k, v in parse_qs(request.content.decode()).items()}
+        callback_query = parse_qs(urlsplit(form["hub.callback"]).query)
+        verified = websub_service.verify_intent(
+            session,
+            feed.uuid,
+            form["hub.mode"],
+            form["hub.topic"],
+            callback_query["token"][0],
+            int(form["hub.lease_seconds"]),
+        )
+        if not verified:
+            return httpx.Response(400)
+        subscriptions[form["hub.topic"]] = form["hub.secret"]
+        return httpx.Response(202)
+
+    # Act: Subscribe, then have the hub push a signed and a forged body
+    with httpx.Client(transport=httpx.MockTransport(hub)) as client:
+        websub.request_subscription(
+            client,
+            "http://hub.test/",
+            "http://feed.test/rss",
+            f"http://api.test/websub/{feed.uuid}?token={token}",
+            feed.websub_secret,  # type: ignore
+            lease_seconds,
+        )
+    secret = subscriptions["http://feed.test/rss"]
+    forged = websub_service.store_pushed_content(
+        session, feed.uuid, rss_base, websub.sign_payload("guessed", rss_base)
+    )
+    written = websub_service.store_pushed_content(
+        session, feed.uuid, rss_base, websub.sign_payload(secret, rss_base, "sha1")
+    )
+
+    # Assert: Feed is pushed for the lease, and only the signed content is stored
+    lease_end = datetime.now() + timedelta(seconds=lease_seconds)
+    assert feed.is_pushed
+    assert feed.websub_expires_at <= lease_end  # type: ignore
+    assert not websub.needs_subscription(feed, datetime.now())
+    assert not websub_service.verify_intent(
+        session, feed.uuid, "subscribe", "http://feed.test/rss", token
+    )
+    assert forged == 0
+    assert written == len(feedparser.parse(rss_base).entries)
+
+
+def test_verify_intent_refuses_requests_we_did_not_make(session: Session) -> None:
+    # Arrange: Feed with a requested subscription
+    feed = Feed(
+        url="whatever",
+        websub_hub="http://hub.test/",
+        websub_topic="http://feed.test/rss",
+        websub_secret=websub.create_secret(),
+        websub_requested_at=datetime.now(),
+    )
+    session.add(feed)
+    session.flush()
+    token = websub.get_callback_token(feed.websub_secret)  # type: ignore
+    topic = "http://feed.test/rss"
+
+    # Act & Assert: Other topics, unsubscribing the current one, and requests without
+    # the callback's token are refused
+    assert not websub_service.verify_intent(
+        session, feed.uuid, "subscribe", "http://other.test/rss", token
+    )
+    assert not websub_service.verify_intent(session, feed.uuid, "subscribe", topic, "")
+    assert not websub_service.verify_intent(session, feed.uuid, "denied", topic, "")
+    assert not websub_service.verify_intent(
+        session, feed.uuid, "unsubscribe", topic, ""
+    )
+    assert websub_service.verify_intent(
+        session, feed.uuid, "unsubscribe", "http://other.test/rss", ""
+    )
+
+    # Once the hub confirmed the request, it can't be confirmed again
+    assert websub_service.verify_intent(session, feed.uuid, "subscribe", topic, token)
+    assert not websub_service.verify_intent(
+        session, feed.uuid, "subscribe", topic, token
+    )
+
+
+def test_verify_intent_caps_the_lease_granted_by_the_hub(session: Session) -> None:
+    # Arrange: Feed with a requested subscription
+    feed = Feed(
+        url="whatever",
+        websub_hub="http://hub.test/",
+        websub_topic="http://feed.test/rss",
+        websub_secret=websub.create_secret(),
+        websub_requested_at=datetime.now(),
+    )
+    session.add(feed)
+    session.flush()
+    token = websub.get_callback_token(feed.websub_secret)  # type: ignore
+
+    # Act: Confirm with a lease far beyond the one requested
+    verified = websub_service.verify_intent(
+        session, feed.uuid, "subscribe", "http://feed.test/rss", token, 10**12
+    )
+
+    # Assert: The subscription lasts for the lease we request
+    max_lease = timedelta(seconds=get_settings().WEBSUB_LEASE_SECONDS)
+    assert verified
+    assert feed.websub_expires_at <= datetime.now() + max_lease  # type: ignore
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from api.models import WrittenEntry
+from cache import redis_client
+from config import get_settings
+
+# Personal timelines keep the followed-only listing of each user in a Redis sorted set,
+# capped to the newest TIMELINE_SIZE entries. Members are "<entry>:<feed>:<created>"
+# so that a feed's entries can be pruned on unfollow and listed rows hydrated by
+# primary key, scores are sync dates in microseconds, which doubles hold exactly.
+#
+# The floor key next to it tells that the timeline is built: entries scored at or
+# below the floor may be missing, none are if it is 0. Refreshes only push to built
+# timelines, and the first listing after a timeline expired builds it again from the
+# database, which also bounds how long a lost push goes unnoticed.
+
+# Value of the floor key while a listing loads the timeline from the database
+BUILDING = "building"
+BUILD_TIMEOUT_SECONDS = 60
+
+# Timelines of a feed's followers pushed to per round-trip
+PUSH_BATCH_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+# Adds entries to a built timeline, caps it and raises the floor to the entries it
+# dropped. While a build is running entries are only added, the build then caps the
+# timeline once with the entries it loaded and starts the TTL of both keys.
+# KEYS: timeline, floor. ARGV: size, minimum floor, TTL to finish a build with or 0,
+# then score and member pairs. Requires Redis 6.2 for ZADD GT.
+PUSH_SCRIPT = redis_client.register_script(
+    """
+local current = redis.call('GET', KEYS[2])
+if not current then
+    return 0
+end
+if #ARGV > 3 then
+    redis.call('ZADD', KEYS[1], 'GT', unpack(ARGV, 4))
+end
+
+local building = current == 'building'
+local finishing = tonumber(ARGV[3]) > 0
+if building and not finishing then
+    redis.call('PEXPIRE', KEYS[1], redis.call('PTTL', KEYS[2]))
+    return 1
+end
+
+local floor = ARGV[2]
+if not building and tonumber(current) > tonumber(floor) then
+    floor = current
+end
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if excess > 0 then
+    local dropped = redis.call('ZRANGE', KEYS[1], excess - 1, excess - 1, 'WITHSCORES')
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    if tonumber(dropped[2]) > tonumber(floor) then
+        floor = dropped[2]
+    end
+end
+
+if finishing then
+    redis.call('SET', KEYS[2], floor, 'EX', ARGV[3])
+else
+    redis.call('SET', KEYS[2], floor, 'KEEPTTL')
+end
+redis.call('PEXPIRE', KEYS[1], redis.call('PTTL', KEYS[2]))
+return 1
+"""
+)
+
+
+def get_timeline_key(user_id: UUID) -> str:
+    return f"user:{user_id}:timeline"
+
+
+def get_floor_key(user_id: UUID) -> str:
+    return f"user:{user_id}:timeline:floor"
+
+
+def get_score(date: datetime) -> int:
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_score(value: bytes | str | float) -> int:
+    return int(float(value))
+
+
+def get_member(entry: WrittenEntry) -> str:
+    return f"{entry.uuid}:{entry.feed_id}:{get_score(entry.created_at)}"
+
+
+def parse_member(member: bytes) -> Tuple[UUID, UUID, datetime]:
+    """Entry ID, feed ID and creation date of a timeline member"""
+    entry_id, feed_id, created_at = member.decode().split(":")
+    return (
+        UUID(entry_id),
+        UUID(feed_id),
+        EPOCH + timedelta(microseconds=int(created_at)),
+    )
+
+
+def push_entries(
+    user_ids: Sequence[UUID],
+    entries: Sequence[WrittenEntry],
+    complete: bool = True,
+    ttl: int = 0,
+) -> None:
+    """
+    Add entries to the timelines of the given users, skipping the ones not built.
+
+    Args:
+        user_ids (Sequence[UUID]): Users whose timeline gets the entries.
+        entries (Sequence[WrittenEntry]): Entries to add.
+        complete (bool): False if the entries are the newest ones of a larger set,
+            sorted newest first, that may have more as recent as the last one.
+        ttl (int): Finish the build of the timeline, which expires after that long.
+    """
+    min_floor = 0 if complete or not entries else get_score(entries[-1].updated_at)
+    args: List[str | int] = [get_settings().TIMELINE_SIZE, min_floor, ttl]
+    for entry in entries:
+        args.extend((get_score(entry.updated_at), get_member(entry)))
+
+    for i in range(0, len(user_ids), PUSH_BATCH_SIZE):
+        pipeline = redis_client.pipeline(transaction=False)
+        for user_id in user_ids[i : i + PUSH_BATCH_SIZE]:
+            PUSH_SCRIPT(
+                keys=[get_timeline_key(user_id), get_floor_key(user_id)],
+                args=args,
+                client=pipeline,
+            )
+        pipeline.execute()
+
+
+def get_floor(user_id: UUID) -> Optional[str]:
+    """Floor of a timeline, BUILDING while it is being built, None if it is not built"""
+    floor = redis_client.get(get_floor_key(user_id))
+    return floor.decode() if floor is not None else None
+
+
+def start_build(user_id: UUID) -> bool:
+    """Claim the build of a timeline, False if another listing is already building it"""
+    return bool(
+        redis_client.set(
+            get_floor_key(user_id), BUILDING, nx=True, ex=BUILD_TIMEOUT_SECONDS
+        )
+    )
+
+
+def finish_build(user_id: UUID, entries: Sequence[WrittenEntry], complete: bool) -> None:
+    """Add the entries loaded by a build, newest first, and make the timeline available"""
+    push_entries([user_id], entries, complete, get_settings().TIMELINE_TTL_SECONDS)
+
+
+def read_timeline(
+    user_id: UUID, max_score: int | str, min_score: int | str, start: int, count: int
+) -> List[Tuple[bytes, int]]:
+    """Members of a timeline between two scores, newest first, with their score"""
+    return redis_client.zrevrangebyscore(
+        get_timeline_key(user_id),
+        max_score,
+        min_score,
+        start=start,
+        num=count,
+        withscores=True,
+        score_cast_func=parse_score,
+    )
+
+
+def prune_feed(user_id: UUID, feed_id: UUID) -> None:
+    """Remove the entries of a feed from a timeline"""
+    key = get_timeline_key(user_id)
+    members = [
+        member
+        for member in redis_client.zrange(key, 0, -1)
+        if parse_member(member)[1] == feed_id
+    ]
+    if members:
+        redis_client.zrem(key, *members)
+
+
+def delete_timelines(user_ids: Sequence[UUID]) -> None:
+    """Drop timelines, which the next listing of each user builds again"""
+    for i in range(0, len(user_ids), PUSH_BATCH_SIZE):
+        keys = []
+        for user_id in user_ids[i : i + PUSH_BATCH_SIZE]:
+            keys.extend((get_timeline_key(user_id), get_floor_key(user_id)))
+        redis_client.delete(*keys)